@@ -254,7 +254,9 @@ Further Details:
 		"""Performs the checking of CSRF tokens. This check is skipped for the 
 		GET, HEAD, OPTIONS and TRACE methods within HTTP, and is also skipped
 		for any function that has been added to _exempt_views by use of the
-		disable_csrf_check decorator."""
+		disable_csrf_check decorator. The token may be sent in the
+		X-CSRFP-Token header instead of the form, which lets views stream
+		the request body (e.g. uploads) rather than having it parsed here."""
 
 		## Throw away requests with methods we don't support
 		if request.method not in ('GET', 'HEAD', 'POST'):
@@ -273,7 +275,12 @@ Further Details:
 				if not view_location in self._exempt_views:
 					token = session.get('_csrfp_token')
 
-					if not token or token != request.form.get('_csrfp_token'):
+					## Prefer the header so we don't parse the body if we don't have to
+					supplied = request.headers.get('X-CSRFP-Token',None)
+					if supplied is None:
+						supplied = request.form.get('_csrfp_token')
+
+					if not token or token != supplied:
 						if 'username' in session:
 							self.logger.warning('CSRF Protection alert: %s failed to present a valid POST token', session['username'])
 						else:
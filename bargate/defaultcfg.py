@@ -44,10 +44,50 @@ ENCRYPT_KEY = ''
 ## The 'workgroup' that SMBC should use for auth
 SMB_WORKGROUP = 'MSHOME'
 
+## SMB connection pooling
+# Keep libsmbclient contexts (and thus their connections to the file server)
+# open between requests rather than reconnecting on every request. Contexts
+# are kept per user, server and share. SMB_CONTEXT_POOL_SIZE is the maximum
+# number of idle contexts kept per worker process and idle contexts are closed
+# after SMB_CONTEXT_POOL_IDLE_TIMEOUT seconds.
+SMB_CONTEXT_POOL              = True
+SMB_CONTEXT_POOL_SIZE         = 64
+SMB_CONTEXT_POOL_IDLE_TIMEOUT = 300
+
+## Directory listing cache
+# Directory listings are cached per user for LISTING_CACHE_TTL seconds so that
+# navigating back and forth between folders doesn't re-read them from the file
+# server. Listings are invalidated when a user changes a directory via bargate
+# (upload, rename, copy, mkdir or delete). LISTING_CACHE_SIZE is the maximum
+# number of listings kept per worker process. Each worker has its own cache,
+# so invalidations reach the other workers through a generation counter per
+# directory in redis. Listings aren't cached without redis (REDIS_ENABLED is
+# False, or redis is down) as workers couldn't tell each other about changes.
+# Changes made other than via bargate show up after at most LISTING_CACHE_TTL
+# seconds.
+LISTING_CACHE      = True
+LISTING_CACHE_TTL  = 30
+LISTING_CACHE_SIZE = 128
+
+## Number of files to stat() in parallel when listing a directory. Each thread
+## uses its own connection to the file server. This can be overridden for an
+## individual share with the 'stat_concurrency' option in the shares config.
+SMB_STAT_CONCURRENCY = 8
+
+## Directory listings are sent to the browser in pages of BROWSE_PAGE_SIZE
+## entries, with further pages loaded as the user scrolls. BROWSE_PAGE_SIZE_MAX
+## is the largest page size a client may ask for.
+BROWSE_PAGE_SIZE     = 500
+BROWSE_PAGE_SIZE_MAX = 2000
+
 ## Maximum file upload size
 # 256MB by default
 MAX_CONTENT_LENGTH = 256 * 1024 * 1024
 
+## Uploaded files are written to the file server as they are received, in
+# blocks of this many bytes
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+
 ## File 'types' we don't allow people to upload
 BANNED_EXTENSIONS = set([
 "ade", "adp", "bat", "chm", "cmd", "com", "cpl", "exe",
@@ -56,6 +96,19 @@ BANNED_EXTENSIONS = set([
 "vbs", "vxd", "wsc", "wsf", "wsh"
 ])
 
+## Allow directories (and multiple selected items) to be downloaded as a ZIP
+# file. The archive is created as it is sent, files are deflated at
+# ZIP_COMPRESS_LEVEL unless they have one of ZIP_STORE_EXTENSIONS (i.e. they
+# are already compressed) in which case they are stored as-is.
+ZIP_DOWNLOAD = True
+ZIP_COMPRESS_LEVEL = 6
+ZIP_STORE_EXTENSIONS = set([
+"jpg", "jpeg", "png", "gif", "webp", "mp3", "m4a", "aac", "ogg", "wma",
+"mp4", "m4v", "mov", "avi", "mkv", "wmv", "webm", "zip", "gz", "tgz",
+"bz2", "xz", "7z", "rar", "cab", "jar", "docx", "xlsx", "pptx", "odt",
+"ods", "odp"
+])
+
 ## File logging
 FILE_LOG=True
 LOG_FILE='bargate.log'
@@ -74,6 +127,15 @@ REDIS_ENABLED=True
 REDIS_HOST='localhost'
 REDIS_PORT=6379
 
+## Each worker process shares one pool of redis connections. Redis commands
+## give up after REDIS_SOCKET_TIMEOUT seconds. If redis can't be reached
+## REDIS_BREAKER_THRESHOLD times in a row Bargate stops trying it for
+## REDIS_BREAKER_COOLDOWN seconds, and in the meantime uses the default
+## settings from this file and doesn't record user activity.
+REDIS_SOCKET_TIMEOUT=1
+REDIS_BREAKER_THRESHOLD=3
+REDIS_BREAKER_COOLDOWN=30
+
 ## Disable the application or not
 # Default to true if no config file to make sure a config file has been found.
 DISABLE_APP=True
@@ -143,12 +205,82 @@ TOTP_IDENT   = 'bargate'
 ## REMEMBER_ME_ENABLED - "Remember me on this computer" enabled or not.
 REMEMBER_ME_ENABLED = True
 
+## Downloads
+# Files are read from the file server in blocks of DOWNLOAD_BLOCK_SIZE bytes.
+# Reading is done on a separate thread which reads up to DOWNLOAD_READ_AHEAD
+# blocks ahead of what has been sent to the client, so that reading from the
+# file server and sending to the client happen at the same time. Set
+# DOWNLOAD_READ_AHEAD to 0 to read and send one block at a time instead.
+DOWNLOAD_BLOCK_SIZE = 1024 * 1024
+DOWNLOAD_READ_AHEAD = 2
+
+## Copying files
+# Files are copied in blocks of COPY_BLOCK_SIZE bytes, reading ahead on another
+# thread. Copies run in the background: the request waits up to COPY_WAIT
+# seconds for the copy to finish before telling the user it is continuing in
+# the background.
+COPY_BLOCK_SIZE  = 4 * 1024 * 1024
+COPY_WAIT        = 20
+
 ## Image previews
 IMAGE_PREVIEW=True
 
 ## Max image preview size in bytes
 IMAGE_PREVIEW_MAX_SIZE=30*1024*1024
 
+## The sizes (in pixels, the longest side) of image previews that can be asked
+# for. The grid shows 'small' (or 'medium' on high-DPI screens).
+IMAGE_PREVIEW_SIZES={'small': 200, 'medium': 400, 'large': 800}
+
+## View images as a copy scaled down to fit the user's screen rather than
+# sending the (often very large) original, for images up to IMAGE_VIEW_MAX_SIZE
+# bytes. The screen size is rounded up to one of IMAGE_VIEW_SIZES so that
+# copies can be cached and shared. The original is linked to from the page.
+IMAGE_VIEW=True
+IMAGE_VIEW_MAX_SIZE=64*1024*1024
+IMAGE_VIEW_SIZES=[800, 1280, 1920, 2560, 3840]
+
+## Send previews as WebP (which is smaller) to browsers which support it, if
+# Pillow was built with WebP support
+IMAGE_PREVIEW_WEBP=True
+IMAGE_PREVIEW_WEBP_QUALITY=80
+
+## Use the thumbnail embedded in JPEG and TIFF files' EXIF data, if it is in
+# the first 64KB of the file, rather than reading and decoding the whole image.
+# Embedded thumbnails smaller than IMAGE_PREVIEW_EXIF_MIN_SIZE pixels (on their
+# longest side) are ignored.
+IMAGE_PREVIEW_EXIF=True
+IMAGE_PREVIEW_EXIF_MIN_SIZE=120
+
+## Grid view asks for previews in batches: at most IMAGE_PREVIEW_BATCH_MAX
+# files per request, read by up to IMAGE_PREVIEW_BATCH_CONCURRENCY threads
+IMAGE_PREVIEW_BATCH_MAX=50
+IMAGE_PREVIEW_BATCH_CONCURRENCY=4
+
+## Create and cache thumbnails in the background as soon as a directory is
+# browsed in grid view, using THUMBNAIL_PREWARM_WORKERS threads per worker
+# process. Up to THUMBNAIL_PREWARM_MAX images per directory are queued (in the
+# order they are shown), and no more than THUMBNAIL_PREWARM_QUEUE in total.
+THUMBNAIL_PREWARM=False
+THUMBNAIL_PREWARM_WORKERS=2
+THUMBNAIL_PREWARM_MAX=500
+THUMBNAIL_PREWARM_QUEUE=5000
+
+## How many image previews each worker process will decode at the same time
+IMAGE_PREVIEW_CONCURRENCY=4
+
+## Log roughly how much memory each image preview used (to help size workers)
+IMAGE_PREVIEW_LOG_MEMORY=False
+
+## Image preview thumbnails are cached on local disk in THUMBNAIL_CACHE_DIR,
+# the least recently used are deleted when there are more than
+# THUMBNAIL_CACHE_SIZE bytes of them. The directory is created with mode 0700
+# if it doesn't exist. If it does it must be owned by the user Bargate runs
+# as, otherwise thumbnails aren't cached.
+THUMBNAIL_CACHE=True
+THUMBNAIL_CACHE_DIR='/var/lib/bargate/thumbnails'
+THUMBNAIL_CACHE_SIZE=512*1024*1024
+
 ## Should bargate attempt to use winbind to resolve a SID to a name?
 WBINFO_LOOKUP=False
 WBINFO_BINARY='/usr/bin/wbinfo'
@@ -158,3 +290,63 @@ SEARCH_ENABLED=False
 
 ## Maximum time to search for before giving up and returning results
 SEARCH_TIMEOUT=50
+
+## Number of directories to list in parallel when searching. Each thread uses
+## its own connection to the file server. Set to 1 to search one directory at
+## a time.
+SEARCH_CONCURRENCY=4
+
+## Send search results to the browser as they are found rather than when the
+## search has finished. Streamed searches can run for up to SEARCH_STREAM_TIMEOUT
+## seconds (the user can stop them sooner) and report how many folders have
+## been searched every SEARCH_STREAM_PROGRESS_INTERVAL seconds.
+SEARCH_STREAM=True
+SEARCH_STREAM_TIMEOUT=300
+SEARCH_STREAM_PROGRESS_INTERVAL=0.5
+
+## Searches are saved for SEARCH_RESUME_TTL seconds, in redis if it is enabled,
+## so that a search which ran out of time can be carried on from where it
+## stopped with the link to more results. Repeating a search starts it again.
+## Without redis up to SEARCH_RESUME_CACHE_SIZE searches are kept in each
+## worker process. Searches with more than SEARCH_RESUME_MAX_RESULTS results
+## aren't saved.
+SEARCH_RESUME_TTL=600
+SEARCH_RESUME_CACHE_SIZE=64
+SEARCH_RESUME_MAX_RESULTS=5000
+
+## Let users search every share in the shares config at once (apart from those
+## with 'search = false'). Each share is searched from its root with
+## SEARCH_ALL_SHARES_CONCURRENCY threads, and all of them stop at the same
+## SEARCH_TIMEOUT (or SEARCH_STREAM_TIMEOUT) deadline.
+SEARCH_ALL_SHARES=True
+SEARCH_ALL_SHARES_CONCURRENCY=2
+
+## Keep an index of file names on the shares which have 'index = true' in the
+## shares config, so they can be searched without walking the file server. The
+## shares are crawled every INDEX_INTERVAL seconds by a background thread using
+## the INDEX_USERNAME account, which must be able to read all of each share.
+## Search results are still checked against the user's own permissions.
+## The index database and the crawler's lock file are kept in INDEX_DIR, which
+## is created with mode 0700 if it doesn't exist. If it does it must be owned
+## by the user Bargate runs as.
+INDEX_ENABLED=False
+INDEX_DIR='/var/lib/bargate/index'
+INDEX_INTERVAL=3600
+INDEX_USERNAME=''
+INDEX_PASSWORD=''
+
+## Maximum number of matches to take from the index for one search
+INDEX_SEARCH_MAX_RESULTS=1000
+
+## Also index the text of the documents (plain text, Office and OpenDocument
+## files) on indexed shares which have 'contents = true' in the shares config,
+## so that users can search the contents of files. This needs SQLite with
+## FTS5. Documents bigger than CONTENT_INDEX_MAX_FILE_SIZE bytes aren't read,
+## at most CONTENT_INDEX_MAX_TEXT characters of text are kept from each one,
+## and it is stored in chunks of CONTENT_INDEX_CHUNK_SIZE characters. PDF
+## files are indexed too if CONTENT_INDEX_PDF is set, which needs PyPDF2.
+CONTENT_INDEX_ENABLED=False
+CONTENT_INDEX_MAX_FILE_SIZE=20971520
+CONTENT_INDEX_MAX_TEXT=1048576
+CONTENT_INDEX_CHUNK_SIZE=16384
+CONTENT_INDEX_PDF=False
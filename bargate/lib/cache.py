@@ -0,0 +1,77 @@
+#!/usr/bin/python
+#
+# This file is part of Bargate.
+#
+# Bargate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bargate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bargate.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import threading
+import collections
+
+################################################################################
+
+class LRUCache(object):
+	"""A simple thread safe in-memory cache. Items expire ttl seconds after
+	they were stored and the least recently used item is dropped when more
+	than max_size items are stored. Setting either max_size or ttl to 0
+	disables the cache.
+	"""
+
+	def __init__(self,max_size,ttl):
+		self.max_size = max_size
+		self.ttl      = ttl
+		self.lock     = threading.Lock()
+		self.data     = collections.OrderedDict()
+
+	def get(self,key,default=None):
+		with self.lock:
+			item = self.data.pop(key,None)
+
+			if item is None:
+				return default
+
+			(expires, value) = item
+			if expires < time.time():
+				return default
+
+			## Move the item to the most recently used end
+			self.data[key] = item
+			return value
+
+	def set(self,key,value):
+		if self.max_size <= 0 or self.ttl <= 0:
+			return
+
+		with self.lock:
+			self.data.pop(key,None)
+			self.data[key] = (time.time() + self.ttl, value)
+
+			while len(self.data) > self.max_size:
+				self.data.popitem(last=False)
+
+	def delete(self,key):
+		with self.lock:
+			self.data.pop(key,None)
+
+	def invalidate(self,match):
+		"""Removes every item whose key the function match returns True for"""
+
+		with self.lock:
+			for key in list(self.data.keys()):
+				if match(key):
+					del self.data[key]
+
+	def clear(self):
+		with self.lock:
+			self.data.clear()
@@ -0,0 +1,184 @@
+#!/usr/bin/python
+#
+# This file is part of Bargate.
+#
+# Bargate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bargate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bargate.  If not, see <http://www.gnu.org/licenses/>.
+
+## copyjob.py
+# Copies files on the file server. The copy runs on a background thread so that
+# copying a large file doesn't hold the HTTP request open until it times out,
+# and the number of bytes copied so far can be reported to the user when the
+# request stops waiting for it. If a copy fails the incomplete destination file
+# is deleted, and if the request had stopped waiting the user is told on their
+# next request (see failures()).
+
+from bargate import app
+import bargate.lib.pool
+import bargate.lib.download
+import bargate.lib.redisconn
+import os
+import time
+import threading
+import traceback
+import urllib
+
+## Failure messages by username when redis isn't enabled (or is down)
+local_failures = {}
+local_failures_lock = threading.Lock()
+
+## How long failure messages are kept in redis for
+FAILURE_TTL = 86400
+
+################################################################################
+
+def report_failure(username,message):
+	"""Keeps a message about a failed background copy to show to the user on
+	their next request. Can be called outside of a request."""
+
+	if bargate.lib.redisconn.available():
+		try:
+			p = bargate.lib.redisconn.client.pipeline()
+			p.rpush('user:' + username + ':copyfailures',message)
+			p.expire('user:' + username + ':copyfailures',FAILURE_TTL)
+			p.execute()
+			return
+		except Exception as ex:
+			app.logger.warning("Could not save copy failure message: " + str(type(ex)) + " " + str(ex))
+
+	with local_failures_lock:
+		local_failures.setdefault(username,[]).append(message)
+
+def failures(username):
+	"""Returns (and forgets) the messages about the user's failed background
+	copies. Without redis only the failures seen by this worker process are
+	returned."""
+
+	with local_failures_lock:
+		messages = local_failures.pop(username,[])
+
+	if bargate.lib.redisconn.available():
+		try:
+			p = bargate.lib.redisconn.client.pipeline()
+			p.lrange('user:' + username + ':copyfailures',0,-1)
+			p.delete('user:' + username + ':copyfailures')
+			messages = p.execute()[0] + messages
+		except Exception as ex:
+			app.logger.warning("Could not load copy failure messages: " + str(type(ex)) + " " + str(ex))
+
+	return messages
+
+################################################################################
+
+class CopyJob(object):
+	"""Copies the file source_uri to dest_uri. Both files are opened when the
+	job is created, so any errors opening them are raised to the caller. The
+	data is copied by start()ing the job, which runs it on a thread using its
+	own pooled libsmbclient contexts (one to read, one to write, as contexts
+	cannot be shared between threads). If the copy fails the destination file
+	is deleted. If the failure happens after wait() has given up, a message
+	for the user is left with report_failure.
+	"""
+
+	def __init__(self,key,workgroup,username,password,source_uri,dest_uri,size,on_complete=None):
+		self.username    = username
+		self.dest_uri    = dest_uri
+		self.size        = size
+		self.copied      = 0
+		self.done        = False
+		self.error       = None
+		self.started     = time.time()
+		self.finished    = None
+		self.on_complete = on_complete
+		self.complete    = threading.Event()
+		self.lock        = threading.Lock()
+		self.background  = False
+
+		self.read_pctx  = bargate.lib.pool.contexts.acquire(key,workgroup,username,password)
+		self.write_pctx = bargate.lib.pool.contexts.acquire(key,workgroup,username,password)
+
+		try:
+			self.source_fh = self.read_pctx.context.open(source_uri)
+			self.dest_fh   = self.write_pctx.context.open(dest_uri, os.O_CREAT | os.O_WRONLY | os.O_TRUNC)
+		except Exception as ex:
+			self._release()
+			raise
+
+	def start(self):
+		thread = threading.Thread(target=self.run)
+		thread.daemon = True
+		thread.start()
+
+	def wait(self,timeout):
+		"""Waits up to timeout seconds for the copy to finish. Returns True if it did."""
+
+		self.complete.wait(timeout)
+
+		## From now on failures have to be reported to the user later
+		with self.lock:
+			if not self.done:
+				self.background = True
+			return self.done
+
+	def run(self):
+		try:
+			## Read ahead (on another thread) in large blocks whilst writing
+			## the previous blocks
+			for buff in bargate.lib.download.read_ahead(self.source_fh,0,self.size,app.config['COPY_BLOCK_SIZE']):
+				self.dest_fh.write(buff)
+				self.copied = self.copied + len(buff)
+
+			self.dest_fh.close()
+			self.source_fh.close()
+
+		except Exception as ex:
+			app.logger.error("Copy to " + self.dest_uri + " failed for user " + self.username + ": " + str(type(ex)) + ": " + str(ex) + traceback.format_exc())
+			self.error = str(ex)
+			self._remove_dest()
+
+		finally:
+			self._release()
+			self.finished = time.time()
+
+			with self.lock:
+				self.done  = True
+				background = self.background
+
+			if background and self.error is not None:
+				name = urllib.unquote(self.dest_uri.rpartition('/')[2])
+				report_failure(self.username,'The copy "' + name + '" could not be created: ' + self.error)
+
+			try:
+				if self.on_complete is not None:
+					self.on_complete()
+			finally:
+				self.complete.set()
+
+	def _remove_dest(self):
+		"""Closes both files and deletes the incomplete destination file"""
+
+		for fh in [self.source_fh, self.dest_fh]:
+			try:
+				fh.close()
+			except Exception as ex:
+				pass
+
+		try:
+			self.write_pctx.context.unlink(self.dest_uri)
+		except Exception as ex:
+			app.logger.error("Could not delete incomplete copy " + self.dest_uri + " for user " + self.username + ": " + str(type(ex)) + ": " + str(ex))
+			self.error = self.error + " (the incomplete copy could not be deleted)"
+
+	def _release(self):
+		bargate.lib.pool.contexts.release(self.read_pctx)
+		bargate.lib.pool.contexts.release(self.write_pctx)
@@ -17,6 +17,8 @@
 
 from bargate import app
 import os
+import stat
+import errno
 import datetime
 import re
 
@@ -144,3 +146,28 @@ def flask_load_session_json(value):
 
 	return json.loads(value, object_hook=object_hook)
 
+################################################################################
+
+def private_directory(path):
+	"""Creates the directory 'path' with mode 0700 if it doesn't exist. Raises
+	an OSError if it can't be created, or if it is a symlink, not a directory
+	or owned by another user - the thumbnail cache and the index keep data
+	from the file servers there, which other local users mustn't read or
+	replace. Group and other permissions are removed if it has any."""
+
+	try:
+		os.makedirs(path,0700)
+	except OSError as ex:
+		if ex.errno != errno.EEXIST:
+			raise
+
+	st = os.lstat(path)
+
+	if not stat.S_ISDIR(st.st_mode):
+		raise OSError(errno.ENOTDIR,"Not a directory",path)
+
+	if st.st_uid != os.getuid():
+		raise OSError(errno.EPERM,"Directory is owned by another user",path)
+
+	if st.st_mode & 0077:
+		os.chmod(path,0700)
@@ -0,0 +1,222 @@
+#!/usr/bin/python
+#
+# This file is part of Bargate.
+#
+# Bargate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bargate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bargate.  If not, see <http://www.gnu.org/licenses/>.
+
+## download.py
+# Sends files from SMB to the browser, including support for HTTP range
+# requests (partial content) so that media can be seeked and downloads resumed
+
+from bargate import app
+from flask import request, Response, stream_with_context
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_range_header, http_date
+import os
+import binascii
+import threading
+import Queue
+
+## The maximum number of ranges we'll serve in a multi-range request. More
+## than this and the whole file is sent instead.
+MAX_RANGES = 32
+
+################################################################################
+
+def read_range(file_object,start,length,block_size=None):
+	"""A generator which reads length bytes starting at start from a pysmbc
+	file object and yields them in blocks of block_size bytes (defaults to
+	DOWNLOAD_BLOCK_SIZE)"""
+
+	if block_size is None:
+		block_size = app.config['DOWNLOAD_BLOCK_SIZE']
+
+	file_object.seek(start)
+	remaining = length
+
+	while remaining > 0:
+		buff = file_object.read(min(block_size,remaining))
+		if not buff:
+			break
+		remaining = remaining - len(buff)
+		yield buff
+
+################################################################################
+
+def read_ahead(file_object,start,length,block_size=None):
+	"""A generator which yields the same blocks as read_range, but reads them
+	from the file server on a separate thread while the previous blocks are
+	being written to the client. Up to DOWNLOAD_READ_AHEAD blocks are buffered
+	so that SMB reads and client writes overlap rather than alternate."""
+
+	if app.config['DOWNLOAD_READ_AHEAD'] <= 0:
+		for buff in read_range(file_object,start,length,block_size):
+			yield buff
+		return
+
+	blocks = Queue.Queue(app.config['DOWNLOAD_READ_AHEAD'])
+	stop   = threading.Event()
+
+	def put(item):
+		## Wait for space in the buffer, unless the client has gone away
+		while not stop.is_set():
+			try:
+				blocks.put(item,timeout=1)
+				return True
+			except Queue.Full:
+				pass
+		return False
+
+	def reader():
+		try:
+			for buff in read_range(file_object,start,length,block_size):
+				if not put(buff):
+					return
+			put(None)
+		except Exception as ex:
+			put(ex)
+
+	thread = threading.Thread(target=reader)
+	thread.daemon = True
+	thread.start()
+
+	try:
+		while True:
+			item = blocks.get()
+			if item is None:
+				break
+			elif isinstance(item,Exception):
+				raise item
+			yield item
+	finally:
+		## Stop the reader (e.g. if the client disconnected) and wait for it so
+		## that the file object is no longer in use when the SMB connection
+		## is returned to the pool
+		stop.set()
+		thread.join()
+
+################################################################################
+
+def get_ranges(size,etag,last_modified):
+	"""Works out which byte ranges of a file of size bytes the client asked for.
+	Returns None if the whole file should be sent, or a list of (start, stop)
+	tuples (stop is exclusive). The list is empty if none of the requested
+	ranges can be satisfied."""
+
+	if 'Range' not in request.headers:
+		return None
+
+	## If-Range means only send the range if the file hasn't changed
+	if_range = request.headers.get('If-Range',None)
+	if if_range is not None and if_range != etag and if_range != last_modified:
+		return None
+
+	rng = parse_range_header(request.headers['Range'])
+
+	## Ignore ranges we can't parse or don't understand
+	if rng is None or rng.units != 'bytes':
+		return None
+
+	ranges = []
+	for (start, stop) in rng.ranges:
+		if start < 0:
+			## suffix range i.e. the last N bytes
+			start = max(0,size + start)
+			stop  = size
+		elif stop is None or stop > size:
+			stop = size
+
+		if start < stop:
+			ranges.append((start, stop))
+
+	## Merge overlapping or adjacent ranges
+	ranges.sort()
+	merged = []
+	for (start, stop) in ranges:
+		if len(merged) > 0 and start <= merged[-1][1]:
+			merged[-1] = (merged[-1][0], max(stop,merged[-1][1]))
+		else:
+			merged.append((start, stop))
+
+	if len(merged) > MAX_RANGES:
+		return None
+
+	return merged
+
+################################################################################
+
+def send_smbc_file(file_object,filename,mtype,size,mtime,as_attachment=True):
+	"""Returns a response which sends an open pysmbc file object to the client.
+	Handles single and multiple byte range requests (206 Partial Content) using
+	the file object's seek(). 'size' and 'mtime' should come from stat() and
+	are used to validate If-Range requests. The response is streamed within
+	the request context so the SMB connection is not returned to the pool
+	until the file has been sent.
+	"""
+
+	etag          = '"%x-%x"' % (int(mtime),int(size))
+	last_modified = http_date(int(mtime))
+
+	headers = Headers()
+	headers['Accept-Ranges'] = 'bytes'
+	headers['ETag']          = etag
+	headers['Last-Modified'] = last_modified
+
+	if as_attachment:
+		headers.add('Content-Disposition','attachment',filename=filename)
+
+	ranges = get_ranges(size,etag,last_modified)
+
+	## The whole file
+	if ranges is None:
+		headers['Content-Length'] = str(size)
+		body = read_ahead(file_object,0,size)
+		return Response(stream_with_context(body),200,headers,mimetype=mtype,direct_passthrough=True)
+
+	## None of the ranges requested are within the file
+	if len(ranges) == 0:
+		headers['Content-Range'] = 'bytes */%d' % size
+		return Response('',416,headers)
+
+	## A single range
+	if len(ranges) == 1:
+		(start, stop) = ranges[0]
+		headers['Content-Range']  = 'bytes %d-%d/%d' % (start,stop - 1,size)
+		headers['Content-Length'] = str(stop - start)
+		body = read_ahead(file_object,start,stop - start)
+		return Response(stream_with_context(body),206,headers,mimetype=mtype,direct_passthrough=True)
+
+	## Multiple ranges are sent as multipart/byteranges
+	boundary = binascii.hexlify(os.urandom(16))
+	parts    = []
+	length   = 0
+
+	for (start, stop) in ranges:
+		part_header = '--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n' % (boundary,mtype,start,stop - 1,size)
+		parts.append((part_header, start, stop))
+		length = length + len(part_header) + (stop - start) + 2
+
+	trailer = '--%s--\r\n' % boundary
+	length  = length + len(trailer)
+
+	def multipart_body():
+		for (part_header, start, stop) in parts:
+			yield part_header
+			for buff in read_ahead(file_object,start,stop - start):
+				yield buff
+			yield '\r\n'
+		yield trailer
+
+	headers['Content-Length'] = str(length)
+	return Response(stream_with_context(multipart_body()),206,headers,content_type='multipart/byteranges; boundary=' + boundary,direct_passthrough=True)
@@ -104,6 +104,10 @@ def fatalerr(title=u"fatal error ☹",message="Whilst processing your request an
 
 ################################################################################
 
+## The exceptions smbc_handler has a message for
+SMBC_ERRORS = (smbc.PermissionError, smbc.NoEntryError, smbc.NoSpaceError, smbc.ExistsError,
+	smbc.NotEmptyError, smbc.TimedOutError, smbc.ConnectionRefusedError, RuntimeError)
+
 ## handler for all exceptions generated by pysmbc
 def smbc_handler(exception_object,uri="Unknown",redirect_to=None):
 	"""Handles exceptions generated by pysmbc functions. It currently deals with
@@ -228,3 +232,11 @@ def invalid_path(redirect_to=None):
 def invalid_name(redirect_to=None):
 	"""Returns a template or redirect to return from the view for when a user enters an invalid file name"""
 	return stderr("Invalid file or directory name","The file or directory name you entered is invalid",redirect_to)
+
+def invalid_search(message,redirect_to=None):
+	"""Returns a template or redirect to return from the view for when a user enters a search query which can't be understood"""
+	return stderr("Invalid search",message,redirect_to)
+
+def redis_unavailable(redirect_to=None):
+	"""Returns a template or redirect to return from the view for when something which needs REDIS (settings, bookmarks) is used while REDIS is down"""
+	return stderr("Temporarily unavailable","Your settings and bookmarks can't be loaded or saved right now, please try again in a few minutes.",redirect_to)
@@ -0,0 +1,167 @@
+#!/usr/bin/python
+#
+# This file is part of Bargate.
+#
+# Bargate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bargate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bargate.  If not, see <http://www.gnu.org/licenses/>.
+
+## extract.py
+# Gets the text out of documents for the contents index (see
+# bargate.lib.index): plain text files, Office Open XML (docx, xlsx, pptx),
+# OpenDocument (odt, ods, odp) and, with CONTENT_INDEX_PDF (which needs
+# PyPDF2), PDF. At most max_chars characters are taken from a document, and
+# parts of Office/OpenDocument files which would unzip to more than
+# CONTENT_INDEX_MAX_FILE_SIZE bytes are skipped.
+
+from bargate import app
+import zipfile
+import StringIO
+import re
+import xml.etree.cElementTree as ElementTree
+
+if app.config['CONTENT_INDEX_PDF']:
+	import PyPDF2
+
+TEXT_EXTS  = ['txt', 'text', 'csv', 'tsv', 'md', 'rst', 'log', 'ini', 'cfg', 'conf',
+	'xml', 'html', 'htm', 'json', 'yaml', 'yml', 'tex', 'sql', 'sh', 'bat', 'ps1',
+	'py', 'pl', 'rb', 'php', 'js', 'css', 'c', 'h', 'cpp', 'java', 'cs', 'vb']
+
+## The parts of each type of zipped XML document which hold its text
+ZIPPED_PARTS = {
+	'docx': re.compile(r'^word/(document|footnotes|endnotes|header\d*|footer\d*)\.xml$'),
+	'xlsx': re.compile(r'^xl/sharedStrings\.xml$'),
+	'pptx': re.compile(r'^ppt/(slides/slide|notesSlides/notesSlide)\d+\.xml$'),
+	'odt':  re.compile(r'^content\.xml$'),
+	'ods':  re.compile(r'^content\.xml$'),
+	'odp':  re.compile(r'^content\.xml$'),
+}
+
+## XML elements (by local name) which end a line of text: paragraphs and
+## headings, and shared strings in spreadsheets
+XML_BREAKS = ['p', 'h', 'si']
+
+################################################################################
+
+def extension(name):
+	(base, dot, ext) = name.rpartition('.')
+	if len(dot) == 0:
+		return None
+	return ext.lower()
+
+def supported(name):
+	"""Returns True if text can be extracted from files called 'name'"""
+
+	ext = extension(name)
+
+	if ext == 'pdf':
+		return app.config['CONTENT_INDEX_PDF']
+
+	return ext in TEXT_EXTS or ext in ZIPPED_PARTS
+
+def extract(name,data,max_chars):
+	"""Returns the text (unicode) of the document called 'name' whose contents
+	are the str data, up to max_chars characters of it. Raises an exception
+	if the document can't be read."""
+
+	ext = extension(name)
+
+	if ext in ZIPPED_PARTS:
+		return _extract_zipped(data,ZIPPED_PARTS[ext],max_chars)
+	elif ext == 'pdf':
+		return _extract_pdf(data,max_chars)
+	else:
+		return _extract_text(data,max_chars)
+
+def chunks(text,size):
+	"""Splits text into chunks of at most 'size' characters, breaking at white
+	space where there is some so that words aren't cut in half"""
+
+	result = []
+	while len(text) > size:
+		split = max(text.rfind(u' ',0,size),text.rfind(u'\n',0,size))
+		if split <= 0:
+			split = size
+
+		result.append(text[:split])
+		text = text[split:].lstrip()
+
+	if len(text) > 0:
+		result.append(text)
+
+	return result
+
+################################################################################
+
+def _extract_text(data,max_chars):
+	if data.startswith('\xff\xfe') or data.startswith('\xfe\xff'):
+		return data.decode('utf-16','replace')[:max_chars]
+
+	## UTF-8 needs at most 4 bytes a character
+	data = data[:max_chars * 4]
+	if data.startswith('\xef\xbb\xbf'):
+		data = data[3:]
+
+	try:
+		text = data.decode('utf-8')
+	except UnicodeDecodeError as ex:
+		## A character cut in half at the end is fine, anything else means
+		## it isn't UTF-8, and Windows file servers mostly have cp1252
+		if ex.start >= len(data) - 3:
+			text = data.decode('utf-8','ignore')
+		else:
+			text = data.decode('cp1252','replace')
+
+	return text[:max_chars]
+
+def _extract_zipped(data,parts,max_chars):
+	archive = zipfile.ZipFile(StringIO.StringIO(data))
+	lines   = []
+	length  = 0
+
+	## Slides etc. in order, so slide10 comes after slide9
+	members = [info for info in archive.infolist() if parts.match(info.filename)]
+	members.sort(key=lambda info: [int(part) if part.isdigit() else part for part in re.split(r'(\d+)',info.filename)])
+
+	for info in members:
+		## Don't unzip anything huge
+		if info.file_size > app.config['CONTENT_INDEX_MAX_FILE_SIZE']:
+			continue
+
+		for (event, elem) in ElementTree.iterparse(archive.open(info)):
+			if elem.tag.rpartition('}')[2] in XML_BREAKS:
+				line = u''.join(elem.itertext()).strip()
+				elem.clear()
+
+				if len(line) > 0:
+					lines.append(line)
+					length = length + len(line) + 1
+
+					if length >= max_chars:
+						return u'\n'.join(lines)[:max_chars]
+
+	return u'\n'.join(lines)
+
+def _extract_pdf(data,max_chars):
+	reader = PyPDF2.PdfFileReader(StringIO.StringIO(data),strict=False)
+	pages  = []
+	length = 0
+
+	for idx in range(reader.getNumPages()):
+		page = reader.getPage(idx).extractText()
+		pages.append(page)
+		length = length + len(page) + 1
+
+		if length >= max_chars:
+			break
+
+	return u'\n'.join(pages)[:max_chars]
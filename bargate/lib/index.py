@@ -0,0 +1,654 @@
+#!/usr/bin/python
+#
+# This file is part of Bargate.
+#
+# Bargate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bargate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bargate.  If not, see <http://www.gnu.org/licenses/>.
+
+## index.py
+# A local SQLite index of the names of every file and directory on the shares
+# marked with 'index = true' in the shares config, so that searching them
+# doesn't mean walking the whole tree over SMB. A background thread crawls
+# the shares every INDEX_INTERVAL seconds with the INDEX_USERNAME account.
+# Directories whose modify time hasn't changed since the last crawl aren't
+# listed again, but their files are stat'ed again as changing a file doesn't
+# change the modify time of its directory. The size and modify time of every
+# entry is kept so that size:, after: and before: can be answered from the
+# index too. Names are matched with an FTS5 trigram index where SQLite
+# has one. The index only says where files might be: search results are
+# stat'ed as the user before being shown to them, and documents found by
+# their contents must be readable by them (see bargate.lib.search).
+#
+# With CONTENT_INDEX_ENABLED the text of the documents on shares which also
+# have 'contents = true' is indexed too (see bargate.lib.extract), in an FTS5
+# table of chunks of at most CONTENT_INDEX_CHUNK_SIZE characters. Every
+# directory on these shares is listed on each crawl, because changing a file
+# doesn't change the modify time of its directory, but only files whose size
+# or modify time has changed are read again.
+
+from bargate import app
+import bargate.lib.core
+import bargate.lib.smb
+import bargate.lib.extract
+import smbc
+import sqlite3
+import threading
+import re
+import fcntl
+import os
+import urllib
+import time
+import traceback
+
+################################################################################
+
+SCHEMA = [
+	"CREATE TABLE IF NOT EXISTS dirs (share TEXT, path TEXT, mtime INTEGER, crawled INTEGER, PRIMARY KEY (share, path))",
+	"CREATE TABLE IF NOT EXISTS entries (id INTEGER PRIMARY KEY, share TEXT, parent TEXT, name TEXT, folded TEXT, type TEXT, size INTEGER, mtime INTEGER)",
+	"CREATE INDEX IF NOT EXISTS entries_parent ON entries (share, parent)",
+	"CREATE TABLE IF NOT EXISTS content_files (id INTEGER PRIMARY KEY, share TEXT, parent TEXT, name TEXT, size INTEGER, mtime INTEGER, UNIQUE (share, parent, name))",
+]
+
+## Keeps the trigram index in step with the entries table
+FTS_SCHEMA = [
+	"CREATE VIRTUAL TABLE IF NOT EXISTS names USING fts5(folded, content='entries', content_rowid='id', tokenize='trigram')",
+	"CREATE TRIGGER IF NOT EXISTS entries_ai AFTER INSERT ON entries BEGIN INSERT INTO names (rowid, folded) VALUES (new.id, new.folded); END",
+	"CREATE TRIGGER IF NOT EXISTS entries_ad AFTER DELETE ON entries BEGIN INSERT INTO names (names, rowid, folded) VALUES ('delete', old.id, old.folded); END",
+]
+
+## The text of each document is kept in chunks in 'contents', with rowids
+## from content_files.id * CHUNKS_PER_FILE so a file's chunks can be found
+## (and deleted) without a scan
+CONTENT_SCHEMA = [
+	"CREATE VIRTUAL TABLE IF NOT EXISTS contents USING fts5(body, tokenize='unicode61 remove_diacritics 1')",
+]
+
+CHUNKS_PER_FILE = 4096
+
+## Trigram matching needs at least this many characters
+FTS_MIN_QUERY = 3
+
+################################################################################
+
+def share_enabled(func_name):
+	"""Returns True if the share (shares config section) func_name is indexed"""
+
+	if not app.config['INDEX_ENABLED']:
+		return False
+
+	if func_name not in app.sharesList:
+		return False
+
+	if not app.sharesConfig.has_option(func_name,'index'):
+		return False
+
+	return app.sharesConfig.getboolean(func_name,'index')
+
+def contents_enabled(func_name):
+	"""Returns True if the contents of the documents on the share func_name
+	are indexed"""
+
+	if not app.config['CONTENT_INDEX_ENABLED'] or not share_enabled(func_name):
+		return False
+
+	if not app.sharesConfig.has_option(func_name,'contents'):
+		return False
+
+	return app.sharesConfig.getboolean(func_name,'contents')
+
+## A set of characters in a shell pattern, e.g. [abc] or [!0-9]
+GLOB_SET_RE = re.compile(r'\[!?\]?[^\]]*\]')
+
+def _like_escape(text):
+	return text.replace('\\','\\\\').replace('%','\\%').replace('_','\\_')
+
+################################################################################
+
+class FilenameIndex(object):
+	"""The index database, index.db in 'directory'. Each thread gets its own
+	SQLite connection; SQLite itself deals with more than one process using
+	the database."""
+
+	def __init__(self,directory):
+		self.directory    = directory
+		self.filename     = os.path.join(directory,'index.db')
+		self.local        = threading.local()
+		self.fts          = None
+		self.fts_contents = None
+
+	def private_file(self,name):
+		"""Returns the path of the file 'name' in the index directory, having
+		created it (and the directory, see bargate.lib.core.private_directory)
+		if need be so that only this user can read or write it"""
+
+		bargate.lib.core.private_directory(self.directory)
+
+		path = os.path.join(self.directory,name)
+		os.close(os.open(path,os.O_WRONLY | os.O_CREAT | os.O_NOFOLLOW,0600))
+
+		if os.stat(path).st_mode & 0077:
+			os.chmod(path,0600)
+
+		return path
+
+	def connect(self):
+		db = getattr(self.local,'db',None)
+
+		if db is None:
+			## SQLite gives its journal files the same permissions
+			db = sqlite3.connect(self.private_file('index.db'),timeout=30)
+			for statement in SCHEMA:
+				db.execute(statement)
+
+			## Not every SQLite has FTS5 and its trigram tokenizer
+			if self.fts is None:
+				try:
+					for statement in FTS_SCHEMA:
+						db.execute(statement)
+					self.fts = True
+				except sqlite3.OperationalError as ex:
+					app.logger.info("bargate.lib.index: SQLite can't create a trigram index, searches will scan the index instead: " + str(ex))
+					self.fts = False
+
+			## The contents index only needs FTS5
+			if self.fts_contents is None:
+				try:
+					for statement in CONTENT_SCHEMA:
+						db.execute(statement)
+					self.fts_contents = True
+				except sqlite3.OperationalError as ex:
+					app.logger.info("bargate.lib.index: SQLite doesn't have FTS5, the contents of files won't be indexed: " + str(ex))
+					self.fts_contents = False
+
+			db.commit()
+			self.local.db = db
+
+		return db
+
+	def has_contents(self):
+		"""Returns True if SQLite can index the contents of files"""
+
+		self.connect()
+		return self.fts_contents
+
+	def indexed(self,share,path):
+		"""Returns True if the directory 'path' (unicode, relative to the root
+		of the share) has been crawled"""
+
+		db = self.connect()
+		return db.execute("SELECT 1 FROM dirs WHERE share = ? AND path = ?",(share,path)).fetchone() is not None
+
+	def search(self,share,path,query,limit,exts=None,etype=None,globs=None,offset=0,min_size=None,max_size=None,after=None,before=None):
+		"""Returns up to 'limit' (parent, name, type) tuples, skipping the
+		first 'offset', for the entries below 'path' whose names contain
+		'query' (ignoring case). If exts is given only files with one of those
+		extensions are returned, if etype is given only entries of that type
+		('file' or 'dir'), and if globs (lower case shell patterns) are given
+		only entries whose names match all of them. min_size and max_size
+		(bytes) and after and before (timestamps) narrow the entries down by
+		their size and modify time as of the last crawl."""
+
+		db     = self.connect()
+		folded = query.lower()
+
+		where  = "e.share = ?"
+		params = [share]
+
+		if etype is not None:
+			where  = where + " AND e.type = ?"
+			params = params + [etype]
+
+		## SQLite's GLOB has the same syntax as fnmatch apart from [!...].
+		## Patterns with a '[' which doesn't start a set mean something else
+		## to GLOB, so those are only tested by the caller.
+		for pattern in globs or []:
+			if GLOB_SET_RE.sub('',pattern).find('[') == -1:
+				where  = where + " AND e.folded GLOB ?"
+				params = params + [GLOB_SET_RE.sub(lambda match: match.group(0).replace('[!','[^',1),pattern)]
+
+		if len(path) > 0:
+			where  = where + " AND (e.parent = ? OR e.parent LIKE ? ESCAPE '\\')"
+			params = params + [path, _like_escape(path) + '/%']
+
+		if min_size is not None:
+			where  = where + " AND e.size >= ?"
+			params = params + [min_size]
+
+		if max_size is not None:
+			where  = where + " AND e.size <= ?"
+			params = params + [max_size]
+
+		if after is not None:
+			where  = where + " AND e.mtime >= ?"
+			params = params + [after]
+
+		if before is not None:
+			where  = where + " AND e.mtime < ?"
+			params = params + [before]
+
+		if exts is not None:
+			if len(exts) == 0:
+				return []
+
+			where  = where + " AND e.type = 'file' AND (" + " OR ".join(["e.folded LIKE ? ESCAPE '\\'"] * len(exts)) + ")"
+			params = params + ['%.' + _like_escape(ext) for ext in exts]
+
+		if self.fts and len(folded) >= FTS_MIN_QUERY:
+			sql    = "SELECT e.parent, e.name, e.type FROM names JOIN entries e ON e.id = names.rowid WHERE names MATCH ? AND " + where + " ORDER BY e.id LIMIT ? OFFSET ?"
+			params = ['"' + folded.replace('"','""') + '"'] + params + [limit, offset]
+		else:
+			sql    = "SELECT e.parent, e.name, e.type FROM entries e WHERE e.folded LIKE ? ESCAPE '\\' AND " + where + " ORDER BY e.id LIMIT ? OFFSET ?"
+			params = ['%' + _like_escape(folded) + '%'] + params + [limit, offset]
+
+		return db.execute(sql,params).fetchall()
+
+	def search_contents(self,share,path,text,limit,exts=None,offset=0):
+		"""Returns up to 'limit' (parent, name, type) tuples, skipping the
+		first 'offset', as search() does, for the documents below 'path' which
+		contain the words in 'text' (as a phrase) and, if exts is given, have
+		one of those extensions"""
+
+		db = self.connect()
+
+		if not self.fts_contents:
+			return []
+
+		where  = "f.share = ?"
+		params = [share]
+
+		if len(path) > 0:
+			where  = where + " AND (f.parent = ? OR f.parent LIKE ? ESCAPE '\\')"
+			params = params + [path, _like_escape(path) + '/%']
+
+		if min_size is not None:
+			where  = where + " AND e.size >= ?"
+			params = params + [min_size]
+
+		if max_size is not None:
+			where  = where + " AND e.size <= ?"
+			params = params + [max_size]
+
+		if after is not None:
+			where  = where + " AND e.mtime >= ?"
+			params = params + [after]
+
+		if before is not None:
+			where  = where + " AND e.mtime < ?"
+			params = params + [before]
+
+		if exts is not None:
+			if len(exts) == 0:
+				return []
+
+			where  = where + " AND (" + " OR ".join(["f.name LIKE ? ESCAPE '\\'"] * len(exts)) + ")"
+			params = params + ['%.' + _like_escape(ext) for ext in exts]
+
+		sql    = "SELECT f.parent, f.name, 'file' FROM content_files f WHERE f.id IN (SELECT rowid / " + str(CHUNKS_PER_FILE) + " FROM contents WHERE contents MATCH ?) AND " + where + " ORDER BY f.id LIMIT ? OFFSET ?"
+		params = ['"' + text.replace('"','""') + '"'] + params + [limit, offset]
+
+		return db.execute(sql,params).fetchall()
+
+	def content_files(self,share,path):
+		"""Returns a dictionary of the (size, mtime) the documents in the
+		directory 'path' had when their contents were indexed, by name"""
+
+		rows = self.connect().execute("SELECT name, size, mtime FROM content_files WHERE share = ? AND parent = ?",(share,path)).fetchall()
+		return dict([(row[0], (row[1], row[2])) for row in rows])
+
+	def put_contents(self,share,path,name,size,mtime,chunks):
+		"""Replaces the indexed text of the document 'name' in the directory
+		'path' with chunks, a list of strings"""
+
+		db  = self.connect()
+		row = db.execute("SELECT id FROM content_files WHERE share = ? AND parent = ? AND name = ?",(share,path,name)).fetchone()
+
+		if row is None:
+			file_id = db.execute("INSERT INTO content_files (share, parent, name, size, mtime) VALUES (?, ?, ?, ?, ?)",(share,path,name,size,mtime)).lastrowid
+		else:
+			file_id = row[0]
+			self._delete_chunks([file_id])
+			db.execute("UPDATE content_files SET size = ?, mtime = ? WHERE id = ?",(size,mtime,file_id))
+
+		if self.fts_contents:
+			db.executemany("INSERT INTO contents (rowid, body) VALUES (?, ?)",
+				[(file_id * CHUNKS_PER_FILE + idx, chunk) for (idx, chunk) in enumerate(chunks[:CHUNKS_PER_FILE])])
+
+		db.commit()
+
+	def remove_contents(self,share,path,names):
+		"""Removes the indexed text of the documents 'names' in 'path'"""
+
+		db  = self.connect()
+		ids = []
+		for name in names:
+			row = db.execute("SELECT id FROM content_files WHERE share = ? AND parent = ? AND name = ?",(share,path,name)).fetchone()
+			if row is not None:
+				ids.append(row[0])
+
+		self._delete_chunks(ids)
+		db.executemany("DELETE FROM content_files WHERE id = ?",[(file_id,) for file_id in ids])
+		db.commit()
+
+	def _delete_chunks(self,ids):
+		if self.fts_contents:
+			self.connect().executemany("DELETE FROM contents WHERE rowid >= ? AND rowid < ?",
+				[(file_id * CHUNKS_PER_FILE, (file_id + 1) * CHUNKS_PER_FILE) for file_id in ids])
+
+	def get_dir(self,share,path):
+		"""Returns the modify time a directory had when it was last listed, or
+		None if it hasn't been"""
+
+		row = self.connect().execute("SELECT mtime FROM dirs WHERE share = ? AND path = ?",(share,path)).fetchone()
+		if row is None:
+			return None
+		return row[0]
+
+	def subdirs(self,share,path):
+		"""Returns the names of the directories in 'path' as last listed"""
+
+		rows = self.connect().execute("SELECT name FROM entries WHERE share = ? AND parent = ? AND type = 'dir'",(share,path)).fetchall()
+		return [row[0] for row in rows]
+
+	def files(self,share,path):
+		"""Returns the names of the files in 'path' as last listed"""
+
+		rows = self.connect().execute("SELECT name FROM entries WHERE share = ? AND parent = ? AND type = 'file'",(share,path)).fetchall()
+		return [row[0] for row in rows]
+
+	def put_stats(self,share,path,entries):
+		"""Updates the size and modify time of the entries in 'path' from
+		entries, a list of (name, type, size, mtime) tuples"""
+
+		db = self.connect()
+		db.executemany("UPDATE entries SET size = ?, mtime = ? WHERE share = ? AND parent = ? AND name = ? AND type = ?",
+			[(size,emtime,share,path,name,etype) for (name, etype, size, emtime) in entries])
+		db.commit()
+
+	def put_dir(self,share,path,mtime,entries):
+		"""Replaces the contents of the directory 'path' with entries, a list
+		of (name, type, size, mtime) tuples. Directories which have gone away
+		are removed along with everything beneath them."""
+
+		db = self.connect()
+
+		old = set(self.subdirs(share,path))
+		new = set([entry[0] for entry in entries if entry[1] == 'dir'])
+
+		for name in old - new:
+			self.remove_tree(share,self.join(path,name),commit=False)
+
+		db.execute("DELETE FROM entries WHERE share = ? AND parent = ?",(share,path))
+		db.executemany("INSERT INTO entries (share, parent, name, folded, type, size, mtime) VALUES (?, ?, ?, ?, ?, ?, ?)",
+			[(share,path,name,name.lower(),etype,size,emtime) for (name, etype, size, emtime) in entries])
+		db.execute("INSERT OR REPLACE INTO dirs (share, path, mtime, crawled) VALUES (?, ?, ?, ?)",(share,path,mtime,int(time.time())))
+		db.commit()
+
+	def remove_tree(self,share,path,commit=True):
+		"""Removes a directory and everything beneath it from the index"""
+
+		db   = self.connect()
+		like = _like_escape(path) + '/%'
+
+		db.execute("DELETE FROM entries WHERE share = ? AND (parent = ? OR parent LIKE ? ESCAPE '\\')",(share,path,like))
+		db.execute("DELETE FROM dirs WHERE share = ? AND (path = ? OR path LIKE ? ESCAPE '\\')",(share,path,like))
+
+		ids = [row[0] for row in db.execute("SELECT id FROM content_files WHERE share = ? AND (parent = ? OR parent LIKE ? ESCAPE '\\')",(share,path,like)).fetchall()]
+		self._delete_chunks(ids)
+		db.executemany("DELETE FROM content_files WHERE id = ?",[(file_id,) for file_id in ids])
+
+		if commit:
+			db.commit()
+
+	def join(self,path,name):
+		if len(path) > 0:
+			return path + '/' + name
+		return name
+
+################################################################################
+
+class Crawler(object):
+	"""Crawls the indexed shares in a background thread. The thread is started
+	the first time start() is called. Only one process at a time crawls, using
+	a lock file next to the database, and a crawl is skipped if another
+	process finished one less than 'interval' seconds ago. The lock file is
+	kept in the index directory."""
+
+	def __init__(self,index,interval):
+		self.index    = index
+		self.interval = interval
+		self.lock     = threading.Lock()
+		self.started  = False
+
+	def start(self):
+		if self.started:
+			return
+
+		with self.lock:
+			if self.started:
+				return
+			self.started = True
+
+		thread = threading.Thread(target=self._run)
+		thread.daemon = True
+		thread.start()
+
+	def _run(self):
+		while True:
+			try:
+				lockname = self.index.private_file('crawl.lock')
+				with open(lockname,'a') as lockfile:
+					fcntl.flock(lockfile,fcntl.LOCK_EX)
+					try:
+						## The lock file's modify time is when the last crawl
+						## (by any process) finished
+						if time.time() - os.path.getmtime(lockname) >= self.interval or os.path.getsize(lockname) == 0:
+							self.crawl()
+							if os.path.getsize(lockname) == 0:
+								lockfile.write('.')
+								lockfile.flush()
+							os.utime(lockname,None)
+					finally:
+						fcntl.flock(lockfile,fcntl.LOCK_UN)
+			except Exception as ex:
+				app.logger.error("bargate.lib.index crawl failed: " + str(type(ex)) + ": " + str(ex) + traceback.format_exc())
+
+			time.sleep(self.interval)
+
+	def crawl(self):
+		for share in app.sharesList:
+			if not share_enabled(share):
+				continue
+
+			srv_path = app.sharesConfig.get(share,'path')
+
+			## Per-user shares can't be crawled by one account
+			if '%' in srv_path:
+				app.logger.warn("bargate.lib.index: not indexing share '" + share + "' because its path depends on the user")
+				continue
+
+			if not srv_path.endswith('/'):
+				srv_path = srv_path + '/'
+
+			started = time.time()
+			(listed, skipped, documents) = self.crawl_share(share,srv_path.encode('utf-8'))
+			app.logger.info("bargate.lib.index crawled share '" + share + "' in " + str(int(time.time() - started)) + "s: " + str(listed) + " directories listed, " + str(skipped) + " unchanged, " + str(documents) + " documents read")
+
+	def crawl_share(self,share,srv_path_as_str):
+		"""Walks the share, listing directories which are new or whose modify
+		time has changed. Unchanged directories are not listed again (unless
+		the contents of the share's documents are indexed) but their
+		subdirectories (as last listed) are still checked. Returns the number
+		of directories listed, the number unchanged and the number of
+		documents whose contents were indexed."""
+
+		credentials = (app.config['SMB_WORKGROUP'],app.config['INDEX_USERNAME'],app.config['INDEX_PASSWORD'])
+		libsmbclient = smbc.Context(auth_fn=lambda server,share,workgroup,username,password: credentials)
+
+		contents  = contents_enabled(share) and self.index.has_contents()
+		listed    = 0
+		skipped   = 0
+		documents = 0
+
+		## The paths of the directories still to visit
+		stack   = [u'']
+
+		while len(stack) > 0:
+			path       = stack.pop()
+			uri_as_str = srv_path_as_str + urllib.quote(path.encode('utf-8'))
+
+			try:
+				mtime = libsmbclient.stat(uri_as_str.rstrip('/'))[8]
+			except smbc.NoEntryError:
+				self.index.remove_tree(share,path)
+				continue
+			except Exception as ex:
+				app.logger.warning("bargate.lib.index could not stat " + uri_as_str + ": " + str(type(ex)) + ": " + str(ex))
+				continue
+
+			## Directories get their modify time when they are visited
+			if len(path) > 0:
+				(parent, slash, name) = path.rpartition('/')
+				self.index.put_stats(share,parent,[(name,'dir',None,mtime)])
+
+			unchanged = self.index.get_dir(share,path) == mtime
+
+			if unchanged and not contents:
+				skipped = skipped + 1
+				self.index.put_stats(share,path,self.stat_files(libsmbclient,uri_as_str,self.index.files(share,path)))
+				for name in self.index.subdirs(share,path):
+					stack.append(self.index.join(path,name))
+				continue
+
+			try:
+				dentries = bargate.lib.smb.listDirectory(libsmbclient,uri_as_str)
+			except Exception as ex:
+				app.logger.warning("bargate.lib.index could not list " + uri_as_str + ": " + str(type(ex)) + ": " + str(ex))
+				continue
+
+			entries = []
+			names   = []
+			for dentry in dentries:
+				name = dentry.name
+				if isinstance(name,str):
+					name = name.decode('utf-8')
+
+				if name in ['.','..']:
+					continue
+
+				if dentry.smbc_type == bargate.lib.smb.SMB_FILE:
+					names.append(name)
+				elif dentry.smbc_type == bargate.lib.smb.SMB_DIR:
+					entries.append((name,'dir',None,None))
+					stack.append(self.index.join(path,name))
+
+			## getdents doesn't give the size and modify time of files
+			files   = self.stat_files(libsmbclient,uri_as_str,names)
+			entries = files + entries
+
+			if unchanged:
+				skipped = skipped + 1
+				self.index.put_stats(share,path,files)
+			else:
+				self.index.put_dir(share,path,mtime,entries)
+				listed = listed + 1
+
+			if contents:
+				documents = documents + self.crawl_contents(libsmbclient,share,path,uri_as_str,entries)
+
+		return (listed, skipped, documents)
+
+	def stat_files(self,libsmbclient,uri_as_str,names):
+		"""Stats the files called 'names' in the directory uri_as_str and
+		returns a list of (name, 'file', size, mtime) tuples. The size and
+		modify time are None for files which can't be stat'ed."""
+
+		files = []
+		for name in names:
+			file_uri_as_str = uri_as_str.rstrip('/') + '/' + urllib.quote(name.encode('utf-8'))
+
+			try:
+				fstat = libsmbclient.stat(file_uri_as_str)
+				files.append((name,'file',fstat[6],fstat[8]))
+			except Exception as ex:
+				app.logger.warning("bargate.lib.index could not stat " + file_uri_as_str + ": " + str(type(ex)) + ": " + str(ex))
+				files.append((name,'file',None,None))
+
+		return files
+
+	def crawl_contents(self,libsmbclient,share,path,uri_as_str,entries):
+		"""Indexes the text of the documents in the directory 'path' which are
+		new or whose size or modify time has changed, and forgets those which
+		have gone away. Documents bigger than CONTENT_INDEX_MAX_FILE_SIZE, or
+		which can't be read, are recorded without any text so that they are
+		only tried again once they change. Returns the number of documents
+		indexed."""
+
+		known = self.index.content_files(share,path)
+		names = set([entry[0] for entry in entries if entry[1] == 'file'])
+
+		self.index.remove_contents(share,path,[name for name in known if name not in names])
+
+		indexed = 0
+		for (name, etype, size, mtime) in entries:
+			if etype != 'file' or not bargate.lib.extract.supported(name):
+				continue
+
+			file_uri_as_str = uri_as_str.rstrip('/') + '/' + urllib.quote(name.encode('utf-8'))
+
+			try:
+				if size is None or mtime is None:
+					fstat = libsmbclient.stat(file_uri_as_str)
+					(size, mtime) = (fstat[6], fstat[8])
+			except Exception as ex:
+				app.logger.warning("bargate.lib.index could not stat " + file_uri_as_str + ": " + str(type(ex)) + ": " + str(ex))
+				continue
+
+			if known.get(name) == (size, mtime):
+				continue
+
+			text = u''
+			if size <= app.config['CONTENT_INDEX_MAX_FILE_SIZE']:
+				try:
+					text = bargate.lib.extract.extract(name,self.read(libsmbclient,file_uri_as_str,size),app.config['CONTENT_INDEX_MAX_TEXT'])
+				except Exception as ex:
+					app.logger.info("bargate.lib.index could not get the text of " + file_uri_as_str + ": " + str(type(ex)) + ": " + str(ex))
+
+			self.index.put_contents(share,path,name,size,mtime,bargate.lib.extract.chunks(text,app.config['CONTENT_INDEX_CHUNK_SIZE']))
+			indexed = indexed + 1
+
+		return indexed
+
+	def read(self,libsmbclient,uri_as_str,size):
+		"""Reads a file of 'size' bytes (or fewer, if it has shrunk)"""
+
+		file_object = libsmbclient.open(uri_as_str)
+		data = []
+		left = size
+
+		try:
+			while left > 0:
+				block = file_object.read(min(left,1024 * 1024))
+				if len(block) == 0:
+					break
+
+				data.append(block)
+				left = left - len(block)
+		finally:
+			file_object.close()
+
+		return ''.join(data)
+
+################################################################################
+
+index   = FilenameIndex(app.config['INDEX_DIR'])
+crawler = Crawler(index,app.config['INDEX_INTERVAL'])
@@ -0,0 +1,183 @@
+#!/usr/bin/python
+#
+# This file is part of Bargate.
+#
+# Bargate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bargate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bargate.  If not, see <http://www.gnu.org/licenses/>.
+
+## pool.py
+# A per-worker pool of live libsmbclient contexts. Each context keeps its
+# SMB session and tree connects open between requests so that browse, stat,
+# preview and download requests don't have to reconnect and re-authenticate
+# to the file server every time.
+
+from bargate import app
+import smbc
+import time
+import threading
+import collections
+
+################################################################################
+
+def context_key(username,srv_path):
+	"""Returns the pool key for a user and a server path (smb://server/share/...).
+	Contexts are shared between all paths on the same share for a user.
+	"""
+
+	if srv_path.startswith('smb://'):
+		srv_path = srv_path[6:]
+
+	parts  = srv_path.split('/')
+	server = parts[0].lower()
+
+	if len(parts) > 1:
+		share = parts[1].lower()
+	else:
+		share = ''
+
+	return (username,server,share)
+
+################################################################################
+
+class PooledContext(object):
+	"""A libsmbclient context along with the credentials it authenticates
+	with. The credentials are set each time the context is checked out of the
+	pool so that libsmbclient never has to call back into the Flask session
+	(which means the context can also be used outside of the request thread).
+	"""
+
+	def __init__(self,key):
+		self.key       = key
+		self.workgroup = None
+		self.username  = None
+		self.password  = None
+		self.discard   = False
+		self.last_used = time.time()
+		self.context   = smbc.Context(auth_fn=self.auth)
+
+	def auth(self,server,share,workgroup,username,password):
+		return (self.workgroup,self.username,self.password)
+
+################################################################################
+
+class ContextPool(object):
+	"""A pool of idle libsmbclient contexts keyed by (username, server, share).
+	libsmbclient contexts are not thread safe, so a context is only ever in
+	use by one caller at a time: acquire() removes it from the pool and
+	release() puts it back. Idle contexts are evicted after idle_timeout
+	seconds and the least recently used idle context is dropped when more
+	than max_size are held.
+	"""
+
+	def __init__(self,max_size,idle_timeout):
+		self.max_size     = max_size
+		self.idle_timeout = idle_timeout
+		self.lock         = threading.Lock()
+
+		## key -> list of idle PooledContext objects (most recently used last)
+		self.idle = {}
+
+		## All idle PooledContext objects in least recently used order
+		self.lru = collections.OrderedDict()
+
+		## PooledContext objects currently checked out
+		self.busy = set()
+
+	def acquire(self,key,workgroup,username,password):
+		"""Returns a PooledContext for key, reusing an idle one if possible"""
+
+		pctx = None
+
+		with self.lock:
+			self._evict_idle()
+
+			if self.idle.get(key):
+				pctx = self.idle[key].pop()
+				del self.lru[pctx]
+
+		if pctx is None:
+			app.logger.debug("bargate.lib.pool creating new smbc context for " + str(key))
+			pctx = PooledContext(key)
+
+		pctx.workgroup = workgroup
+		pctx.username  = username
+		pctx.password  = password
+
+		with self.lock:
+			self.busy.add(pctx)
+
+		return pctx
+
+	def release(self,pctx):
+		"""Returns a PooledContext to the pool, or drops it if it has been
+		marked to be discarded or the pool is disabled"""
+
+		with self.lock:
+			self.busy.discard(pctx)
+
+			## Don't keep the password in memory longer than we need to
+			pctx.password = None
+
+			if pctx.discard or self.max_size <= 0:
+				return
+
+			pctx.last_used = time.time()
+			self.idle.setdefault(pctx.key,[]).append(pctx)
+			self.lru[pctx] = None
+
+			## Drop the least recently used contexts if we are over the limit
+			while len(self.lru) > self.max_size:
+				oldest, _ = self.lru.popitem(last=False)
+				self._remove_idle(oldest)
+
+	def drop_user(self,username):
+		"""Drops every idle context belonging to username, and marks any contexts
+		currently in use by that user to be dropped when they are released.
+		Called when the user logs out."""
+
+		with self.lock:
+			for pctx in list(self.lru.keys()):
+				if pctx.key[0] == username:
+					del self.lru[pctx]
+					self._remove_idle(pctx)
+
+			for pctx in self.busy:
+				if pctx.key[0] == username:
+					pctx.discard = True
+
+	def _evict_idle(self):
+		## must be called with self.lock held
+		expire_before = time.time() - self.idle_timeout
+
+		while len(self.lru) > 0:
+			oldest = next(iter(self.lru))
+			if oldest.last_used > expire_before:
+				break
+
+			del self.lru[oldest]
+			self._remove_idle(oldest)
+
+	def _remove_idle(self,pctx):
+		## must be called with self.lock held
+		contexts = self.idle.get(pctx.key,[])
+		if pctx in contexts:
+			contexts.remove(pctx)
+		if len(contexts) == 0:
+			self.idle.pop(pctx.key,None)
+
+################################################################################
+
+if app.config['SMB_CONTEXT_POOL']:
+	contexts = ContextPool(app.config['SMB_CONTEXT_POOL_SIZE'],app.config['SMB_CONTEXT_POOL_IDLE_TIMEOUT'])
+else:
+	contexts = ContextPool(0,0)
@@ -0,0 +1,170 @@
+#!/usr/bin/python
+#
+# This file is part of Bargate.
+#
+# Bargate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bargate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bargate.  If not, see <http://www.gnu.org/licenses/>.
+
+## prewarm.py
+# Creates image preview thumbnails in the background as soon as a directory
+# is browsed, so that they are already in the thumbnail cache by the time the
+# browser asks for them. Files are queued in the order they are shown (so the
+# first screenful is done first), and a user's queued files are abandoned
+# when they browse somewhere else. The user's password is kept once per user,
+# not in every queued task, and is forgotten as soon as their files are
+# abandoned or the last of them has been started.
+
+from bargate import app
+import bargate.lib.pool
+import bargate.lib.thumbnail
+import bargate.lib.smb
+import threading
+import Queue
+import itertools
+import traceback
+
+################################################################################
+
+class Task(object):
+	"""A file to create a thumbnail for, along with who to read it as (the
+	worker threads can't access the user's session). The password is kept by
+	the Prewarmer."""
+
+	def __init__(self,generation,key,workgroup,username,uri_as_str,name,size,fmt):
+		self.generation = generation
+		self.key        = key
+		self.workgroup  = workgroup
+		self.username   = username
+		self.uri_as_str = uri_as_str
+		self.name       = name
+		self.size       = size
+		self.fmt        = fmt
+
+################################################################################
+
+class Prewarmer(object):
+	"""A pool of worker threads which create thumbnails from a priority queue.
+	Each user has a generation number which is incremented every time they
+	browse; queued tasks from an older generation are skipped. The threads are
+	started the first time anything is queued.
+	"""
+
+	def __init__(self,workers,max_queued):
+		self.workers     = workers
+		self.queue       = Queue.PriorityQueue(max_queued)
+		self.lock        = threading.Lock()
+		self.generations = {}
+		self.started     = False
+		self.counter     = itertools.count()
+
+		## username -> the password for the user's current generation and
+		## the number of its tasks which haven't been started yet
+		self.credentials = {}
+
+	def _start(self):
+		with self.lock:
+			if self.started:
+				return
+			self.started = True
+
+		for i in range(self.workers):
+			thread = threading.Thread(target=self._worker)
+			thread.daemon = True
+			thread.start()
+
+	def cancel(self,username):
+		"""Abandons any thumbnails queued for username, forgetting their
+		password, and returns the user's new generation number"""
+
+		with self.lock:
+			generation = self.generations.get(username,0) + 1
+			self.generations[username] = generation
+			self.credentials.pop(username,None)
+			return generation
+
+	def _password(self,task):
+		"""Returns the password to start task with, or None if the task has
+		been abandoned. The password is forgotten once the last queued task
+		of the user's generation has been started."""
+
+		with self.lock:
+			credentials = self.credentials.get(task.username)
+
+			if credentials is None or credentials['generation'] != task.generation:
+				return None
+
+			credentials['pending'] = credentials['pending'] - 1
+			if credentials['pending'] <= 0:
+				del self.credentials[task.username]
+
+			return credentials['password']
+
+	def add(self,srv_path,workgroup,username,password,files,size='small',fmt='jpeg'):
+		"""Queues thumbnails of size and format fmt to be created for files, a
+		list of (uri_as_str, name) tuples in the order they are displayed.
+		Anything previously queued for username is abandoned."""
+
+		generation = self.cancel(username)
+
+		if self.workers <= 0 or len(files) == 0:
+			return
+
+		self._start()
+
+		key         = bargate.lib.pool.context_key(username,srv_path)
+		credentials = {'generation': generation, 'password': password, 'pending': len(files)}
+
+		with self.lock:
+			## Unless the user has browsed somewhere else already
+			if self.generations.get(username,0) != generation:
+				return
+			self.credentials[username] = credentials
+
+		for (idx, (uri_as_str, name)) in enumerate(files):
+			task = Task(generation,key,workgroup,username,uri_as_str,name,size,fmt)
+
+			## Earlier files first; the counter keeps tasks from being compared
+			try:
+				self.queue.put_nowait((idx,next(self.counter),task))
+			except Queue.Full:
+				app.logger.debug("bargate.lib.prewarm queue is full, not pre-warming the rest of the directory")
+
+				## Don't wait for tasks which were never queued
+				with self.lock:
+					credentials['pending'] = credentials['pending'] - (len(files) - idx)
+					if credentials['pending'] <= 0 and self.credentials.get(username) is credentials:
+						del self.credentials[username]
+				return
+
+	def _worker(self):
+		while True:
+			(priority, count, task) = self.queue.get()
+
+			password = self._password(task)
+			if password is None:
+				continue
+
+			pctx = bargate.lib.pool.contexts.acquire(task.key,task.workgroup,task.username,password)
+			try:
+				bargate.lib.smb.previewEntry(pctx.context,task.uri_as_str,task.name,task.size,task.fmt)
+			except Exception as ex:
+				app.logger.debug("bargate.lib.prewarm could not create a thumbnail for " + task.uri_as_str + ": " + str(type(ex)) + ": " + str(ex))
+			finally:
+				bargate.lib.pool.contexts.release(pctx)
+
+################################################################################
+
+if app.config['THUMBNAIL_PREWARM']:
+	prewarmer = Prewarmer(app.config['THUMBNAIL_PREWARM_WORKERS'],app.config['THUMBNAIL_PREWARM_QUEUE'])
+else:
+	prewarmer = Prewarmer(0,1)
@@ -0,0 +1,282 @@
+#!/usr/bin/python
+#
+# This file is part of Bargate.
+#
+# Bargate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bargate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bargate.  If not, see <http://www.gnu.org/licenses/>.
+
+## query.py
+# The search query language. A query is a list of terms separated by spaces
+# (use quotes around a term, or the value of a key:value term, for ones
+# containing spaces; other quotes, such as the apostrophe in "John's", are
+# just part of the name being searched for). Each term narrows the search:
+#
+#   report           names containing 'report' (plain words are joined
+#                    back together, so 'annual report' matches as one phrase)
+#   *.doc?           names matching a shell style pattern (*, ? and [...])
+#   re:^IMG_\d+      names matching a regular expression (the whole name)
+#   ext:pdf,docx     files with one of these extensions
+#   type:file        only files (or type:dir for only directories)
+#   size:>10M        files larger than 10MB (also <, and ranges like 1M..5M)
+#   after:2016-01-31 modified on or after a date, or within a number of days
+#   before:30d       modified before a date, or more than a number of days ago
+#   depth:2          search at most this many levels down (1 means only
+#                    the current directory)
+#   exclude:.git     don't look inside directories matching this pattern
+#
+# Name tests and directory pruning only need what is in a directory listing;
+# size and modify time tests need a stat.
+
+import re
+import fnmatch
+import time
+import datetime
+
+SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+SIZE_RE    = re.compile(r'^(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?$',re.IGNORECASE)
+DAYS_RE    = re.compile(r'^(\d+)d$',re.IGNORECASE)
+
+## A term: a quoted string at the start of a term (optionally after 'key:')
+## which is closed at the end of a term, otherwise anything up to a space
+TERM_RE    = re.compile(r'''(\w+:)?(?:"([^"]*)"|'([^']*)')(?=\s|$)|\S+''',re.UNICODE)
+
+################################################################################
+
+def _pattern(pattern):
+	"""Compiles a shell style pattern to a case insensitive regex"""
+
+	return re.compile(fnmatch.translate(pattern.lower()),re.IGNORECASE | re.UNICODE)
+
+def _is_glob(term):
+	return '*' in term or '?' in term or '[' in term
+
+def _size(value):
+	match = SIZE_RE.match(value.strip())
+	if not match:
+		raise ValueError("'" + value + "' is not a valid size, try e.g. 500K, 10M or 2G")
+	return int(float(match.group(1)) * SIZE_UNITS[match.group(2).lower()])
+
+def _size_range(value):
+	"""Parses '>N', '<N', 'N..M' or 'N' (exactly) into (minimum, maximum)"""
+
+	if value.startswith('>='):
+		return (_size(value[2:]), None)
+	elif value.startswith('>'):
+		return (_size(value[1:]) + 1, None)
+	elif value.startswith('<='):
+		return (None, _size(value[2:]))
+	elif value.startswith('<'):
+		return (None, _size(value[1:]) - 1)
+	elif '..' in value:
+		(low, high) = value.split('..',1)
+		return (_size(low) if low else None, _size(high) if high else None)
+	else:
+		return (_size(value), _size(value))
+
+def _time(value):
+	"""Parses a date (YYYY-MM-DD) or a number of days ago (Nd) to a timestamp"""
+
+	match = DAYS_RE.match(value)
+	if match:
+		return time.time() - int(match.group(1)) * 86400
+
+	try:
+		return time.mktime(datetime.datetime.strptime(value,'%Y-%m-%d').timetuple())
+	except ValueError:
+		raise ValueError("'" + value + "' is not a valid date, use YYYY-MM-DD or a number of days e.g. 7d")
+
+################################################################################
+
+class Query(object):
+	"""A compiled search query. Build one with parse()."""
+
+	def __init__(self):
+		self.text       = None
+		self.globs      = []
+		self.patterns   = []
+		self.regexes    = []
+		self.exts       = None
+		self.type       = None
+		self.min_size   = None
+		self.max_size   = None
+		self.after      = None
+		self.before     = None
+		self.max_depth  = None
+		self.excludes   = []
+
+	def needs_stat(self):
+		"""True if matching needs the size or modify time of entries"""
+
+		return self.min_size is not None or self.max_size is not None or self.after is not None or self.before is not None
+
+	def empty(self):
+		"""True if the query has no tests that would narrow down the results"""
+
+		return (self.text is None and len(self.globs) == 0 and len(self.regexes) == 0 and self.exts is None and self.type is None and not self.needs_stat())
+
+	def match_name(self,name,etype):
+		"""Tests an entry's name (unicode) and type ('file' or 'dir')"""
+
+		if self.type is not None and etype != self.type:
+			return False
+
+		## Size and extension tests only make sense for files
+		if etype != 'file' and (self.exts is not None or self.min_size is not None or self.max_size is not None):
+			return False
+
+		folded = name.lower()
+
+		if self.text is not None and self.text not in folded:
+			return False
+
+		if self.exts is not None:
+			(base, dot, ext) = folded.rpartition('.')
+			if len(dot) == 0 or ext not in self.exts:
+				return False
+
+		for pattern in self.globs:
+			if not pattern.match(folded):
+				return False
+
+		for pattern in self.regexes:
+			if not pattern.match(name):
+				return False
+
+		return True
+
+	def match_stat(self,fstat):
+		"""Tests an entry's size and modify time. fstat is a dictionary with
+		'size' and 'mtime' keys as returned by bargate.lib.smb.statEntry"""
+
+		if not self.needs_stat():
+			return True
+
+		if fstat is None:
+			return False
+
+		size  = fstat.get('size')
+		mtime = fstat.get('mtime')
+
+		if self.min_size is not None and (size is None or size < self.min_size):
+			return False
+		if self.max_size is not None and (size is None or size > self.max_size):
+			return False
+		if self.after is not None and (mtime is None or mtime < self.after):
+			return False
+		if self.before is not None and (mtime is None or mtime >= self.before):
+			return False
+
+		return True
+
+	def descend(self,name,depth):
+		"""Returns True if the directory called 'name', 'depth' levels below the
+		directory being searched (1 for its immediate subdirectories), should
+		be searched"""
+
+		if self.max_depth is not None and depth >= self.max_depth:
+			return False
+
+		folded = name.lower()
+		for pattern in self.excludes:
+			if pattern.match(folded):
+				return False
+
+		return True
+
+################################################################################
+
+def parse(text):
+	"""Parses a search query (see the top of this file) into a Query object.
+	Raises ValueError with a message for the user if the query is invalid."""
+
+	if not isinstance(text,unicode):
+		text = text.decode('utf-8')
+
+	## Split on spaces, allowing quotes but not backslash escapes (which
+	## would mangle regular expressions)
+	terms = []
+	for match in TERM_RE.finditer(text):
+		if match.group(2) is not None:
+			terms.append((match.group(1) or u'') + match.group(2))
+		elif match.group(3) is not None:
+			terms.append((match.group(1) or u'') + match.group(3))
+		else:
+			terms.append(match.group(0))
+
+	query = Query()
+	words = []
+
+	for term in terms:
+		(key, sep, value) = term.partition(':')
+		key = key.lower()
+
+		if len(sep) == 0 or key not in ['re','ext','type','size','after','before','depth','exclude']:
+			if _is_glob(term):
+				query.globs.append(_pattern(term))
+				query.patterns.append(term.lower())
+			else:
+				words.append(term)
+			continue
+
+		if len(value) == 0:
+			raise ValueError("No value was given for '" + key + ":'")
+
+		if key == 're':
+			try:
+				query.regexes.append(re.compile('(?:' + value + r')\Z',re.IGNORECASE | re.UNICODE))
+			except re.error as ex:
+				raise ValueError("Invalid regular expression '" + value + "': " + str(ex))
+
+		elif key == 'ext':
+			exts = set([ext.strip().lstrip('.').lower() for ext in value.split(',') if len(ext.strip()) > 0])
+			if query.exts is None:
+				query.exts = exts
+			else:
+				query.exts = query.exts & exts
+
+		elif key == 'type':
+			value = value.lower()
+			if value in ['file','files','f']:
+				query.type = 'file'
+			elif value in ['dir','dirs','folder','folders','directory','d']:
+				query.type = 'dir'
+			else:
+				raise ValueError("'type:' must be 'file' or 'dir'")
+
+		elif key == 'size':
+			(query.min_size, query.max_size) = _size_range(value)
+
+		elif key == 'after':
+			query.after = _time(value)
+
+		elif key == 'before':
+			query.before = _time(value)
+
+		elif key == 'depth':
+			try:
+				query.max_depth = int(value)
+			except ValueError:
+				raise ValueError("'depth:' must be a number")
+			if query.max_depth < 1:
+				raise ValueError("'depth:' must be at least 1")
+
+		elif key == 'exclude':
+			query.excludes.append(_pattern(value))
+
+	if len(words) > 0:
+		query.text = u' '.join(words).lower()
+
+	if query.empty():
+		raise ValueError("Please enter something to search for")
+
+	return query
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+#
+# This file is part of Bargate.
+#
+# Bargate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bargate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bargate.  If not, see <http://www.gnu.org/licenses/>.
+
+## redisconn.py
+# The redis client shared by every request in a worker process. Connections
+# come from one connection pool and time out after REDIS_SOCKET_TIMEOUT
+# seconds. After REDIS_BREAKER_THRESHOLD connection failures in a row the
+# circuit breaker opens: for the next REDIS_BREAKER_COOLDOWN seconds redis
+# isn't tried at all and commands fail straight away, then one command is let
+# through to see if it has come back. While the breaker is open available()
+# is False, and Bargate carries on without redis: user preferences are the
+# defaults from the config and user activity isn't recorded.
+
+from bargate import app
+import redis
+import threading
+import time
+
+################################################################################
+
+class CircuitBreaker(object):
+	"""Counts connection failures and decides whether to try redis at all"""
+
+	def __init__(self,threshold,cooldown):
+		self.threshold = threshold
+		self.cooldown  = cooldown
+		self.failures  = 0
+		self.opened_at = None
+		self.trial     = False
+		self.lock      = threading.Lock()
+
+	def is_open(self):
+		"""Returns True while redis shouldn't be used"""
+
+		with self.lock:
+			return self.opened_at is not None and time.time() - self.opened_at < self.cooldown
+
+	def allow(self):
+		"""Returns True if a command may be sent. Once the cooldown is over
+		only one command at a time is let through until one succeeds."""
+
+		with self.lock:
+			if self.opened_at is None:
+				return True
+
+			if time.time() - self.opened_at < self.cooldown or self.trial:
+				return False
+
+			self.trial = True
+			return True
+
+	def success(self):
+		with self.lock:
+			if self.opened_at is not None:
+				app.logger.info("bargate.lib.redisconn: redis is back, leaving degraded mode")
+
+			self.failures  = 0
+			self.opened_at = None
+			self.trial     = False
+
+	def failure(self):
+		with self.lock:
+			self.failures = self.failures + 1
+			self.trial    = False
+
+			if self.opened_at is not None or self.failures >= self.threshold:
+				if self.opened_at is None:
+					app.logger.warning("bargate.lib.redisconn: could not reach redis " + str(self.failures) + " times in a row, running without it for " + str(self.cooldown) + " seconds")
+				self.opened_at = time.time()
+
+################################################################################
+
+class GuardedRedis(redis.StrictRedis):
+	"""A StrictRedis client whose commands (and pipelines) go through the
+	circuit breaker. Commands raise redis.ConnectionError without trying
+	the server while the breaker is open."""
+
+	def __init__(self,breaker,*args,**kwargs):
+		redis.StrictRedis.__init__(self,*args,**kwargs)
+		self.breaker = breaker
+
+	def guard(self,func,*args,**kwargs):
+		if not self.breaker.allow():
+			raise redis.ConnectionError("Redis is unavailable")
+
+		try:
+			result = func(*args,**kwargs)
+		except (redis.ConnectionError, redis.TimeoutError):
+			self.breaker.failure()
+			raise
+		except redis.RedisError:
+			## The server answered, even if it didn't like the command
+			self.breaker.success()
+			raise
+
+		self.breaker.success()
+		return result
+
+	def execute_command(self,*args,**kwargs):
+		return self.guard(redis.StrictRedis.execute_command,self,*args,**kwargs)
+
+	def pipeline(self,*args,**kwargs):
+		pipe    = redis.StrictRedis.pipeline(self,*args,**kwargs)
+		execute = pipe.execute
+		pipe.execute = lambda *args, **kwargs: self.guard(execute,*args,**kwargs)
+		return pipe
+
+################################################################################
+
+def available():
+	"""Returns True if redis is enabled and not known to be down"""
+
+	return app.config['REDIS_ENABLED'] and not breaker.is_open()
+
+breaker = CircuitBreaker(app.config['REDIS_BREAKER_THRESHOLD'],app.config['REDIS_BREAKER_COOLDOWN'])
+
+pool    = redis.ConnectionPool(host=app.config['REDIS_HOST'], port=app.config['REDIS_PORT'], db=0,
+	socket_timeout=app.config['REDIS_SOCKET_TIMEOUT'],
+	socket_connect_timeout=app.config['REDIS_SOCKET_TIMEOUT'])
+
+client  = GuardedRedis(breaker,connection_pool=pool)
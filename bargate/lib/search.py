@@ -17,12 +17,64 @@
 
 from bargate import app
 import bargate.lib.smb
+import bargate.lib.pool
+import bargate.lib.user
+import bargate.lib.userdata
+import bargate.lib.index
+import bargate.lib.query
+import bargate.lib.cache
+import bargate.lib.redisconn
 import string, os, smbc, pprint, urllib, re, time
-from flask import url_for
+import threading, Queue, collections, json
+from flask import url_for, session, g
+
+## Where searches got to, by token, when redis isn't enabled (or is down)
+saved_searches = bargate.lib.cache.LRUCache(app.config['SEARCH_RESUME_CACHE_SIZE'],app.config['SEARCH_RESUME_TTL'])
+
+def get_engine(libsmbclient,func_name,path,path_as_str,srv_path_as_str,uri_as_str,query,timeout=None,state=None,mode='names'):
+	"""Returns the search engine to use to search below 'path': the filename
+	index if that part of the share has been crawled, otherwise a walk of the
+	file server. If state (see load()) is given the search carries on from
+	where it got to. If mode is 'contents' the contents index is searched
+	instead (see check())."""
+
+	if mode == 'contents':
+		return ContentSearchEngine(libsmbclient,func_name,path,path_as_str,srv_path_as_str,uri_as_str,query,timeout)
+	elif state is not None:
+		engine = RecursiveSearchEngine(libsmbclient,func_name,path,path_as_str,srv_path_as_str,uri_as_str,query,timeout)
+		engine.resume(state)
+		return engine
+	elif bargate.lib.index.share_enabled(func_name) and bargate.lib.index.index.indexed(func_name,path):
+		return IndexSearchEngine(libsmbclient,func_name,path,path_as_str,srv_path_as_str,uri_as_str,query,timeout)
+	else:
+		return RecursiveSearchEngine(libsmbclient,func_name,path,path_as_str,srv_path_as_str,uri_as_str,query,timeout)
+
+def check(func_name,path,query,mode='names'):
+	"""Raises ValueError, with a message for the user, if query can't be
+	searched for in 'mode' ('names' or 'contents') below path"""
+
+	matcher = bargate.lib.query.parse(query)
+
+	if mode == 'contents':
+		if not bargate.lib.index.contents_enabled(func_name) or not bargate.lib.index.index.has_contents() or not bargate.lib.index.index.indexed(func_name,path):
+			raise ValueError("The contents of the files in this folder haven't been indexed, so they can't be searched")
+
+		if matcher.text is None:
+			raise ValueError("Please enter some words to search the contents of files for")
 
 class RecursiveSearchEngine:
+	"""Searches the directory tree below uri_as_str for entries matching
+	'query' (see bargate.lib.query, which raises ValueError for invalid
+	queries). Directories the query excludes, or which are deeper than it
+	allows, are never listed. The tree is searched breadth first so that when the
+	search runs out of time the results cover the whole of the top of the
+	tree rather than one deep branch of it. Up to SEARCH_CONCURRENCY
+	directories are listed at once, each by a thread with its own
+	libsmbclient context from the context pool. Everything else (matching
+	and processing entries) happens in the request thread.
+	"""
 
-	def __init__(self,libsmbclient,func_name,path,path_as_str,srv_path_as_str,uri_as_str,query):
+	def __init__(self,libsmbclient,func_name,path,path_as_str,srv_path_as_str,uri_as_str,query,timeout=None):
 		self.libsmbclient    = libsmbclient
 		self.func_name       = func_name
 		self.path            = path
@@ -30,59 +82,598 @@ class RecursiveSearchEngine:
 		self.srv_path_as_str = srv_path_as_str
 		self.uri_as_str      = uri_as_str
 		self.query           = query
-		
-		self.timeout_at      = int(time.time()) + app.config['SEARCH_TIMEOUT']
+		self.matcher         = bargate.lib.query.parse(query)
+		self.concurrency     = app.config['SEARCH_CONCURRENCY']
+
+		if timeout is None:
+			timeout = app.config['SEARCH_TIMEOUT']
+
+		self.timeout_at      = time.time() + timeout
 		self.timeout_reached = False
+		self.truncated       = False
 		self.results         = []
+		self.dirs_scanned    = 0
+
+		## Directories still to be listed, as (path, path_as_str, uri_as_str, depth)
+		self.frontier        = collections.deque([(path,path_as_str,uri_as_str,0)])
 
 	def search(self):
-		self._search(self.path,self.path_as_str,self.uri_as_str)
+		for entry in self.walk():
+			self.results.append(entry)
+
 		return self.results, self.timeout_reached
-		
-	def _search(self,path, path_as_str, uri_as_str):
 
-		## Try getting directory contents of where we are
-		app.logger.debug("RecursiveSearchEngine: _search called to search: " + uri_as_str)
+	def walk(self,heartbeat=False):
+		"""A generator which yields each matching entry (processed by
+		processDentry) as soon as it is found. If heartbeat is True None is
+		also yielded after each directory is searched, so that the caller
+		can report progress."""
+
+		if self.concurrency <= 1:
+			listings = self._list_serial()
+		else:
+			lister   = ParallelLister(self.timeout_at)
+			lister.add(self)
+			listings = lister.listings()
+
 		try:
-			directory_entries = self.libsmbclient.opendir(uri_as_str).getdents()
-		except smbc.NotDirectoryError as ex:
-			return
+			for (engine, directory, dentries) in listings:
+				for entry in self.process(directory,dentries,heartbeat):
+					yield entry
+		finally:
+			listings.close()
 
-		except Exception as ex:
-			app.logger.info("Search encountered an exception " + str(ex) + " " + str(type(ex)))
-			return
+	def process(self,directory,dentries,heartbeat=False):
+		"""A generator which yields the matching entries in one directory
+		listing, and adds the subdirectories to search to the frontier.
+		dentries is the exception raised if the directory couldn't be
+		listed. If heartbeat is True None is yielded first."""
 
-		## now loop over each entry
-		for dentry in directory_entries:
+		(path, path_as_str, uri_as_str, depth) = directory
+		self.dirs_scanned = self.dirs_scanned + 1
 
-			## don't keep searching if we reach the timeout
-			if self.timeout_reached:
-				break;
-			elif int(time.time()) >= self.timeout_at:
-				self.timeout_reached = True
-				break
+		if isinstance(dentries,smbc.NotDirectoryError):
+			return
+		elif isinstance(dentries,Exception):
+			app.logger.info("Search encountered an exception " + str(dentries) + " " + str(type(dentries)))
+			return
 
+		if heartbeat:
+			yield None
+
+		## The whole directory is always searched, even if the timeout
+		## is reached, so that the search can be resumed after it
+		matches = []
+		for dentry in dentries:
 			entry = bargate.lib.smb.loadDentry(dentry, self.srv_path_as_str, path, path_as_str)
 
 			## Skip hidden files
 			if entry['skip']:
 				continue
 
-			## Check if the filename matched
-			if self.query.lower() in entry['name'].lower():
+			## Check if the filename matched, the size and modify time are
+			## checked below
+			if self.matcher.match_name(entry['name'],entry['type']):
+				matches.append(entry)
+
+			## Search subdirectories once this level is done
+			if entry['type'] == 'dir' and self.matcher.descend(entry['name'],depth + 1):
+				if len(path_as_str) > 0:
+					new_path_as_str = path_as_str + "/" + urllib.quote(entry['name_as_str'])
+				else:
+					new_path_as_str = urllib.quote(entry['name_as_str'])
+
+				self.frontier.append((entry['path'], new_path_as_str, entry['uri_as_str'], depth + 1))
+
+		## stat all the name matches at once, rather than one at a time, so
+		## that a large directory doesn't overrun the timeout
+		if self.matcher.needs_stat():
+			fstats = bargate.lib.smb.statEntries(self.libsmbclient,self.srv_path_as_str,[entry['uri_as_str'] for entry in matches],self.concurrency)
+			fstats = [None if isinstance(fstat,Exception) else fstat for fstat in fstats]
+		else:
+			fstats = [None] * len(matches)
+
+		for (entry, fstat) in zip(matches,fstats):
+			if self.matcher.match_stat(fstat):
 				app.logger.debug("RecursiveSearchEngine: Matched: " + entry['name'])
-				entry = bargate.lib.smb.processDentry(entry, self.libsmbclient, self.func_name)
+				entry = bargate.lib.smb.processDentry(entry, self.libsmbclient, self.func_name, fstat)
 				entry['parent_path'] = path
 				entry['parent_url']  = url_for(self.func_name,path=path)
-				self.results.append(entry)
+				yield entry
 
-			## Search subdirectories if we found one
-			if entry['type'] == 'dir':
-				if len(path) > 0:
-					new_path        = path + "/" + entry['name']
-					new_path_as_str = path_as_str + "/" + entry['name_as_str']
-				else:
-					new_path        = entry['name']
-					new_path_as_str = entry['name_as_str']					
+	def _list_serial(self):
+		"""Lists directories from the frontier one at a time in this thread,
+		yielding (engine, directory, dentries) tuples (as
+		ParallelLister.listings does) where dentries is the exception raised
+		if the directory couldn't be listed"""
+
+		while len(self.frontier) > 0:
+			if time.time() >= self.timeout_at:
+				self.timeout_reached = True
+				return
+
+			directory = self.frontier.popleft()
+			app.logger.debug("RecursiveSearchEngine: searching: " + directory[2])
+
+			try:
+				dentries = bargate.lib.smb.listDirectory(self.libsmbclient,directory[2])
+			except Exception as ex:
+				dentries = ex
+
+			yield (self, directory, dentries)
+
+	def resume(self,state):
+		"""Carries on a search from the state saved by save()"""
+
+		self.results      = state['results']
+		self.dirs_scanned = state['dirs_scanned']
+		self.frontier     = collections.deque([(path, path_as_str.encode('utf-8'), uri_as_str.encode('utf-8'), depth) for (path, path_as_str, uri_as_str, depth) in state['frontier']])
+
+class IndexSearchEngine:
+	"""Searches the filename index (see bargate.lib.index) instead of the file
+	server. The index is built with a service account, so every match is
+	stat'ed as the user before it is returned: anything they can't stat (or
+	which has since been deleted) is left out, and the size and modify time
+	shown are current. The index is read INDEX_SEARCH_MAX_RESULTS rows at a
+	time until that many matches have been found, when 'truncated' is set,
+	or the search runs out of time. Has the same interface as
+	RecursiveSearchEngine.
+	"""
+
+	def __init__(self,libsmbclient,func_name,path,path_as_str,srv_path_as_str,uri_as_str,query,timeout=None):
+		self.libsmbclient    = libsmbclient
+		self.func_name       = func_name
+		self.path            = path
+		self.path_as_str     = path_as_str
+		self.srv_path_as_str = srv_path_as_str
+		self.uri_as_str      = uri_as_str
+		self.query           = query
+		self.matcher         = bargate.lib.query.parse(query)
+
+		if timeout is None:
+			timeout = app.config['SEARCH_TIMEOUT']
+
+		self.timeout_at      = time.time() + timeout
+		self.timeout_reached = False
+		self.truncated       = False
+		self.results         = []
+		self.dirs_scanned    = 0
+
+		## Index searches can't be carried on, so there is nothing to resume
+		self.frontier        = collections.deque()
+
+	def search(self):
+		for entry in self.walk():
+			self.results.append(entry)
+
+		return self.results, self.timeout_reached
+
+	def candidates(self,offset,limit):
+		"""Returns up to limit (parent, name, type) tuples from the index,
+		skipping the first offset, which might match. The index narrows the
+		search down by name, pattern, extension, type, size and modify time,
+		the rest of the query is tested by check(). Sizes and modify times
+		are as of the last crawl, so check() tests them again."""
+
+		return bargate.lib.index.index.search(self.func_name,self.path,self.matcher.text or u'',limit,self.matcher.exts,self.matcher.type,self.matcher.patterns,offset,
+			self.matcher.min_size,self.matcher.max_size,self.matcher.after,self.matcher.before)
+
+	def walk(self,heartbeat=False):
+		limit  = app.config['INDEX_SEARCH_MAX_RESULTS']
+		offset = 0
+		found  = 0
+
+		while True:
+			if time.time() > self.timeout_at:
+				self.timeout_reached = True
+				return
+
+			candidates = self.candidates(offset,limit)
+			offset     = offset + len(candidates)
+
+			for entry in self.check(candidates):
+				yield entry
+				found = found + 1
+
+				if found >= limit:
+					self.truncated = True
+					return
+
+			if len(candidates) < limit:
+				return
+
+			if heartbeat:
+				yield None
+
+	def check(self,candidates):
+		"""Yields the processed entries for the candidates which match the
+		whole query and which the user can stat"""
+
+		show_hidden = bargate.lib.userdata.get_show_hidden_files()
+
+		entries = []
+		for (parent, name, etype) in candidates:
+			if not self.matcher.match_name(name,etype):
+				continue
+
+			## Leave out anything the live search wouldn't have looked inside:
+			## hidden, excluded or too deep directories
+			parts = [part for part in parent[len(self.path):].split('/') if len(part) > 0]
+
+			if not show_hidden and any([bargate.lib.smb.hiddenName(part) for part in parts]):
+				continue
+
+			if not all([self.matcher.descend(part,depth + 1) for (depth, part) in enumerate(parts)]):
+				continue
+
+			if etype == 'dir':
+				smbc_type = bargate.lib.smb.SMB_DIR
+			else:
+				smbc_type = bargate.lib.smb.SMB_FILE
+
+			entry = bargate.lib.smb.loadEntry(name, smbc_type, self.srv_path_as_str, parent, urllib.quote(parent.encode('utf-8')))
+
+			## Skip hidden files
+			if entry['skip']:
+				continue
+
+			entries.append(entry)
+
+		fstats = self.stat_entries([entry['uri_as_str'] for entry in entries])
+
+		for (entry, fstat) in zip(entries,fstats):
+			if isinstance(fstat,Exception) or not self.matcher.match_stat(fstat):
+				continue
+
+			entry = bargate.lib.smb.processDentry(entry, self.libsmbclient, self.func_name, fstat)
+			entry['parent_path'] = entry['path'].rpartition('/')[0]
+			entry['parent_url']  = url_for(self.func_name,path=entry['parent_path'])
+			yield entry
+
+	def stat_entries(self,uris):
+		"""Stats the candidates as the user, returning a list of stat
+		dictionaries or exceptions as statEntries does"""
+
+		return bargate.lib.smb.statEntries(self.libsmbclient,self.srv_path_as_str,uris,app.config['SEARCH_CONCURRENCY'])
+
+class ContentSearchEngine(IndexSearchEngine):
+	"""Searches the contents index (see bargate.lib.index) for documents
+	containing the words in the query. The rest of the query (patterns,
+	ext:, size: etc.) is tested against the documents found, as for
+	IndexSearchEngine. A match gives away what is in a document, so
+	documents are only returned if the user can open them for reading, not
+	just stat them."""
+
+	def __init__(self,libsmbclient,func_name,path,path_as_str,srv_path_as_str,uri_as_str,query,timeout=None):
+		IndexSearchEngine.__init__(self,libsmbclient,func_name,path,path_as_str,srv_path_as_str,uri_as_str,query,timeout)
+
+		## The words are looked for in the documents, not their names
+		self.text         = self.matcher.text
+		self.matcher.text = None
+
+		if self.text is None:
+			raise ValueError("Please enter some words to search the contents of files for")
+
+	def candidates(self,offset,limit):
+		return bargate.lib.index.index.search_contents(self.func_name,self.path,self.text,limit,self.matcher.exts,offset)
+
+	def stat_entries(self,uris):
+		return bargate.lib.smb.statReadableEntries(self.libsmbclient,self.srv_path_as_str,uris,app.config['SEARCH_CONCURRENCY'])
+
+################################################################################
+
+class ParallelLister(object):
+	"""Lists the directories on the frontiers of one or more
+	RecursiveSearchEngines in worker threads. Each engine gets its own
+	engine.concurrency workers, each with its own libsmbclient context from
+	the context pool, and only as many of its directories are handed out at
+	a time as it has workers so the rest of its frontier stays in breadth
+	first order. All the searches share one deadline, timeout_at."""
+
+	def __init__(self,timeout_at):
+		self.timeout_at = timeout_at
+		self.done       = Queue.Queue()
+		self.stop       = threading.Event()
+		self.sources    = []
+
+	def add(self,engine):
+		"""Starts the worker threads for engine. Must be called from the
+		request thread."""
+
+		## The worker threads can't access the Flask session, so work out the
+		## credentials and the pool key now
+		key       = bargate.lib.pool.context_key(session['username'],engine.srv_path_as_str)
+		workgroup = app.config['SMB_WORKGROUP']
+		username  = session['username']
+		password  = bargate.lib.user.get_password()
+
+		## in_flight is the directories handed to the workers which haven't
+		## been yielded yet
+		source = {'engine': engine, 'work': Queue.Queue(), 'in_flight': [], 'threads': []}
+
+		def worker():
+			pctx = bargate.lib.pool.contexts.acquire(key,workgroup,username,password)
+			try:
+				while True:
+					directory = source['work'].get()
+					if directory is None or self.stop.is_set():
+						return
+
+					app.logger.debug("RecursiveSearchEngine: searching: " + directory[2])
+
+					try:
+						dentries = bargate.lib.smb.listDirectory(pctx.context,directory[2])
+					except Exception as ex:
+						dentries = ex
+
+					self.done.put((source, directory, dentries))
+			finally:
+				bargate.lib.pool.contexts.release(pctx)
+
+		for i in range(max(1,engine.concurrency)):
+			thread = threading.Thread(target=worker)
+			thread.daemon = True
+			thread.start()
+			source['threads'].append(thread)
+
+		self.sources.append(source)
+
+	def listings(self):
+		"""A generator which yields (engine, directory, dentries) tuples in the
+		order the listings complete, where dentries is the exception raised if
+		the directory couldn't be listed. Engines which still had directories
+		to list when the deadline passed have timeout_reached set."""
+
+		try:
+			while True:
+				busy = False
+				for source in self.sources:
+					engine = source['engine']
+					while len(engine.frontier) > 0 and len(source['in_flight']) < max(1,engine.concurrency):
+						directory = engine.frontier.popleft()
+						source['work'].put(directory)
+						source['in_flight'].append(directory)
+
+					if len(source['in_flight']) > 0:
+						busy = True
+
+				## Nothing left to list
+				if not busy:
+					return
+
+				try:
+					(source, directory, dentries) = self.done.get(timeout=max(0,self.timeout_at - time.time()))
+				except Queue.Empty:
+					for source in self.sources:
+						if len(source['in_flight']) > 0 or len(source['engine'].frontier) > 0:
+							source['engine'].timeout_reached = True
+					return
+
+				source['in_flight'].remove(directory)
+				yield (source['engine'], directory, dentries)
+		finally:
+			## Let the workers finish what they are doing and go away. Listings
+			## still in progress are abandoned, and put back on the frontier
+			## so a resumed search lists them again.
+			self.stop.set()
+			for source in self.sources:
+				for thread in source['threads']:
+					source['work'].put(None)
+
+				source['engine'].frontier.extendleft(reversed(source['in_flight']))
+				source['in_flight'] = []
+
+################################################################################
+
+def search_shares():
+	"""Returns (func_name, display_name, srv_path) for each share in the
+	shares config which the logged in user can search: shares whose path
+	can be worked out for them and which haven't been left out of searches
+	of all shares with 'search = false'"""
+
+	shares = []
+	for section in app.sharesList:
+		if app.sharesConfig.has_option(section,'search') and not app.sharesConfig.getboolean(section,'search'):
+			continue
+
+		srv_path = bargate.lib.smb.get_share_path(section)
+
+		## The user's home directory isn't known
+		if '%LDAP_HOMEDIR%' in srv_path or not srv_path.startswith('smb://'):
+			continue
+
+		if not srv_path.endswith('/'):
+			srv_path = srv_path + '/'
+
+		shares.append((section, app.sharesConfig.get(section,'display'), srv_path))
+
+	return shares
+
+class FederatedSearch(object):
+	"""Searches every share in 'shares' (see search_shares()) at once, using
+	the same engine for each as a search of the share from its root would.
+	Indexed shares are searched first, then the other shares are walked
+	together with SEARCH_ALL_SHARES_CONCURRENCY workers each and one
+	deadline for all of them. Results are yielded in the order they are
+	found, each with 'share' set to the display name of its share. Has the
+	same interface as RecursiveSearchEngine, except that it can't be saved
+	and resumed."""
+
+	def __init__(self,shares,query,timeout=None):
+		self.query   = query
+		self.matcher = bargate.lib.query.parse(query)
+
+		if timeout is None:
+			timeout = app.config['SEARCH_TIMEOUT']
+
+		self.timeout_at = time.time() + timeout
+		self.results    = []
+		self.engines    = []
+
+		for (func_name, display_name, srv_path) in shares:
+			libsmbclient    = bargate.lib.smb.get_context(srv_path)
+			srv_path_as_str = srv_path.encode('utf-8')
+
+			engine = get_engine(libsmbclient,func_name,u'','',srv_path_as_str,srv_path_as_str,query,timeout)
+			engine.display_name = display_name
+			engine.concurrency  = app.config['SEARCH_ALL_SHARES_CONCURRENCY']
+			engine.timeout_at   = self.timeout_at
+			self.engines.append(engine)
+
+	@property
+	def timeout_reached(self):
+		return any([engine.timeout_reached for engine in self.engines])
+
+	@property
+	def truncated(self):
+		return any([engine.truncated for engine in self.engines])
+
+	@property
+	def dirs_scanned(self):
+		return sum([engine.dirs_scanned for engine in self.engines])
+
+	def search(self):
+		for entry in self.walk():
+			self.results.append(entry)
+
+		return self.results, self.timeout_reached
+
+	def walk(self,heartbeat=False):
+		for engine in self.engines:
+			if isinstance(engine,IndexSearchEngine):
+				for entry in engine.walk():
+					entry['share'] = engine.display_name
+					yield entry
+
+		## Only start the workers once nothing else can stop the walk before
+		## listings() is there to stop them again
+		lister = ParallelLister(self.timeout_at)
+		for engine in self.engines:
+			if not isinstance(engine,IndexSearchEngine):
+				lister.add(engine)
+
+		listings = lister.listings()
+
+		try:
+			for (engine, directory, dentries) in listings:
+				for entry in engine.process(directory,dentries,heartbeat):
+					if entry is not None:
+						entry['share'] = engine.display_name
+					yield entry
+		finally:
+			listings.close()
+
+################################################################################
+
+def stream(engine,render,finished=None):
+	"""A generator of the server-sent events for a search: a 'result' event
+	with the HTML returned by render(entry) for each result (starting with
+	any in engine.results already), 'progress' events with how many
+	directories have been searched at most every
+	SEARCH_STREAM_PROGRESS_INTERVAL seconds, and a 'done' event at the end.
+	finished(data) is called before 'done' is sent to add to its data.
+	Closing the generator (which Flask does if the browser goes away) stops
+	the search and its threads."""
+
+	def event(name,data):
+		return 'event: ' + name + '\ndata: ' + json.dumps(data) + '\n\n'
+
+	def progress():
+		return {'dirs': engine.dirs_scanned, 'results': len(engine.results)}
+
+	walker    = engine.walk(heartbeat=True)
+	last_sent = 0
+
+	try:
+		## Send what a resumed search had already found first
+		for entry in engine.results:
+			yield event('result',{'html': render(entry)})
+
+		for entry in walker:
+			if entry is not None:
+				engine.results.append(entry)
+				yield event('result',{'html': render(entry)})
+			elif time.time() - last_sent >= app.config['SEARCH_STREAM_PROGRESS_INTERVAL']:
+				last_sent = time.time()
+				yield event('progress',progress())
+
+		data = progress()
+		data['timeout_reached'] = engine.timeout_reached
+		data['truncated']       = engine.truncated
+
+		if finished is not None:
+			finished(data)
+
+		yield event('done',data)
+	finally:
+		walker.close()
+
+################################################################################
+
+def save(engine,token=None):
+	"""Saves the results of a search, and the directories it still has to
+	search, for SEARCH_RESUME_TTL seconds so that it can be carried on later.
+	Returns the token to load it with, or
+	None if it couldn't be saved. Searches with more than
+	SEARCH_RESUME_MAX_RESULTS results aren't saved."""
+
+	if len(engine.results) > app.config['SEARCH_RESUME_MAX_RESULTS']:
+		return None
+
+	if token is None:
+		token = os.urandom(16).encode('hex')
+
+	state = {
+		'username':     session['username'],
+		'func_name':    engine.func_name,
+		'path':         engine.path,
+		'query':        engine.query,
+		'results':      engine.results,
+		'frontier':     list(engine.frontier),
+		'dirs_scanned': engine.dirs_scanned,
+	}
+
+	try:
+		data = json.dumps(state)
+	except (TypeError, ValueError) as ex:
+		app.logger.warning("Could not save search: " + str(type(ex)) + " " + str(ex))
+		return None
+
+	if bargate.lib.redisconn.available():
+		try:
+			g.redis.setex('search:' + token,app.config['SEARCH_RESUME_TTL'],data)
+		except Exception as ex:
+			app.logger.warning("Could not save search: " + str(type(ex)) + " " + str(ex))
+			return None
+	else:
+		saved_searches.set(token,data)
+
+	return token
+
+def load(func_name,path,query,token):
+	"""Returns a (token, state) tuple for the search by the user for query in
+	path saved under token. Returns (None, None) if token is None or there
+	isn't such a search, so that a new search always starts from scratch."""
+
+	if not token:
+		return (None, None)
+
+	try:
+		if bargate.lib.redisconn.available():
+			data = g.redis.get('search:' + token)
+		else:
+			data = saved_searches.get(token)
+	except Exception as ex:
+		app.logger.warning("Could not load saved search: " + str(type(ex)) + " " + str(ex))
+		return (None, None)
+
+	if data is None:
+		return (None, None)
+
+	state = json.loads(data)
+
+	## Tokens can only be used by the same user, for the same search
+	if state['username'] != session['username'] or state['func_name'] != func_name or state['path'] != path or state['query'] != query:
+		return (None, None)
 
-				self._search(new_path, new_path_as_str, entry['uri_as_str'])
+	return (token, state)
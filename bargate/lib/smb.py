@@ -20,9 +20,23 @@ import bargate.lib.core
 import bargate.lib.errors
 import bargate.lib.userdata
 import bargate.lib.mime
-from bargate.lib.search import RecursiveSearchEngine
+import bargate.lib.pool
+import bargate.lib.cache
+import bargate.lib.redisconn
+import bargate.lib.download
+import bargate.lib.copyjob
+import bargate.lib.upload
+import bargate.lib.zipstream
+import bargate.lib.thumbnail
+import bargate.lib.prewarm
+import bargate.lib.user
+import bargate.lib.search
+import bargate.lib.query
 import string, os, io, smbc, sys, stat, pprint, urllib, re
-from flask import Flask, send_file, request, session, g, redirect, url_for, abort, flash, make_response, jsonify, render_template
+import threading, Queue, base64, json, time
+from flask import Flask, send_file, request, session, g, redirect, url_for, abort, flash, make_response, jsonify, render_template, get_template_attribute
+from flask import Response, stream_with_context
+from werkzeug.datastructures import Headers
 
 ### Python imaging stuff
 from PIL import Image
@@ -54,6 +68,22 @@ SMB_LINK        = 9
 #00095 #define SMBC_FILE           8
 #00096 #define SMBC_LINK           9
 
+#### Sort orders supported by the paginated directory listing
+BROWSE_SORT_KEYS = ['name', 'type', 'size', 'mtime']
+
+#### Entry dictionary keys returned by the paginated directory listing
+BROWSE_JSON_KEYS = ['type', 'name', 'path', 'icon', 'open', 'stat', 'download',
+	'view', 'img_preview', 'mtype', 'mtype_raw', 'size', 'mtime', 'mtime_raw',
+	'error']
+
+#### Directory listing cache
+## keys are (username, directory uri_as_str, func_name, show hidden files,
+## generations) - see listing_key
+if app.config['LISTING_CACHE']:
+	listing_cache = bargate.lib.cache.LRUCache(app.config['LISTING_CACHE_SIZE'],app.config['LISTING_CACHE_TTL'])
+else:
+	listing_cache = bargate.lib.cache.LRUCache(0,0)
+
 ################################################################################
 ################################################################################
 ################################################################################
@@ -118,6 +148,292 @@ def check_path(path):
 ################################################################################
 ################################################################################
 
+def get_share_path(section):
+	"""Returns the server path (smb://server/share/...) of the share
+	'section' in the shares config for the logged in user, with %USERNAME%,
+	%USER% and %LDAP_HOMEDIR% replaced. %LDAP_HOMEDIR% is left alone if the
+	user's home directory isn't known.
+	"""
+
+	## Get the path variable
+	svrpath = app.sharesConfig.get(section,'path')
+
+	## Variable substition for username
+	svrpath = svrpath.replace("%USERNAME%",session['username'])
+	svrpath = svrpath.replace("%USER%",session['username'])
+
+	## LDAP home dir substitution support
+	if app.config['LDAP_HOMEDIR']:
+		if 'ldap_homedir' in session:
+			if not session['ldap_homedir'] == None:
+				svrpath = svrpath.replace("%LDAP_HOMEDIR%",session['ldap_homedir'])
+
+	return svrpath
+
+################################################################################
+################################################################################
+################################################################################
+
+def get_context(srv_path):
+	"""Returns a libsmbclient context for the logged in user to talk to the
+	server/share in srv_path. Contexts come from the per-worker context pool
+	and are returned to it automatically at the end of the request.
+	"""
+
+	pctx = bargate.lib.pool.contexts.acquire(
+		bargate.lib.pool.context_key(session['username'],srv_path),
+		app.config['SMB_WORKGROUP'],
+		session['username'],
+		bargate.lib.user.get_password())
+
+	if 'smbc_contexts' not in g:
+		g.smbc_contexts = []
+	g.smbc_contexts.append(pctx)
+
+	return pctx.context
+
+################################################################################
+################################################################################
+################################################################################
+
+def release_contexts(discard=False):
+	"""Returns all the libsmbclient contexts used during this request to the
+	context pool. If discard is True the contexts are closed instead."""
+
+	for pctx in g.get('smbc_contexts',[]):
+		if discard:
+			pctx.discard = True
+		bargate.lib.pool.contexts.release(pctx)
+
+	g.smbc_contexts = []
+
+################################################################################
+################################################################################
+################################################################################
+
+def listing_dirs(uri_as_str):
+	"""Returns a list of uri_as_str (without a trailing slash) and every
+	directory above it, up to and including the server"""
+
+	uri_as_str = uri_as_str.rstrip('/')
+	dirs = [uri_as_str]
+
+	while uri_as_str.count('/') > 2:
+		uri_as_str = uri_as_str.rpartition('/')[0]
+		dirs.append(uri_as_str)
+
+	return dirs
+
+def listing_key(uri_as_str,func_name):
+	"""Returns the key to use in the directory listing cache for the directory
+	uri_as_str as seen by the logged in user, or None if the listing
+	shouldn't be cached. Every worker process has its own cache, so the key
+	includes generation counters kept in redis which invalidate_listing
+	increments: one for the directory itself and one for it and each
+	directory above it (for recursive invalidations). Without redis a
+	worker wouldn't know about changes made via another one, so nothing is
+	cached."""
+
+	if not app.config['LISTING_CACHE'] or not bargate.lib.redisconn.available():
+		return None
+
+	dirs = listing_dirs(uri_as_str)
+
+	try:
+		generations = bargate.lib.redisconn.client.mget(['listing:dir:' + dirs[0]] + ['listing:tree:' + path for path in dirs])
+	except Exception as ex:
+		app.logger.warning("Could not get directory listing generations: " + str(type(ex)) + " " + str(ex))
+		return None
+
+	return (session['username'],dirs[0],func_name,bargate.lib.userdata.get_show_hidden_files(),tuple(generations))
+
+################################################################################
+################################################################################
+################################################################################
+
+def invalidate_listing(uri_as_str,recursive=False):
+	"""Invalidates the cached directory listings of uri_as_str for all users
+	in every worker process, by incrementing its generation counter in
+	redis (see listing_key). If recursive is True the listings of all
+	directories beneath it are invalidated too (used when a directory is
+	renamed or deleted). This process's cached listings are removed as well
+	in case redis can't be reached. Can be called outside of a request."""
+
+	uri_as_str = uri_as_str.rstrip('/')
+
+	if recursive:
+		listing_cache.invalidate(lambda key: key[1] == uri_as_str or key[1].startswith(uri_as_str + '/'))
+		key = 'listing:tree:' + uri_as_str
+	else:
+		listing_cache.invalidate(lambda key: key[1] == uri_as_str)
+		key = 'listing:dir:' + uri_as_str
+
+	if app.config['LISTING_CACHE'] and bargate.lib.redisconn.available():
+		## Once the counter has expired no listing cached with it is left
+		try:
+			p = bargate.lib.redisconn.client.pipeline()
+			p.incr(key)
+			p.expire(key,app.config['LISTING_CACHE_TTL'] * 2)
+			p.execute()
+		except Exception as ex:
+			app.logger.warning("Could not invalidate directory listing " + uri_as_str + ": " + str(type(ex)) + " " + str(ex))
+
+################################################################################
+################################################################################
+################################################################################
+
+def getDirectoryListing(libsmbclient,srv_path,srv_path_as_str,path,path_as_str,uri_as_str,func_name):
+	"""Lists the directory uri_as_str and returns a tuple of two lists, the
+	directories (and shares) and the files within it. Each item is an entry
+	dictionary as returned by processDentry. Hidden entries are omitted.
+	Listings are served from the directory listing cache when possible.
+	Raises the same exceptions as opendir."""
+
+	## Use the cached directory listing if we have one
+	cache_key = bargate.lib.smb.listing_key(uri_as_str,func_name)
+
+	if cache_key is not None:
+		listing = listing_cache.get(cache_key)
+
+		if listing is not None:
+			return listing
+
+	directory_entries = bargate.lib.smb.listDirectory(libsmbclient,uri_as_str)
+
+	## Seperate out dirs and files into two lists
+	dirs   = []
+	files  = []
+
+	for dentry in directory_entries:
+		# Create a new dict for the entry
+		entry = loadDentry(dentry, srv_path_as_str, path, path_as_str)
+
+		# Continue to next entry if we found it should be skipped
+		if entry['skip']:
+			continue
+
+		if entry['type'] == 'file':
+			files.append(entry)
+		elif entry['type'] == 'dir' or entry['type'] == 'share':
+			dirs.append(processDentry(entry,libsmbclient,func_name))
+
+	## stat the files (in parallel) to get their size and modify time
+	concurrency = app.config['SMB_STAT_CONCURRENCY']
+	if app.sharesConfig.has_option(func_name,'stat_concurrency'):
+		concurrency = app.sharesConfig.getint(func_name,'stat_concurrency')
+
+	fstats = statEntries(libsmbclient,srv_path,[entry['uri_as_str'] for entry in files],concurrency)
+
+	# Further process the files (load the icon, size, etc)
+	for entry, fstat in zip(files,fstats):
+		processDentry(entry,libsmbclient,func_name,fstat)
+
+	if cache_key is not None:
+		listing_cache.set(cache_key,(dirs, files))
+
+	return (dirs, files)
+
+################################################################################
+################################################################################
+################################################################################
+
+def sortKey(entry,sort='name',reverse=False):
+	"""Returns the key used to sort a directory entry. Directories are always
+	sorted before files, whatever the sort order. The key is a list of JSON
+	serialisable values so that it can be used in a paging cursor."""
+
+	if entry['type'] == 'file':
+		group = 1
+	else:
+		group = 0
+
+	## When sorting in reverse the group has to be flipped to keep dirs first
+	if reverse:
+		group = 1 - group
+
+	if sort == 'size':
+		value = entry.get('size',0)
+	elif sort == 'mtime':
+		value = entry.get('mtime_raw',0)
+	elif sort == 'type':
+		value = entry.get('mtype_raw',u'')
+	else:
+		value = entry['name'].lower()
+
+	return [group, value, entry['name'].lower(), entry['name']]
+
+################################################################################
+################################################################################
+################################################################################
+
+def sortEntries(dirs,files,sort='name',reverse=False):
+	"""Returns a new list of all the entries in dirs and files sorted by
+	'name', 'type', 'size' or 'mtime'"""
+
+	entries = dirs + files
+	entries.sort(key=lambda entry: sortKey(entry,sort,reverse),reverse=reverse)
+	return entries
+
+################################################################################
+################################################################################
+################################################################################
+
+def encodeCursor(key,sort,reverse):
+	"""Returns an opaque paging cursor pointing after the entry with sort key 'key'"""
+	return base64.urlsafe_b64encode(json.dumps({'k': key, 's': sort, 'r': reverse}))
+
+def decodeCursor(cursor,sort,reverse):
+	"""Returns the sort key stored in a paging cursor. Raises ValueError if
+	the cursor is invalid or was created for a different sort order."""
+
+	try:
+		data = json.loads(base64.urlsafe_b64decode(str(cursor)))
+		key  = data['k']
+	except Exception as ex:
+		raise ValueError('Invalid cursor')
+
+	if data.get('s') != sort or data.get('r') != reverse:
+		raise ValueError('The cursor does not match the sort order')
+
+	return key
+
+################################################################################
+################################################################################
+################################################################################
+
+def pageEntries(entries,sort,reverse,cursor,limit):
+	"""Returns a page of at most 'limit' entries from the sorted list entries,
+	starting after the entry the cursor points to (or from the start if cursor
+	is None). Returns a tuple of the page and the cursor for the next page,
+	which is None if this is the last page. Cursors point at a sort key rather
+	than an offset so paging continues from the right place even if entries
+	are added or removed between requests."""
+
+	start = 0
+
+	if cursor is not None:
+		after = decodeCursor(cursor,sort,reverse)
+		start = len(entries)
+
+		for idx, entry in enumerate(entries):
+			key = sortKey(entry,sort,reverse)
+			if (not reverse and key > after) or (reverse and key < after):
+				start = idx
+				break
+
+	page = entries[start:start + limit]
+
+	if start + limit < len(entries):
+		next_cursor = encodeCursor(sortKey(page[-1],sort,reverse),sort,reverse)
+	else:
+		next_cursor = None
+
+	return (page, next_cursor)
+
+################################################################################
+################################################################################
+################################################################################
+
 def wb_sid_to_name(sid):
 	import subprocess
 	process = subprocess.Popen([app.config['WBINFO_BINARY'], '--sid-to-name',sid], stdout=subprocess.PIPE)
@@ -158,6 +474,151 @@ def statEntry(libsmbclient,url):
 ################################################################################
 ################################################################################
 
+def statEntries(libsmbclient,srv_path,uris,concurrency):
+	"""Runs statEntry on each URI in the list uris using up to 'concurrency'
+	threads, each with its own libsmbclient context from the context pool.
+	Returns a list in the same order as uris where each item is either the
+	dictionary returned by statEntry or the exception raised when the stat
+	failed. If concurrency is 1 or less the stats are performed one after
+	another using libsmbclient.
+	"""
+
+	return mapEntries(libsmbclient,srv_path,statEntry,uris,concurrency)
+
+def statReadable(libsmbclient,url):
+	"""Like statEntry, but first opens the file read-only (and closes it
+	again) so that an exception is raised if the user can't read it. A stat
+	only needs the right to list the directory the file is in."""
+
+	fh = libsmbclient.open(url)
+	fh.close()
+
+	return statEntry(libsmbclient,url)
+
+def statReadableEntries(libsmbclient,srv_path,uris,concurrency):
+	"""Runs statReadable on each URI in the list uris, in the same way as
+	statEntries"""
+
+	return mapEntries(libsmbclient,srv_path,statReadable,uris,concurrency)
+
+def mapEntries(libsmbclient,srv_path,func,items,concurrency):
+	"""Calls func(context, item) for each item in the list items using up to
+	'concurrency' threads, each with its own libsmbclient context from the
+	context pool (libsmbclient contexts can't be shared between threads).
+	Returns a list of what func returned, in the same order as items, where
+	any exception raised by func is returned in place of the result. If
+	concurrency is 1 or less the calls are made one after another using
+	libsmbclient.
+	"""
+
+	results = [None] * len(items)
+
+	if concurrency <= 1 or len(items) <= 1:
+		for idx, item in enumerate(items):
+			try:
+				results[idx] = func(libsmbclient,item)
+			except Exception as ex:
+				results[idx] = ex
+		return results
+
+	## The worker threads can't access the Flask session, so work out the
+	## credentials and the pool key now
+	key       = bargate.lib.pool.context_key(session['username'],srv_path)
+	workgroup = app.config['SMB_WORKGROUP']
+	username  = session['username']
+	password  = bargate.lib.user.get_password()
+
+	work = Queue.Queue()
+	for idx, item in enumerate(items):
+		work.put((idx, item))
+
+	def worker():
+		pctx = bargate.lib.pool.contexts.acquire(key,workgroup,username,password)
+		try:
+			while True:
+				try:
+					(idx, item) = work.get_nowait()
+				except Queue.Empty:
+					return
+
+				try:
+					results[idx] = func(pctx.context,item)
+				except Exception as ex:
+					results[idx] = ex
+		finally:
+			bargate.lib.pool.contexts.release(pctx)
+
+	threads = []
+	for i in range(min(concurrency,len(items))):
+		thread = threading.Thread(target=worker)
+		thread.daemon = True
+		thread.start()
+		threads.append(thread)
+
+	for thread in threads:
+		thread.join()
+
+	return results
+
+################################################################################
+################################################################################
+################################################################################
+
+class TooLargeError(ValueError):
+	"""Raised by renderEntry when a file is too large to preview"""
+	pass
+
+def previewEntry(libsmbclient,uri_as_str,name,size='small',fmt='jpeg'):
+	"""Returns a (cache key, image data) tuple with the preview thumbnail of
+	the image file uri_as_str whose file name is 'name'. 'size' is the name of
+	one of IMAGE_PREVIEW_SIZES and 'fmt' one of bargate.lib.thumbnail.FORMATS.
+	Raises an exception if the file can't be previewed.
+	"""
+
+	pixels = bargate.lib.thumbnail.get_size(size)
+	return renderEntry(libsmbclient,uri_as_str,name,(pixels,pixels),fmt,app.config['IMAGE_PREVIEW_MAX_SIZE'])
+
+def renderEntry(libsmbclient,uri_as_str,name,size,fmt,max_file_size):
+	"""Returns a (cache key, image data) tuple with a copy of the image file
+	uri_as_str (whose file name is 'name') scaled down to fit in size, a
+	(width, height) tuple, in the format fmt. The file is always opened
+	with the user's credentials before the (shared) thumbnail cache is
+	used, as a stat only needs the right to list the directory, not to read
+	the file. Raises ValueError if the file isn't an image, TooLargeError if
+	it is larger than max_file_size bytes, and pysmbc's exceptions if it
+	can't be stat'ed or read.
+	"""
+
+	fstat = libsmbclient.stat(uri_as_str)
+
+	## ensure item is a file
+	if not bargate.lib.smb.statToType(fstat) == SMB_FILE:
+		raise ValueError('Only files can be previewed')
+
+	## guess a mimetype
+	(ftype,mtype) = bargate.lib.mime.filename_to_mimetype(name)
+
+	## Check size is not too large for a preview
+	if fstat[6] > max_file_size:
+		raise TooLargeError('The file is too large to preview')
+
+	## Only preview files that Pillow supports
+	if not mtype in bargate.lib.mime.pillow_supported:
+		raise ValueError('The file is not an image which can be previewed')
+
+	## Check the user can read the file before looking in the cache
+	file_object = libsmbclient.open(uri_as_str)
+
+	try:
+		key = bargate.lib.thumbnail.variant_key(uri_as_str,fstat[6],fstat[8],size,fmt)
+		return (key, bargate.lib.thumbnail.cache.get_or_create(key,lambda: bargate.lib.thumbnail.create(file_object,mtype,size,fmt)))
+	finally:
+		file_object.close()
+
+################################################################################
+################################################################################
+################################################################################
+
 def getEntryType(libsmbclient,uri):
 	## stat the file, st_mode has all the info we need
 
@@ -198,8 +659,46 @@ def statToType(fstat):
 ################################################################################
 ################################################################################
 
+def listDirectory(libsmbclient,uri_as_str):
+	"""Lists the contents of the directory uri_as_str and returns the list of
+	dentries from pysmbc's getdents. These only have a name and a type, so
+	callers must stat() entries to get their size and modify time. Raises
+	the same exceptions as opendir."""
+
+	return libsmbclient.opendir(uri_as_str).getdents()
+
+################################################################################
+################################################################################
+################################################################################
+
+def hiddenName(name):
+	"""Returns True if a file or directory called 'name' is a 'hidden' one,
+	which isn't shown unless the user has chosen to see hidden files"""
+
+	## UNIX hidden files
+	if name.startswith('.'):
+		return True
+
+	## Office temporary files
+	if name.startswith('~$'):
+		return True
+
+	## Other horrible Windows files
+	hidden_entries = ['desktop.ini', '$RECYCLE.BIN', 'RECYCLER', 'Thumbs.db']
+
+	return name in hidden_entries
+
+################################################################################
+
 def loadDentry(dentry,srv_path_as_str, path, path_as_str):
-	"""This function takes a directory entry returned from getdents and returns
+	"""Calls loadEntry with the name and type of a directory entry returned
+	from getdents"""
+
+	return loadEntry(dentry.name,dentry.smbc_type,srv_path_as_str,path,path_as_str)
+
+def loadEntry(name,smbc_type,srv_path_as_str, path, path_as_str):
+	"""This function takes the name and type (one of the SMB_ constants) of
+		a directory entry and returns
 		a dictionary of information about the dentry. Its primary purpose is
 		to return unicode and str objects for the name, path and URI of the entry
 		and determine if the entry should be 'skipped'.
@@ -218,7 +717,7 @@ def loadDentry(dentry,srv_path_as_str, path, path_as_str):
 			- skip			Should this entry be shown to the user or not
 		"""
 
-	entry = {'skip': False, 'name': dentry.name}
+	entry = {'skip': False, 'name': name}
 
 	## In earlier versions of pysmbc getdents returns regular python str objects
 	## and not unicode, so we have to convert to unicode via .decode. However, from
@@ -254,28 +753,17 @@ def loadDentry(dentry,srv_path_as_str, path, path_as_str):
 
 	## Hide hidden files if the user has selected to do so (the default)
 	if not bargate.lib.userdata.get_show_hidden_files():
-		## UNIX hidden files
-		if entry['name'].startswith('.'):
-			entry['skip'] = True
-
-		## Office temporary files
-		if entry['name'].startswith('~$'):
-			entry['skip'] = True
-
-		## Other horrible Windows files
-		hidden_entries = ['desktop.ini', '$RECYCLE.BIN', 'RECYCLER', 'Thumbs.db']
-
-		if entry['name'] in hidden_entries:
+		if hiddenName(entry['name']):
 			entry['skip'] = True
 
-	if dentry.smbc_type == bargate.lib.smb.SMB_FILE:
+	if smbc_type == bargate.lib.smb.SMB_FILE:
 		entry['type'] = 'file'
 
-	elif dentry.smbc_type == bargate.lib.smb.SMB_DIR:
+	elif smbc_type == bargate.lib.smb.SMB_DIR:
 		entry['type'] = 'dir'
 
 
-	elif dentry.smbc_type == bargate.lib.smb.SMB_SHARE:
+	elif smbc_type == bargate.lib.smb.SMB_SHARE:
 		entry['type'] = 'share'
 
 		## check last char for $ ('administrative' shares)
@@ -291,13 +779,61 @@ def loadDentry(dentry,srv_path_as_str, path, path_as_str):
 ################################################################################
 ################################################################################
 
-def processDentry(entry,libsmbclient,func_name):
+def walkTree(libsmbclient,srv_path_as_str,path,path_as_str,uri_as_str):
+	"""A generator which walks the directory uri_as_str (whose path is 'path')
+	depth first, yielding the entry dictionary (see loadDentry) of every file
+	and directory beneath it. Entries that would be hidden when
+	browsing are skipped, as are the contents of hidden directories.
+	Directories that can't be listed are logged and skipped.
+	"""
+
+	## Only one directory listing per level of the tree is held in memory
+	stack = [(path,path_as_str,uri_as_str)]
+
+	while len(stack) > 0:
+		(dir_path,dir_path_as_str,dir_uri_as_str) = stack.pop()
+
+		try:
+			dentries = listDirectory(libsmbclient,dir_uri_as_str)
+		except Exception as ex:
+			app.logger.warning("bargate.lib.smb.walkTree could not list " + dir_uri_as_str + ": " + str(type(ex)) + ": " + str(ex))
+			continue
+
+		subdirs = []
+		for dentry in dentries:
+			entry = loadDentry(dentry,srv_path_as_str,dir_path,dir_path_as_str)
+
+			if entry['skip'] or entry['type'] not in ['file','dir']:
+				continue
+
+			yield entry
+
+			if entry['type'] == 'dir':
+				if len(dir_path_as_str) == 0:
+					entry_path_as_str = urllib.quote(entry['name_as_str'])
+				else:
+					entry_path_as_str = dir_path_as_str + '/' + urllib.quote(entry['name_as_str'])
+
+				subdirs.append((entry['path'],entry_path_as_str,entry['uri_as_str']))
+
+		## Walk subdirectories in the order they were listed
+		subdirs.reverse()
+		stack.extend(subdirs)
+
+################################################################################
+################################################################################
+################################################################################
+
+def processDentry(entry,libsmbclient,func_name,fstat=None):
 	"""This function takes a directory entry returned from the loadDentry
 		function (a dictionary) and performs further processing on the dentry 
 		via stat() if its a file and infers information such as mimetype and 
 		icon from the entry name. This is used by the browse function and also 
 		by the search function (but only when it finds a matching filename).
 
+		If the file has already been stat'ed (see statEntries) then the result
+		should be passed as fstat, and stat() will not be called again.
+
 		The dictionary returned contains the following ADDITIONAL keys:
 
 			For all types:
@@ -336,7 +872,10 @@ def processDentry(entry,libsmbclient,func_name):
 		try:
 
 			## For files we stat the file and look up a bunch of stuff
-			fstat = statEntry(libsmbclient,entry['uri_as_str'])
+			if fstat is None:
+				fstat = statEntry(libsmbclient,entry['uri_as_str'])
+			elif isinstance(fstat,Exception):
+				raise fstat
 		except Exception as ex:
 			## If the file stat failed we return a result with the data missing
 			## rather than fail the entire page load
@@ -368,13 +907,20 @@ def processDentry(entry,libsmbclient,func_name):
 			entry['view'] = url_for(func_name,path=entry['path'],action='view')
 			entry['open'] = entry['view']
 
+		## Images are viewed as a copy scaled to fit the screen
+		if app.config['IMAGE_VIEW'] and entry['mtype_raw'] in bargate.lib.mime.pillow_supported:
+			if 0 < int(entry['size']) <= app.config['IMAGE_VIEW_MAX_SIZE']:
+				entry['view'] = url_for(func_name,path=entry['path'],action='imageview')
+				entry['open'] = entry['view']
+
 	elif entry['type'] == 'dir':
 		## Set the icon for directories
 		entry['icon'] = 'fa fa-fw fa-folder'
 
 		## Generate URLs to this directory
-		entry['stat'] = url_for(func_name,path=entry['path'],action='stat')
-		entry['open'] = url_for(func_name,path=entry['path'])
+		entry['stat']         = url_for(func_name,path=entry['path'],action='stat')
+		entry['open']         = url_for(func_name,path=entry['path'])
+		entry['download_zip'] = url_for(func_name,path=entry['path'],action='download_zip')
 
 	elif entry['type'] == 'share':
 		## Set the icon for shares
@@ -426,7 +972,7 @@ def connection(srv_path,func_name,active=None,display_name="Home",action='browse
 	parent_redirect = redirect(url_for(func_name))
 
 	## Prepare to talk to the file server
-	libsmbclient = smbc.Context(auth_fn=bargate.lib.user.get_smbc_auth)
+	libsmbclient = bargate.lib.smb.get_context(srv_path)
 
 	############################################################################
 	## HTTP GET ACTIONS ########################################################
@@ -506,14 +1052,120 @@ def connection(srv_path,func_name,active=None,display_name="Home",action='browse
 					if bargate.lib.mime.view_in_browser(mtype):
 						attach = False
 
-				## Send the file to the user
-				resp = make_response(send_file(file_object,add_etags=False,as_attachment=attach,attachment_filename=entryname,mimetype=mtype))
-				resp.headers['content-length'] = str(fstat[6])
-				return resp
+				## Send the file (or the byte ranges of it requested) to the user
+				return bargate.lib.download.send_smbc_file(file_object,entryname,mtype,fstat[6],fstat[8],as_attachment=attach)
 	
 			except Exception as ex:
 				return bargate.lib.errors.smbc_handler(ex,uri_as_str,error_redirect)
 
+################################################################################
+# DOWNLOAD A DIRECTORY (OR SELECTED ITEMS) AS A ZIP FILE
+################################################################################
+
+		elif action == 'download_zip':
+			if not app.config['ZIP_DOWNLOAD']:
+				abort(400)
+
+			## Either download the directory 'path' itself, or the entries within
+			## it whose names are given by 'name' (a multiple selection)
+			names = request.args.getlist('name')
+
+			for name in names:
+				try:
+					bargate.lib.smb.check_name(name)
+				except ValueError as e:
+					return bargate.lib.errors.invalid_name(error_redirect)
+
+			try:
+				fstat = libsmbclient.stat(uri_as_str)
+			except Exception as ex:
+				return bargate.lib.errors.smbc_handler(ex,uri_as_str,error_redirect)
+
+			if not bargate.lib.smb.statToType(fstat) == SMB_DIR:
+				return bargate.lib.errors.invalid_item_type(error_redirect)
+
+			## Name the archive after the directory (or the share at the top level)
+			if len(entryname) == 0:
+				zipname = srv_path.rstrip('/').rsplit('/',1)[-1]
+			else:
+				zipname = entryname
+
+			## Work out what goes in the archive: (name in archive, path, path_as_str, uri, stat)
+			items = []
+			if len(names) == 0:
+				items.append((zipname,path,path_as_str,uri_as_str,fstat))
+			else:
+				for name in names:
+					name_as_str = urllib.quote(name.encode('utf-8'))
+
+					if len(path) == 0:
+						item_path        = name
+						item_path_as_str = name_as_str
+					else:
+						item_path        = path + '/' + name
+						item_path_as_str = path_as_str + '/' + name_as_str
+
+					try:
+						item_stat = libsmbclient.stat(uri_as_str + '/' + name_as_str)
+					except Exception as ex:
+						return bargate.lib.errors.smbc_handler(ex,uri_as_str + '/' + name_as_str,error_redirect)
+
+					items.append((name,item_path,item_path_as_str,uri_as_str + '/' + name_as_str,item_stat))
+
+			store_extensions = app.config['ZIP_STORE_EXTENSIONS']
+
+			def add_file(archive,arcname,file_uri,size,mtime):
+				try:
+					file_object = libsmbclient.open(file_uri)
+				except Exception as ex:
+					app.logger.warning("Omitting " + file_uri + " from a zip download, could not open it: " + str(type(ex)) + ": " + str(ex))
+					return []
+
+				## Don't waste time deflating already compressed media
+				compress = arcname.rsplit('.',1)[-1].lower() not in store_extensions
+
+				return archive.add_file(arcname,mtime,size,bargate.lib.download.read_ahead(file_object,0,size),compress)
+
+			def generate():
+				archive = bargate.lib.zipstream.ZipStream(app.config['ZIP_COMPRESS_LEVEL'])
+
+				for (arcname,item_path,item_path_as_str,item_uri,item_stat) in items:
+					if bargate.lib.smb.statToType(item_stat) == SMB_FILE:
+						for block in add_file(archive,arcname,item_uri,item_stat[6],item_stat[8]):
+							yield block
+						continue
+
+					for block in archive.add_dir(arcname,item_stat[8]):
+						yield block
+
+					for entry in walkTree(libsmbclient,srv_path_as_str,item_path,item_path_as_str,item_uri):
+						## The name of the entry within the archive
+						if len(item_path) == 0:
+							entry_arcname = arcname + '/' + entry['path']
+						else:
+							entry_arcname = arcname + entry['path'][len(item_path):]
+
+						try:
+							entry_stat = statEntry(libsmbclient,entry['uri_as_str'])
+						except Exception as ex:
+							app.logger.warning("Omitting " + entry['uri_as_str'] + " from a zip download, could not stat it: " + str(type(ex)) + ": " + str(ex))
+							continue
+
+						if entry['type'] == 'dir':
+							blocks = archive.add_dir(entry_arcname,entry_stat['mtime'])
+						else:
+							blocks = add_file(archive,entry_arcname,entry['uri_as_str'],entry_stat['size'],entry_stat['mtime'])
+
+						for block in blocks:
+							yield block
+
+				for block in archive.finish():
+					yield block
+
+			headers = Headers()
+			headers.add('Content-Disposition','attachment',filename=zipname + '.zip')
+			return Response(stream_with_context(generate()),200,headers,mimetype='application/zip',direct_passthrough=True)
+
 ################################################################################
 # IMAGE PREVIEW
 ################################################################################
@@ -522,47 +1174,129 @@ def connection(srv_path,func_name,active=None,display_name="Home",action='browse
 			if not app.config['IMAGE_PREVIEW']:
 				abort(400)
 
+			## Which size of thumbnail, and send WebP if the browser supports it
+			size = request.args.get('size','small')
+			fmt  = bargate.lib.thumbnail.negotiate_format(request.accept_mimetypes)
+
 			try:
-				fstat = libsmbclient.stat(uri_as_str)
+				(key, data) = bargate.lib.smb.previewEntry(libsmbclient,uri_as_str,entryname,size,fmt)
+			except bargate.lib.smb.TooLargeError as ex:
+				abort(403)
+			except bargate.lib.errors.SMBC_ERRORS as ex:
+				return bargate.lib.errors.smbc_handler(ex,uri_as_str,error_redirect)
 			except Exception as ex:
 				abort(400)
 
-			## ensure item is a file
-			if not bargate.lib.smb.statToType(fstat) == SMB_FILE:
-				abort(400)
-				
-			## guess a mimetype
-			(ftype,mtype) = bargate.lib.mime.filename_to_mimetype(entryname)
-			
-			## Check size is not too large for a preview
-			if fstat[6] > app.config['IMAGE_PREVIEW_MAX_SIZE']:
-				abort(403)
+			response = make_response(data)
+			response.headers['Content-Type'] = bargate.lib.thumbnail.FORMATS[fmt]
+			response.headers['Vary'] = 'Accept'
+			response.set_etag(key)
+			return response.make_conditional(request)
+
+################################################################################
+# VIEW AN IMAGE SCALED TO FIT THE SCREEN
+################################################################################
 
-			## Only preview files that Pillow supports
-			if not mtype in bargate.lib.mime.pillow_supported:
+		elif action == 'imageview':
+			if not app.config['IMAGE_VIEW']:
 				abort(400)
 
-			## Open the file
 			try:
-				file_object = libsmbclient.open(uri_as_str)
+				fstat = libsmbclient.stat(uri_as_str)
 			except Exception as ex:
 				return bargate.lib.errors.smbc_handler(ex,uri_as_str,error_redirect)
-			
-			## Read the file into memory first (hence a file size limit) because PIL/Pillow tries readline()
-			## on pysmbc's File like objects which it doesn't support
+
+			if not bargate.lib.smb.statToType(fstat) == SMB_FILE:
+				return bargate.lib.errors.invalid_item_type(error_redirect)
+
+			(ftype,mtype) = bargate.lib.mime.filename_to_mimetype(entryname)
+
+			## Link to the original too, viewed in the browser if it can be
+			if bargate.lib.mime.view_in_browser(mtype):
+				url_original = url_for(func_name,path=path,action='view')
+			else:
+				url_original = None
+
+			return render_template('image-view.html',
+				active=active,
+				filename=entryname,
+				size=fstat[6],
+				url_render=url_for(func_name,path=path,action='render'),
+				url_original=url_original,
+				url_download=url_for(func_name,path=path,action='download'),
+				url_parent_dir=url_for(func_name,path=parent_directory_path))
+
+		elif action == 'render':
+			if not app.config['IMAGE_VIEW']:
+				abort(400)
+
+			## The size of the user's screen (in device pixels)
+			try:
+				width  = int(request.args.get('w',1920))
+				height = int(request.args.get('h',1080))
+			except ValueError as e:
+				abort(400)
+
+			size = bargate.lib.thumbnail.get_view_size(width,height)
+			fmt  = bargate.lib.thumbnail.negotiate_format(request.accept_mimetypes)
+
 			try:
-				sfile = StringIO.StringIO(file_object.read())
-				pil_img = Image.open(sfile).convert('RGB')
-				size = 200, 200
-				pil_img.thumbnail(size, Image.ANTIALIAS)
-
-				img_io = StringIO.StringIO()
-				pil_img.save(img_io, 'JPEG', quality=85)
-				img_io.seek(0)
-				return send_file(img_io, mimetype='image/jpeg',add_etags=False)
+				(key, data) = bargate.lib.smb.renderEntry(libsmbclient,uri_as_str,entryname,size,fmt,app.config['IMAGE_VIEW_MAX_SIZE'])
+			except bargate.lib.smb.TooLargeError as ex:
+				abort(403)
+			except bargate.lib.errors.SMBC_ERRORS as ex:
+				return bargate.lib.errors.smbc_handler(ex,uri_as_str,error_redirect)
 			except Exception as ex:
 				abort(400)
 
+			response = make_response(data)
+			response.headers['Content-Type'] = bargate.lib.thumbnail.FORMATS[fmt]
+			response.headers['Vary'] = 'Accept'
+			response.set_etag(key)
+			return response.make_conditional(request)
+
+################################################################################
+# IMAGE PREVIEWS FOR MANY FILES IN A DIRECTORY - json ajax request
+################################################################################
+
+		elif action == 'previews':
+			if not app.config['IMAGE_PREVIEW']:
+				abort(400)
+
+			## The names of the files (in the directory 'path') to preview
+			names = request.args.getlist('name')[:app.config['IMAGE_PREVIEW_BATCH_MAX']]
+
+			items = []
+			for name in names:
+				try:
+					bargate.lib.smb.check_name(name)
+				except ValueError as e:
+					continue
+
+				items.append((uri_as_str + '/' + urllib.quote(name.encode('utf-8')),name))
+
+			size = request.args.get('size','small')
+			fmt  = bargate.lib.thumbnail.negotiate_format(request.accept_mimetypes)
+
+			try:
+				bargate.lib.thumbnail.get_size(size)
+			except ValueError as e:
+				abort(400)
+
+			## Create the thumbnails in parallel (decoding is limited separately)
+			results = mapEntries(libsmbclient,srv_path,lambda context, item: previewEntry(context,item[0],item[1],size,fmt),items,app.config['IMAGE_PREVIEW_BATCH_CONCURRENCY'])
+
+			## Send each thumbnail as a data URI. Files which couldn't be
+			## previewed are left out.
+			previews = {}
+			for ((item_uri, name), result) in zip(items,results):
+				if not isinstance(result,Exception):
+					previews[name] = 'data:' + bargate.lib.thumbnail.FORMATS[fmt] + ';base64,' + base64.b64encode(result[1])
+
+			response = jsonify({'error': 0, 'previews': previews})
+			response.headers['Vary'] = 'Accept'
+			return response
+
 ################################################################################
 # STAT FILE/DIR - json ajax request
 ################################################################################
@@ -621,31 +1355,181 @@ def connection(srv_path,func_name,active=None,display_name="Home",action='browse
 
 			query   = request.args.get('q')
 
-			searchEngine = RecursiveSearchEngine(libsmbclient,func_name,path,path_as_str,srv_path_as_str,uri_as_str,query)
-			results, timeout_reached = searchEngine.search()
+			## Search file names, or the contents of files if they are indexed
+			mode    = request.args.get('mode','names')
+			if mode != 'contents':
+				mode = 'names'
 
-			if timeout_reached:
-				flash("Some search results have been omitted because the search took too long to perform.","alert-warning")
+			try:
+				bargate.lib.search.check(func_name,path,query,mode)
+			except ValueError as ex:
+				return bargate.lib.errors.invalid_search(unicode(ex),redirect(url_for(func_name,path=path)))
+
+			## The search form can ask for every share to be searched instead
+			if request.args.get('all',False) and app.config['SEARCH_ALL_SHARES'] and mode == 'names':
+				return redirect(url_for('search_all',q=query))
+
+			## A search which has been saved (see bargate.lib.search.save) is
+			## carried on from where it got to when its token is given, by the
+			## link to more results. Without a token the search starts again.
+			## Contents searches always finish so they aren't saved.
+			token    = request.args.get('token',None)
+			url_more = None
+
+			## Streamed searches start once the page has loaded, see 'searchstream'
+			if app.config['SEARCH_STREAM']:
+				results    = []
+				url_stream = url_for(func_name,path=path,action='searchstream',q=query,token=token,mode=mode if mode == 'contents' else None)
+			elif mode == 'contents':
+				url_stream   = None
+				searchEngine = bargate.lib.search.get_engine(libsmbclient,func_name,path,path_as_str,srv_path_as_str,uri_as_str,query,mode=mode)
+				results, timeout_reached = searchEngine.search()
+
+				if timeout_reached:
+					flash("Some search results have been omitted because the search took too long to perform.","alert-warning")
+			else:
+				url_stream     = None
+				(token, state) = bargate.lib.search.load(func_name,path,query,token)
+				searchEngine   = bargate.lib.search.get_engine(libsmbclient,func_name,path,path_as_str,srv_path_as_str,uri_as_str,query,state=state)
+				results, timeout_reached = searchEngine.search()
+				token          = bargate.lib.search.save(searchEngine,token)
+
+				if timeout_reached:
+					flash("Some search results have been omitted because the search took too long to perform.","alert-warning")
+
+					## Only walks of the file server can be carried on
+					if token is not None and len(searchEngine.frontier) > 0:
+						url_more = url_for(func_name,path=path,action='search',q=query,token=token)
+
+			if not app.config['SEARCH_STREAM'] and searchEngine.truncated:
+				flash("Only the first " + str(len(results)) + " results are shown, please narrow down your search.","alert-warning")
 
 			return render_template('search.html',
 				results=results,
+				url_stream=url_stream,
+				url_more=url_more,
 				query=query,
+				mode=mode,
 				path=path,
 				root_display_name = display_name,
 				search_mode=True,
 				url_home=url_for(func_name),
+				url_upload=url_for(func_name,path=path,action='jsonupload'),
 				crumbs=crumbs,
 				on_file_click=bargate.lib.userdata.get_on_file_click())
 			
+################################################################################
+# SEARCH RESULTS AS THEY ARE FOUND - server-sent events
+################################################################################
+
+		elif action == 'searchstream':
+			if not app.config['SEARCH_ENABLED'] or not app.config['SEARCH_STREAM']:
+				abort(404)
+
+			if 'q' not in request.args:
+				abort(400)
+
+			query          = request.args.get('q')
+			mode           = request.args.get('mode','names')
+
+			if mode == 'contents':
+				(token, state) = (None, None)
+			else:
+				(token, state) = bargate.lib.search.load(func_name,path,query,request.args.get('token',None))
+
+			try:
+				bargate.lib.search.check(func_name,path,query,mode)
+				searchEngine = bargate.lib.search.get_engine(libsmbclient,func_name,path,path_as_str,srv_path_as_str,uri_as_str,query,app.config['SEARCH_STREAM_TIMEOUT'],state,mode)
+			except ValueError as ex:
+				abort(400)
+
+			on_file_click = bargate.lib.userdata.get_on_file_click()
+			render_result = get_template_attribute('search-entries.html','result_entry')
+
+			def finished(data):
+				if mode == 'contents':
+					return
+
+				## Save the search so it can be carried on
+				saved = bargate.lib.search.save(searchEngine,token)
+				if searchEngine.timeout_reached and saved is not None and len(searchEngine.frontier) > 0:
+					data['more'] = url_for(func_name,path=path,action='searchstream',q=query,token=saved)
+
+			events = bargate.lib.search.stream(searchEngine,lambda entry: render_result(entry,on_file_click,display_name),finished)
+
+			response = Response(stream_with_context(events),mimetype='text/event-stream')
+			response.headers['Cache-Control'] = 'no-cache'
+			## Stop nginx buffering the events
+			response.headers['X-Accel-Buffering'] = 'no'
+			return response
+
+################################################################################
+# PAGINATED DIRECTORY LISTING - json ajax request
+################################################################################
+
+		elif action == 'jsonbrowse':
+
+			## What page of what sort order has been asked for
+			sort = request.args.get('sort','name')
+			if sort not in BROWSE_SORT_KEYS:
+				abort(400)
+
+			reverse = request.args.get('order','asc') == 'desc'
+			cursor  = request.args.get('cursor',None)
+
+			try:
+				limit = int(request.args.get('limit',app.config['BROWSE_PAGE_SIZE']))
+			except ValueError as ex:
+				abort(400)
+
+			limit = max(1,min(limit,app.config['BROWSE_PAGE_SIZE_MAX']))
+
+			try:
+				(dirs, files) = bargate.lib.smb.getDirectoryListing(libsmbclient,srv_path,srv_path_as_str,path,path_as_str,uri_as_str,func_name)
+			except Exception as ex:
+				return jsonify({'error': 1, 'reason': 'An error occured: ' + str(type(ex)) + ": " + str(ex)})
+
+			entries = bargate.lib.smb.sortEntries(dirs,files,sort,reverse)
+
+			try:
+				(page, next_cursor) = bargate.lib.smb.pageEntries(entries,sort,reverse,cursor,limit)
+			except ValueError as ex:
+				abort(400)
+
+			## The HTML for each entry is rendered using the same macros as the
+			## directory templates so that pages can be added to the view as-is
+			layout          = bargate.lib.userdata.get_layout()
+			on_file_click   = bargate.lib.userdata.get_on_file_click()
+			render_dir      = get_template_attribute('directory-' + layout + '-entries.html','dir_entry')
+			render_file     = get_template_attribute('directory-' + layout + '-entries.html','file_entry')
+
+			data = []
+			for entry in page:
+				item = dict((key, entry[key]) for key in BROWSE_JSON_KEYS if key in entry)
+
+				if entry['type'] == 'file':
+					item['html'] = render_file(entry,on_file_click)
+				else:
+					item['html'] = render_dir(entry)
+
+				data.append(item)
+
+			if next_cursor is not None:
+				next_url = url_for(func_name,path=path,action='jsonbrowse',sort=sort,order=request.args.get('order','asc'),limit=limit,cursor=next_cursor)
+			else:
+				next_url = None
+
+			return jsonify({'error': 0, 'entries': data, 'total': len(entries), 'cursor': next_cursor, 'next': next_url})
+
 ################################################################################
 # BROWSE / DIRECTORY / LIST FILES
 ################################################################################
 		
-		elif action == 'browse':		
+		elif action == 'browse':
 
 			## Try getting directory contents
 			try:
-				directory_entries = libsmbclient.opendir(uri_as_str).getdents()
+				(dirs, files) = bargate.lib.smb.getDirectoryListing(libsmbclient,srv_path,srv_path_as_str,path,path_as_str,uri_as_str,func_name)
 			except smbc.NotDirectoryError as ex:
 				## If there is a parent directory, go up to it
 				if parent_directory:
@@ -656,25 +1540,18 @@ def connection(srv_path,func_name,active=None,display_name="Home",action='browse
 			except Exception as ex:
 				return bargate.lib.errors.smbc_handler(ex,uri,error_redirect)
 
-			## Seperate out dirs and files into two lists
-			dirs  = []
-			files = []
-
-			for dentry in directory_entries:
-				# Create a new dict for the entry
-				entry = loadDentry(dentry, srv_path_as_str, path, path_as_str)
+			## Only render the first page of entries, sorted by name. Further
+			## pages are loaded on demand via the 'jsonbrowse' action.
+			entries = bargate.lib.smb.sortEntries(dirs,files)
+			(page, next_cursor) = bargate.lib.smb.pageEntries(entries,'name',False,None,app.config['BROWSE_PAGE_SIZE'])
 
-				# Continue to next entry if we found it should be skipped
-				if entry['skip']:
-					continue
-				else:
-					# Further process the entry (stat it, load the icon, etc)
-					entry = processDentry(entry,libsmbclient,func_name)
+			if next_cursor is not None:
+				url_next_page = url_for(func_name,path=path,action='jsonbrowse',cursor=next_cursor)
+			else:
+				url_next_page = None
 
-				if entry['type'] == 'file':
-					files.append(entry)
-				elif entry['type'] == 'dir' or entry['type'] == 'share':
-					dirs.append(entry)
+			dirs  = [entry for entry in page if entry['type'] != 'file']
+			files = [entry for entry in page if entry['type'] == 'file']
 
 			## Build a breadcrumbs trail ##
 			crumbs = []
@@ -695,12 +1572,31 @@ def connection(srv_path,func_name,active=None,display_name="Home",action='browse
 				
 			## are there any items?
 			no_items = False
-			if len(files) == 0 and len(dirs) == 0:
+			if len(entries) == 0:
 				no_items = True
 
 			## What layout does the user want?
 			layout = bargate.lib.userdata.get_layout()
 
+			## Start creating the thumbnails the grid will ask for, in the order
+			## they'll be shown. This also abandons any still being created for
+			## the directory the user was looking at before.
+			if app.config['THUMBNAIL_PREWARM']:
+				## The grid asks for the smallest size, in the format this browser supports
+				pixels  = bargate.lib.thumbnail.get_size('small')
+				fmt     = bargate.lib.thumbnail.negotiate_format(request.accept_mimetypes)
+				prewarm = []
+
+				## has() only saves queueing thumbnails which already exist, the
+				## thumbnails themselves are only sent by previewEntry once the
+				## user has opened the file
+				if layout == 'grid':
+					for entry in entries:
+						if 'img_preview' in entry and not bargate.lib.thumbnail.cache.has(bargate.lib.thumbnail.variant_key(entry['uri_as_str'],entry['size'],entry['mtime_raw'],(pixels,pixels),fmt)):
+							prewarm.append((entry['uri_as_str'],entry['name']))
+
+				bargate.lib.prewarm.prewarmer.add(srv_path,app.config['SMB_WORKGROUP'],session['username'],bargate.lib.user.get_password(),prewarm[:app.config['THUMBNAIL_PREWARM_MAX']],'small',fmt)
+
 			## Render the template
 			return render_template('directory-' + layout + '.html',
 				active=active,
@@ -710,6 +1606,9 @@ def connection(srv_path,func_name,active=None,display_name="Home",action='browse
 				path=path,
 				cwd=entryname,
 				url_home=url_for(func_name),
+				url_upload=url_for(func_name,path=path,action='jsonupload'),
+				url_download_zip=url_for(func_name,path=path,action='download_zip'),
+				url_previews=url_for(func_name,path=path,action='previews'),
 				url_parent_dir=url_for(func_name,path=parent_directory_path),
 				url_bookmark=url_for('bookmarks'),
 				url_search=url_for(func_name,path=path,action="search"),
@@ -719,6 +1618,8 @@ def connection(srv_path,func_name,active=None,display_name="Home",action='browse
 				root_display_name = display_name,
 				on_file_click=bargate.lib.userdata.get_on_file_click(),
 				no_items = no_items,
+				url_next_page = url_next_page,
+				url_first_page = url_for(func_name,path=path,action='jsonbrowse'),
 			)
 
 		else:
@@ -736,10 +1637,15 @@ def connection(srv_path,func_name,active=None,display_name="Home",action='browse
 		## we do this because we need, in javascript, to be able to change these
 		## without having to regenerate the URL in the <form>
 		## as such, the path and action are not sent via bargate POSTs anyway
+		##
+		## The exception is uploads: the upload is written to the file server
+		## as the request body is parsed, so the action and path must be
+		## known before we look at the form (i.e. they come from the URL)
 
 		## Get the action and path
-		action = request.form['action']
-		path   = request.form['path']
+		if action != 'jsonupload':
+			action = request.form['action']
+			path   = request.form['path']
 		
 		## Check the path is valid
 		try:
@@ -775,6 +1681,12 @@ def connection(srv_path,func_name,active=None,display_name="Home",action='browse
 			parent_directory = False
 			parent_directory_path = ""
 
+		## The URI of the directory containing the item the action is performed on
+		if parent_directory:
+			parent_uri_as_str = srv_path_as_str + parent_directory_path_as_str
+		else:
+			parent_uri_as_str = srv_path_as_str
+
 		## parent_directory is either True/False if there is one
 		## entryname will either be the part after the last / or the full path
 		## parent_directory_path will be empty string or the parent directory path
@@ -785,84 +1697,12 @@ def connection(srv_path,func_name,active=None,display_name="Home",action='browse
 
 		if action == 'jsonupload':
 		
-			ret = []
-			
-			uploaded_files = request.files.getlist("files[]")
-			
-			for ufile in uploaded_files:
-			
-				if bargate.lib.core.banned_file(ufile.filename):
-					ret.append({'name' : ufile.filename, 'error': 'Filetype not allowed'})
-					continue
-					
-				## Make the filename "secure" - see http://flask.pocoo.org/docs/patterns/fileuploads/#uploading-files
-				filename = bargate.lib.core.secure_filename(ufile.filename)
-				upload_uri_as_str = uri_as_str + '/' + urllib.quote(filename.encode('utf-8'))
+			## Write the uploaded files to the file server as they are received
+			ret = bargate.lib.upload.upload(libsmbclient,uri_as_str)
 
-				## Check the new file name is valid
-				try:
-					bargate.lib.smb.check_name(filename)
-				except ValueError as e:
-					ret.append({'name' : ufile.filename, 'error': 'Filename not allowed'})
-					continue
-					
-				## Check to see if the file exists
-				fstat = None
-				try:
-					fstat = libsmbclient.stat(upload_uri_as_str)
-				except smbc.NoEntryError:
-					app.logger.debug("Upload filename of " + upload_uri_as_str + " does not exist, ignoring")
-					## It doesn't exist so lets continue to upload
-				except Exception as ex:
-					app.logger.error("Exception when uploading a file: " + str(type(ex)) + ": " + str(ex) + traceback.format_exc())
-					ret.append({'name' : ufile.filename, 'error': 'Failed to stat existing file: ' + str(ex)})
-					continue
-
-				byterange_start = 0
-				if 'Content-Range' in request.headers:
-					byterange_start = int(request.headers['Content-Range'].split(' ')[1].split('-')[0])
-					app.logger.debug("Chunked file upload request: Content-Range sent with byte range start of " + str(byterange_start) + " with filename " + filename)
-
-				## Actual upload
-				try:
-					# Check if we're writing from the start of the file
-					if byterange_start == 0:
-						## We're truncating an existing file, or creating a new file
-						## If the file already exists, check to see if we should overwrite
-						if fstat is not None:
-							if not bargate.lib.userdata.get_overwrite_on_upload():
-								ret.append({'name' : ufile.filename, 'error': 'File already exists. You can enable overwriting files in Settings.'})
-								continue
-
-							## Now ensure we're not trying to upload a file on top of a directory (can't do that!)
-							itemType = bargate.lib.smb.getEntryType(libsmbclient,upload_uri_as_str)
-							if itemType == bargate.lib.smb.SMB_DIR:
-								ret.append({'name' : ufile.filename, 'error': "That name already exists and is a directory"})
-								continue
-
-						## Open the file for the first time, truncating or creating it if necessary
-						app.logger.debug("Opening for writing with O_CREAT and TRUNC")
-						wfile = libsmbclient.open(upload_uri_as_str,os.O_CREAT | os.O_TRUNC | os.O_WRONLY)
-					else:
-						## Open the file and seek to where we are going to write the additional data
-						app.logger.debug("Opening for writing with O_WRONLY")
-						wfile = libsmbclient.open(upload_uri_as_str,os.O_WRONLY)
-						wfile.seek(byterange_start)
-
-					while True:
-						buff = ufile.read(io.DEFAULT_BUFFER_SIZE)
-						if not buff:
-							break
-						wfile.write(buff)
+			## The directory contents have changed
+			bargate.lib.smb.invalidate_listing(uri_as_str)
 
-					wfile.close()
-					ret.append({'name' : ufile.filename})
-
-				except Exception as ex:
-					app.logger.error("Exception when uploading a file: " + str(type(ex)) + ": " + str(ex) + traceback.format_exc())
-					ret.append({'name' : ufile.filename, 'error': 'Could not upload file: ' + str(ex)})
-					continue
-					
 			return jsonify({'files': ret})
 
 ################################################################################
@@ -902,6 +1742,10 @@ def connection(srv_path,func_name,active=None,display_name="Home",action='browse
 			except Exception as ex:
 				return bargate.lib.errors.smbc_handler(ex,uri,error_redirect)
 			else:
+				bargate.lib.smb.invalidate_listing(parent_uri_as_str)
+				bargate.lib.smb.invalidate_listing(uri_as_str,recursive=True)
+				bargate.lib.smb.invalidate_listing(new_uri_as_str,recursive=True)
+
 				flash(typemsg + " '" + entryname + "' was renamed to '" + request.form['newfilename'] + "' successfully.",'alert-success')
 				return parent_redirect
 
@@ -952,29 +1796,31 @@ def connection(srv_path,func_name,active=None,display_name="Home",action='browse
 			except Exception as ex:
 				return bargate.lib.errors.smbc_handler(ex,uri,error_redirect)
 
-			## Assuming we got here without an exception, open the source file
-			try:		
-				source_fh = libsmbclient.open(uri_as_str)
-			except Exception as ex:
-				return bargate.lib.errors.smbc_handler(ex,uri,error_redirect)
-
-			## Assuming we got here without an exception, open the dest file
-			try:		
-				dest_fh = libsmbclient.open(dest, os.O_CREAT | os.O_WRONLY | os.O_TRUNC )
-
+			## Open the source and destination files and start copying in the background
+			try:
+				job = bargate.lib.copyjob.CopyJob(
+					bargate.lib.pool.context_key(session['username'],srv_path),
+					app.config['SMB_WORKGROUP'],
+					session['username'],
+					bargate.lib.user.get_password(),
+					uri_as_str,
+					dest,
+					source_size,
+					lambda: bargate.lib.smb.invalidate_listing(parent_uri_as_str))
 			except Exception as ex:
 				return bargate.lib.errors.smbc_handler(ex,srv_path + dest,error_redirect)
+			finally:
+				bargate.lib.smb.invalidate_listing(parent_uri_as_str)
 
-			## try reading then writing blocks of data, then redirect!
-			try:
-				location = 0
-				while(location >= 0 and location < source_size):
-					chunk = source_fh.read(1024)
-					dest_fh.write(chunk)
-					location = source_fh.seek(1024,location)
+			job.start()
 
-			except Exception as ex:
-				return bargate.lib.errors.smbc_handler(ex,srv_path + dest,error_redirect)
+			## Wait for small copies to finish so we can report success or failure
+			if not job.wait(app.config['COPY_WAIT']):
+				flash('A copy of "' + entryname + '" is being created as "' + dest_filename + '". ' + str(job.copied) + ' of ' + str(source_size) + ' bytes have been copied so far, the copy will continue in the background.','alert-info')
+				return parent_redirect
+
+			if job.error is not None:
+				return bargate.lib.errors.stderr("Copy failed","The file could not be copied: " + job.error,error_redirect)
 
 			flash('A copy of "' + entryname + '" was created as "' + dest_filename + '"','alert-success')
 			return parent_redirect
@@ -997,6 +1843,7 @@ def connection(srv_path,func_name,active=None,display_name="Home",action='browse
 			except Exception as ex:
 				return bargate.lib.errors.smbc_handler(ex,uri,error_redirect)
 			else:
+				bargate.lib.smb.invalidate_listing(uri_as_str)
 				flash("The folder '" + request.form['directory_name'] + "' was created successfully.",'alert-success')
 				return redirect(url_for(func_name,path=path))
 
@@ -1016,6 +1863,7 @@ def connection(srv_path,func_name,active=None,display_name="Home",action='browse
 				except Exception as ex:
 					return bargate.lib.errors.smbc_handler(ex,uri,error_redirect)
 				else:
+					bargate.lib.smb.invalidate_listing(parent_uri_as_str)
 					flash("The file '" + entryname + "' was deleted successfully.",'alert-success')
 					return parent_redirect
 
@@ -1025,6 +1873,8 @@ def connection(srv_path,func_name,active=None,display_name="Home",action='browse
 				except Exception as ex:
 					return bargate.lib.errors.smbc_handler(ex,uri,error_redirect)
 				else:
+					bargate.lib.smb.invalidate_listing(parent_uri_as_str)
+					bargate.lib.smb.invalidate_listing(uri_as_str,recursive=True)
 					flash("The directory '" + entryname + "' was deleted successfully.",'alert-success')
 					return parent_redirect
 			else:
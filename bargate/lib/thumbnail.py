@@ -0,0 +1,541 @@
+#!/usr/bin/python
+#
+# This file is part of Bargate.
+#
+# Bargate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bargate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bargate.  If not, see <http://www.gnu.org/licenses/>.
+
+## thumbnail.py
+# Creates the thumbnails shown by the 'preview' action and caches them on
+# local disk, so that opening a folder of photos again doesn't mean reading
+# every image from the file server again. Thumbnails are keyed by the file's
+# URI, size and modify time, so a changed file gets a new thumbnail. The cache
+# is shared between users, so callers must open the file with the user's own
+# credentials before taking anything from it: a stat() only needs the right to
+# list the directory, not to read the file. bargate.lib.smb.renderEntry does
+# this for the preview, previews, render and prewarm paths.
+
+from bargate import app
+import bargate.lib.core
+from PIL import Image
+import StringIO
+import hashlib
+import os
+import threading
+import uuid
+import resource
+import struct
+
+################################################################################
+
+## Limits how many images each worker process decodes at once, as decoding
+## large images uses a lot of memory
+decode_slots = threading.BoundedSemaphore(max(1,app.config['IMAGE_PREVIEW_CONCURRENCY']))
+
+## How much of the start of a file to read looking for an EXIF thumbnail
+EXIF_HEADER_SIZE = 64 * 1024
+
+## File types which may have an embedded EXIF thumbnail
+EXIF_TYPES = ['image/jpeg', 'image/tiff', 'image/x-tiff']
+
+## The formats thumbnails can be sent in, and their mimetypes
+FORMATS = {'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+
+def get_size(name):
+	"""Returns the size in pixels of the thumbnail size called 'name' (e.g.
+	'small'), or raises ValueError"""
+
+	if name not in app.config['IMAGE_PREVIEW_SIZES']:
+		raise ValueError('Unknown preview size')
+
+	return app.config['IMAGE_PREVIEW_SIZES'][name]
+
+def webp_supported():
+	"""Returns True if the installed Pillow can write WebP images"""
+
+	Image.init()
+	return 'WEBP' in Image.SAVE
+
+def negotiate_format(accept_mimetypes):
+	"""Returns the thumbnail format to send given the request's Accept header.
+	WebP is only sent to browsers which explicitly list it, as many browsers
+	which can't display it send image/* or */*."""
+
+	if app.config['IMAGE_PREVIEW_WEBP'] and webp_supported():
+		for (value, quality) in accept_mimetypes:
+			if value == 'image/webp' and quality > 0:
+				return 'webp'
+
+	return 'jpeg'
+
+def get_view_size(width,height):
+	"""Returns the (width, height) box a 'view' rendition for a screen of
+	width x height pixels should fit in. Each is rounded up to one of
+	IMAGE_VIEW_SIZES so that renditions for similar screens are shared."""
+
+	sizes = sorted(app.config['IMAGE_VIEW_SIZES'])
+
+	def snap(pixels):
+		for size in sizes:
+			if size >= pixels:
+				return size
+		return sizes[-1]
+
+	return (snap(width), snap(height))
+
+def variant_key(uri_as_str,fsize,mtime,size,fmt):
+	"""Returns the cache key of the variant of a file's thumbnail which fits
+	in size (a (width, height) tuple) in format fmt. Files are identified by
+	their URI, size and modify time so a changed file gets new thumbnails."""
+
+	return cache.key(uri_as_str,fsize,mtime,'%dx%d' % size,fmt)
+
+def create(file_object,mtype,size=(200,200),fmt='jpeg'):
+	"""Reads an image from an open pysmbc file object and returns a thumbnail
+	of it which fits in size (a (width, height) tuple), as a str in the format
+	fmt (see FORMATS). For JPEG and TIFF files the start of the file is checked
+	for an embedded EXIF thumbnail first, and if there is a usable one the rest
+	of the file isn't read at all."""
+
+	with decode_slots:
+		if app.config['IMAGE_PREVIEW_EXIF'] and mtype in EXIF_TYPES:
+			## Don't blow up small embedded thumbnails into large previews
+			min_size = max(app.config['IMAGE_PREVIEW_EXIF_MIN_SIZE'],max(size) // 2)
+			pil_img  = exif_thumbnail(file_object.read(EXIF_HEADER_SIZE),min_size)
+
+			if pil_img is not None:
+				pil_img.thumbnail(size, Image.ANTIALIAS)
+				return save(pil_img.convert('RGB'),fmt)
+
+			file_object.seek(0)
+
+		## Read the file into memory first (hence a file size limit) because PIL/Pillow tries readline()
+		## on pysmbc's File like objects which it doesn't support
+		sfile   = StringIO.StringIO(file_object.read())
+		pil_img = Image.open(sfile)
+
+		## Ask the decoder for a reduced size image if it can (JPEG can decode
+		## at 1/2, 1/4 or 1/8 scale), so the full size image is never in memory.
+		## Other formats ignore this and are decoded at full size.
+		pil_img.draft('RGB',size)
+
+		## Shrink the image before converting it, so the conversion doesn't copy
+		## the full size image. Resizing needs a 'normal' mode.
+		if pil_img.mode not in ['RGB','RGBA','L']:
+			pil_img = pil_img.convert('RGB')
+
+		decoded = pil_img.size
+		pil_img.thumbnail(size, Image.ANTIALIAS)
+		pil_img = pil_img.convert('RGB')
+
+		## Roughly how much memory this preview needed: the file, plus the image
+		## as decoded (up to 4 bytes per pixel)
+		if app.config['IMAGE_PREVIEW_LOG_MEMORY']:
+			peak = sfile.len + (decoded[0] * decoded[1] * 4)
+			app.logger.info("Image preview decoded " + str(sfile.len) + " bytes at " + str(decoded[0]) + "x" + str(decoded[1]) + " using about " + str(peak / 1024) + "KB, worker peak RSS " + str(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss) + "KB")
+
+		sfile.close()
+
+	return save(pil_img,fmt)
+
+def save(pil_img,fmt='jpeg'):
+	"""Returns an image as a JPEG or WebP file (a str)"""
+
+	img_io = StringIO.StringIO()
+
+	if fmt == 'webp':
+		pil_img.save(img_io, 'WEBP', quality=app.config['IMAGE_PREVIEW_WEBP_QUALITY'])
+	else:
+		pil_img.save(img_io, 'JPEG', quality=85)
+
+	return img_io.getvalue()
+
+################################################################################
+
+def exif_thumbnail(header,min_size):
+	"""Returns the thumbnail embedded in the EXIF data of a JPEG or TIFF file as
+	a Pillow image, given the first bytes of the file. Returns None if there
+	isn't one within 'header', if it is smaller than min_size pixels on its
+	longest side or if it is letterboxed (its aspect ratio doesn't match the
+	image's)."""
+
+	try:
+		found = _exif_thumbnail(header)
+	except struct.error as ex:
+		return None
+
+	if found is None:
+		return None
+
+	(data, image_size) = found
+
+	try:
+		pil_img = Image.open(StringIO.StringIO(data))
+		pil_img.load()
+	except Exception as ex:
+		return None
+
+	(width, height) = pil_img.size
+	if max(width,height) < min_size or width == 0 or height == 0:
+		return None
+
+	## Some cameras pad the thumbnail with black bars to 4:3
+	if image_size is not None and image_size[0] > 0 and image_size[1] > 0:
+		image_ratio = float(image_size[0]) / image_size[1]
+		thumb_ratio = float(width) / height
+
+		if abs(thumb_ratio - image_ratio) / image_ratio > 0.05:
+			return None
+
+	return pil_img
+
+def _exif_thumbnail(header):
+	## Returns (jpeg data, (width, height) or None) or None
+
+	if header.startswith('\xff\xd8'):
+		tiff = _jpeg_exif(header)
+	elif header[:4] in ['II*\x00','MM\x00*']:
+		## TIFF files are themselves in the same format as EXIF data
+		tiff = header
+	else:
+		return None
+
+	if tiff is None or tiff[:4] not in ['II*\x00','MM\x00*']:
+		return None
+
+	if tiff.startswith('II'):
+		endian = '<'
+	else:
+		endian = '>'
+
+	(ifd0, next_ifd) = _read_ifd(tiff,endian,struct.unpack(endian + 'I',tiff[4:8])[0])
+	if ifd0 is None or next_ifd == 0:
+		return None
+
+	## The size of the image itself, from the TIFF tags or the EXIF sub-IFD
+	image_size = None
+	if 0x0100 in ifd0 and 0x0101 in ifd0:
+		image_size = (ifd0[0x0100], ifd0[0x0101])
+	elif 0x8769 in ifd0:
+		(exif_ifd, ignored) = _read_ifd(tiff,endian,ifd0[0x8769])
+		if exif_ifd is not None and 0xA002 in exif_ifd and 0xA003 in exif_ifd:
+			image_size = (exif_ifd[0xA002], exif_ifd[0xA003])
+
+	## IFD1 describes the thumbnail
+	(ifd1, ignored) = _read_ifd(tiff,endian,next_ifd)
+	if ifd1 is None or 0x0201 not in ifd1 or 0x0202 not in ifd1:
+		return None
+
+	start  = ifd1[0x0201]
+	length = ifd1[0x0202]
+	data   = tiff[start:start + length]
+
+	if len(data) != length or not data.startswith('\xff\xd8'):
+		return None
+
+	return (data, image_size)
+
+def _jpeg_exif(header):
+	## Returns the TIFF structure from a JPEG's APP1 Exif segment, or None
+
+	pos = 2
+	while pos + 4 <= len(header):
+		if header[pos] != '\xff':
+			return None
+
+		marker = ord(header[pos + 1])
+
+		## Padding, and markers without a length
+		if marker == 0xFF:
+			pos = pos + 1
+			continue
+		if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+			pos = pos + 2
+			continue
+
+		## Start of scan (image data) or end of image: no EXIF
+		if marker == 0xDA or marker == 0xD9:
+			return None
+
+		length = struct.unpack('>H',header[pos + 2:pos + 4])[0]
+
+		if marker == 0xE1 and header[pos + 4:pos + 10] == 'Exif\x00\x00':
+			return header[pos + 10:pos + 2 + length]
+
+		pos = pos + 2 + length
+
+	return None
+
+## The TIFF field types we need: SHORT and LONG
+TIFF_TYPES = {3: ('H',2), 4: ('I',4)}
+
+def _read_ifd(tiff,endian,offset):
+	## Returns ({tag: value}, offset of the next IFD) for the single valued
+	## SHORT and LONG fields of the IFD at offset, or (None, 0)
+
+	if offset < 8 or offset + 2 > len(tiff):
+		return (None, 0)
+
+	count = struct.unpack(endian + 'H',tiff[offset:offset + 2])[0]
+	end   = offset + 2 + (count * 12)
+
+	if end + 4 > len(tiff):
+		return (None, 0)
+
+	fields = {}
+	for i in range(count):
+		entry = tiff[offset + 2 + (i * 12):offset + 14 + (i * 12)]
+		(tag, field_type, field_count) = struct.unpack(endian + 'HHI',entry[0:8])
+
+		if field_count == 1 and field_type in TIFF_TYPES:
+			(fmt, field_size) = TIFF_TYPES[field_type]
+			fields[tag] = struct.unpack(endian + fmt,entry[8:8 + field_size])[0]
+
+	next_ifd = struct.unpack(endian + 'I',tiff[end:end + 4])[0]
+	return (fields, next_ifd)
+
+################################################################################
+
+class Flight(object):
+	"""A thumbnail that is currently being created by one of the threads in
+	this process. Other threads wanting the same thumbnail wait for it."""
+
+	def __init__(self):
+		self.event = threading.Event()
+		self.data  = None
+		self.error = None
+
+################################################################################
+
+class ThumbnailCache(object):
+	"""A cache of thumbnails stored as files in 'directory'. When the files
+	in the cache total more than max_size bytes the least recently used are
+	deleted. Setting max_size to 0 disables the cache (but concurrent
+	requests for the same thumbnail are still only created once). This
+	doesn't check permissions: see the top of this file.
+	"""
+
+	def __init__(self,directory,max_size):
+		self.directory  = directory
+		self.max_size   = max_size
+		self.lock       = threading.Lock()
+		self.evict_lock = threading.Lock()
+		self.inflight   = {}
+
+		## The size of the cache on disk, not known until it has been scanned
+		self.total = None
+
+		## Whether the cache directory is safe to use, not known until it has
+		## been checked
+		self.usable = None
+
+	def key(self,*parts):
+		"""Returns the cache key for a thumbnail, e.g. key(uri, size, mtime, variant...)"""
+
+		return hashlib.sha1('\0'.join([str(part) for part in parts])).hexdigest()
+
+	def _path(self,key):
+		## Spread the files over 256 directories
+		return os.path.join(self.directory,key[:2],key)
+
+	def _ready(self):
+		"""Returns True if the cache is enabled and its directory is one only
+		this user can use (see bargate.lib.core.private_directory)"""
+
+		if self.max_size <= 0:
+			return False
+
+		with self.lock:
+			if self.usable is None:
+				try:
+					bargate.lib.core.private_directory(self.directory)
+					self.usable = True
+				except OSError as ex:
+					app.logger.error("Not caching thumbnails, cannot use " + self.directory + ": " + str(ex))
+					self.usable = False
+
+			return self.usable
+
+	def has(self,key):
+		"""Returns True if there is a cached thumbnail for key"""
+
+		if not self._ready():
+			return False
+
+		return os.path.exists(self._path(key))
+
+	def get(self,key):
+		"""Returns the cached thumbnail for key, or None"""
+
+		if not self._ready():
+			return None
+
+		path = self._path(key)
+
+		try:
+			with open(path,'rb') as f:
+				data = f.read()
+		except (IOError, OSError) as ex:
+			return None
+
+		## Mark the thumbnail as recently used
+		try:
+			os.utime(path,None)
+		except OSError as ex:
+			pass
+
+		return data
+
+	def put(self,key,data):
+		"""Stores a thumbnail in the cache. Errors are logged and ignored."""
+
+		if not self._ready():
+			return
+
+		path = self._path(key)
+		tmp  = path + '.' + uuid.uuid4().hex + '.tmp'
+
+		try:
+			if not os.path.isdir(os.path.dirname(path)):
+				try:
+					os.mkdir(os.path.dirname(path),0700)
+				except OSError as ex:
+					## Another thread or process may have just created it
+					if not os.path.isdir(os.path.dirname(path)):
+						raise
+
+			## Write to a temporary file and rename it so that other processes
+			## never see a partially written thumbnail. Only this user can
+			## read it, and it must be a new file rather than anything put
+			## there by someone else.
+			fd = os.open(tmp,os.O_WRONLY | os.O_CREAT | os.O_EXCL,0600)
+			with os.fdopen(fd,'wb') as f:
+				f.write(data)
+			os.rename(tmp,path)
+
+		except (IOError, OSError) as ex:
+			app.logger.warning("Could not write thumbnail to the cache: " + str(ex))
+
+			try:
+				os.unlink(tmp)
+			except OSError as ex:
+				pass
+
+			return
+
+		with self.lock:
+			if self.total is not None:
+				self.total = self.total + len(data)
+			over = self.total is None or self.total > self.max_size
+
+		if over:
+			self.evict()
+
+	def evict(self):
+		"""Scans the cache directory and deletes the least recently used
+		thumbnails until the cache is below 90% of max_size"""
+
+		## If another thread is already doing this there's no need to wait
+		if not self.evict_lock.acquire(False):
+			return
+
+		try:
+			files = []
+			total = 0
+
+			for (dirpath, dirnames, filenames) in os.walk(self.directory):
+				for filename in filenames:
+					if filename.endswith('.tmp'):
+						continue
+
+					path = os.path.join(dirpath,filename)
+					try:
+						st = os.stat(path)
+					except OSError as ex:
+						continue
+
+					files.append((st.st_mtime,st.st_size,path))
+					total = total + st.st_size
+
+			if total > self.max_size:
+				target = self.max_size * 0.9
+				files.sort()
+
+				for (mtime, size, path) in files:
+					if total <= target:
+						break
+
+					try:
+						os.unlink(path)
+						total = total - size
+					except OSError as ex:
+						pass
+
+			with self.lock:
+				self.total = total
+
+		finally:
+			self.evict_lock.release()
+
+	def get_or_create(self,key,generate):
+		"""Returns the thumbnail for key from the cache, or calls generate()
+		to create it and stores it in the cache. If another thread is already
+		creating the same thumbnail this waits for it rather than creating it
+		again. Exceptions raised by generate() are raised to every caller
+		waiting for that thumbnail."""
+
+		data = self.get(key)
+		if data is not None:
+			return data
+
+		with self.lock:
+			flight = self.inflight.get(key,None)
+			leader = flight is None
+
+			if leader:
+				flight = Flight()
+				self.inflight[key] = flight
+
+		if not leader:
+			flight.event.wait()
+
+			if flight.error is not None:
+				raise flight.error
+
+			return flight.data
+
+		try:
+			## It may have been created since we last looked
+			flight.data = self.get(key)
+
+			if flight.data is None:
+				flight.data = generate()
+				self.put(key,flight.data)
+
+		except Exception as ex:
+			flight.error = ex
+			raise
+
+		finally:
+			with self.lock:
+				del self.inflight[key]
+			flight.event.set()
+
+		return flight.data
+
+################################################################################
+
+if app.config['THUMBNAIL_CACHE']:
+	cache = ThumbnailCache(app.config['THUMBNAIL_CACHE_DIR'],app.config['THUMBNAIL_CACHE_SIZE'])
+else:
+	cache = ThumbnailCache(app.config['THUMBNAIL_CACHE_DIR'],0)
@@ -0,0 +1,228 @@
+#!/usr/bin/python
+#
+# This file is part of Bargate.
+#
+# Bargate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bargate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bargate.  If not, see <http://www.gnu.org/licenses/>.
+
+## upload.py
+# Writes uploaded files straight to the file server as the request body
+# arrives. Normally Werkzeug parses the whole multipart body first, spooling
+# each file into memory or a temporary file on local disk, which we would then
+# read back and write to SMB. Instead the multipart parser is given a stream
+# factory which opens the destination file on the file server as soon as each
+# file part starts, so every uploaded block is written to SMB directly.
+
+from bargate import app
+from flask import request
+from werkzeug.formparser import parse_form_data
+import bargate.lib.core
+import bargate.lib.smb
+import bargate.lib.userdata
+import smbc
+import os
+import urllib
+import traceback
+
+################################################################################
+
+class SMBUploadTarget(object):
+	"""A write-only file-like object which the multipart parser writes an
+	uploaded file into. The data is buffered into UPLOAD_BLOCK_SIZE blocks and
+	written to an open pysmbc file. If wfile is None (the upload was refused)
+	the data is thrown away. Errors are recorded in the upload's result rather
+	than raised so that the rest of the request, and any other files in it,
+	can still be processed.
+	"""
+
+	def __init__(self,wfile,result):
+		self.wfile  = wfile
+		self.result = result
+		self.buffer = []
+		self.length = 0
+
+	def write(self,data):
+		if self.wfile is None:
+			return
+
+		self.buffer.append(data)
+		self.length = self.length + len(data)
+
+		if self.length >= app.config['UPLOAD_BLOCK_SIZE']:
+			self.flush()
+
+	def flush(self):
+		if self.wfile is None or self.length == 0:
+			return
+
+		data        = ''.join(self.buffer)
+		self.buffer = []
+		self.length = 0
+
+		try:
+			self.wfile.write(data)
+		except Exception as ex:
+			self.failed(ex)
+
+	def seek(self,*args):
+		## Werkzeug rewinds the file once it has all been received, ready for
+		## the view to read it. We have already written it, so this is a no-op.
+		pass
+
+	def read(self,*args):
+		return ''
+
+	def close(self):
+		self.flush()
+
+		if self.wfile is not None:
+			try:
+				self.wfile.close()
+			except Exception as ex:
+				self.failed(ex)
+
+			self.wfile = None
+
+	def failed(self,ex):
+		app.logger.error("Exception when uploading a file: " + str(type(ex)) + ": " + str(ex) + traceback.format_exc())
+		self.result['error'] = 'Could not upload file: ' + str(ex)
+
+		## Stop writing, and throw away the rest of the file
+		try:
+			self.wfile.close()
+		except Exception as ex:
+			pass
+
+		self.wfile  = None
+		self.buffer = []
+		self.length = 0
+
+################################################################################
+
+class UploadStreamFactory(object):
+	"""A Werkzeug stream factory which, for each uploaded file in the request,
+	checks the file can be uploaded to the directory uri_as_str and opens it on
+	the file server. The outcome of each upload is recorded in 'results' in
+	the format the jQuery file upload plugin expects.
+	"""
+
+	def __init__(self,libsmbclient,uri_as_str):
+		self.libsmbclient = libsmbclient
+		self.uri_as_str   = uri_as_str
+		self.results      = []
+		self.targets      = []
+
+		## Large files are sent by the browser in chunks, one per request
+		self.byterange_start = 0
+		if 'Content-Range' in request.headers:
+			self.byterange_start = int(request.headers['Content-Range'].split(' ')[1].split('-')[0])
+
+	def __call__(self,total_content_length,content_type,filename=None,content_length=None):
+		if filename is None:
+			filename = ''
+
+		result = {'name' : filename}
+		self.results.append(result)
+
+		target = SMBUploadTarget(self.open(filename,result),result)
+		self.targets.append(target)
+		return target
+
+	def open(self,filename,result):
+		"""Opens filename for writing in the upload directory. Returns the
+		pysmbc file object, or None if the file can't be uploaded (in which
+		case the reason is set in result)"""
+
+		if bargate.lib.core.banned_file(filename):
+			result['error'] = 'Filetype not allowed'
+			return None
+
+		## Make the filename "secure" - see http://flask.pocoo.org/docs/patterns/fileuploads/#uploading-files
+		secure_name = bargate.lib.core.secure_filename(filename)
+		upload_uri_as_str = self.uri_as_str + '/' + urllib.quote(secure_name.encode('utf-8'))
+
+		## Check the new file name is valid
+		try:
+			bargate.lib.smb.check_name(secure_name)
+		except ValueError as e:
+			result['error'] = 'Filename not allowed'
+			return None
+
+		## Check to see if the file exists
+		fstat = None
+		try:
+			fstat = self.libsmbclient.stat(upload_uri_as_str)
+		except smbc.NoEntryError:
+			app.logger.debug("Upload filename of " + upload_uri_as_str + " does not exist, ignoring")
+			## It doesn't exist so lets continue to upload
+		except Exception as ex:
+			app.logger.error("Exception when uploading a file: " + str(type(ex)) + ": " + str(ex) + traceback.format_exc())
+			result['error'] = 'Failed to stat existing file: ' + str(ex)
+			return None
+
+		if self.byterange_start > 0:
+			app.logger.debug("Chunked file upload request: Content-Range sent with byte range start of " + str(self.byterange_start) + " with filename " + secure_name)
+
+		try:
+			# Check if we're writing from the start of the file
+			if self.byterange_start == 0:
+				## We're truncating an existing file, or creating a new file
+				## If the file already exists, check to see if we should overwrite
+				if fstat is not None:
+					if not bargate.lib.userdata.get_overwrite_on_upload():
+						result['error'] = 'File already exists. You can enable overwriting files in Settings.'
+						return None
+
+					## Now ensure we're not trying to upload a file on top of a directory (can't do that!)
+					itemType = bargate.lib.smb.getEntryType(self.libsmbclient,upload_uri_as_str)
+					if itemType == bargate.lib.smb.SMB_DIR:
+						result['error'] = "That name already exists and is a directory"
+						return None
+
+				## Open the file for the first time, truncating or creating it if necessary
+				app.logger.debug("Opening for writing with O_CREAT and TRUNC")
+				return self.libsmbclient.open(upload_uri_as_str,os.O_CREAT | os.O_TRUNC | os.O_WRONLY)
+			else:
+				## Open the file and seek to where we are going to write the additional data
+				app.logger.debug("Opening for writing with O_WRONLY")
+				wfile = self.libsmbclient.open(upload_uri_as_str,os.O_WRONLY)
+				wfile.seek(self.byterange_start)
+				return wfile
+
+		except Exception as ex:
+			app.logger.error("Exception when uploading a file: " + str(type(ex)) + ": " + str(ex) + traceback.format_exc())
+			result['error'] = 'Could not upload file: ' + str(ex)
+			return None
+
+	def close(self):
+		for target in self.targets:
+			target.close()
+
+################################################################################
+
+def upload(libsmbclient,uri_as_str):
+	"""Parses the multipart request body, writing each uploaded file into the
+	directory uri_as_str on the file server as it is received. Returns a list
+	of results, one per file, for the jQuery file upload plugin. The request's
+	form and files must not have been accessed before this is called, as that
+	would consume the request body.
+	"""
+
+	factory = UploadStreamFactory(libsmbclient,uri_as_str)
+
+	try:
+		parse_form_data(request.environ,stream_factory=factory,max_content_length=app.config['MAX_CONTENT_LENGTH'])
+	finally:
+		factory.close()
+
+	return factory.results
@@ -19,6 +19,8 @@ from flask import Flask, request, redirect, session, url_for, abort, flash, g
 from bargate import app
 import bargate.lib.userdata
 import bargate.lib.aes
+import bargate.lib.pool
+import bargate.lib.prewarm
 import os
 import smbc
 import time
@@ -222,6 +224,13 @@ def logout():
 	"""Ends the logged in user's login session. The session remains but it is marked as being not logged in."""
 
 	app.logger.info('User "' + session['username'] + '" logged out from "' + request.remote_addr + '" using ' + request.user_agent.string)
+
+	## Close any pooled connections to file servers for this user
+	bargate.lib.pool.contexts.drop_user(session['username'])
+
+	## Stop creating thumbnails for them in the background
+	bargate.lib.prewarm.prewarmer.cancel(session['username'])
+
 	session.pop('logged_in', None)
 	session.pop('username', None)
 	session.pop('id', None)
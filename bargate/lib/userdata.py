@@ -17,6 +17,7 @@
 
 import bargate
 from bargate import app
+import bargate.lib.redisconn
 from flask import Flask, request, session, redirect, url_for, flash, g, abort, render_template
 import mimetypes
 import os
@@ -28,7 +29,7 @@ import werkzeug
 ################################################################################
 
 def record_user_activity(user_id,expire_minutes=1440):
-	if app.config['REDIS_ENABLED']:
+	if bargate.lib.redisconn.available():
 		now = int(time.time())
 		expires = now + (expire_minutes * 60) + 10
 
@@ -54,63 +55,62 @@ def get_bookmarks():
 	user_bookmark_key  = 'user:' + session['username'] + ':bookmark:'
 	bookmarks          = list()
 
-	if app.config['REDIS_ENABLED'] and 'redis' in g:	
-		if g.redis.exists(user_bookmarks_key):
-			try:
-				user_bookmarks = g.redis.smembers(user_bookmarks_key)
-			except Exception as ex:	
-				app.logger.error('Failed to load bookmarks for ' + session['username'] + ': ' + str(ex))
-				return bookmarks_list
-
-			if user_bookmarks != None:
-				if isinstance(user_bookmarks,set):
-					for bookmark_id in user_bookmarks:
-
+	if bargate.lib.redisconn.available() and 'redis' in g:
+		try:
+			user_bookmarks = g.redis.smembers(user_bookmarks_key)
+		except Exception as ex:
+			app.logger.error('Failed to load bookmarks for ' + session['username'] + ': ' + str(ex))
+			return bookmarks
+
+		if user_bookmarks != None:
+			if isinstance(user_bookmarks,set):
+				for bookmark_id in user_bookmarks:
+
+					try:
+						bookmark = g.redis.hgetall(user_bookmark_key + bookmark_id)
+					except Exception as ex:
+						app.logger.error('Failed to load bookmark ' + bookmark_id + ' for ' + session['username'] + ': ' + str(ex))
+						continue
+
+					if 'version' not in bookmark:
+						## Version 1 bookmark - we link directly from here
+						if 'function' not in bookmark or 'path' not in bookmark:
+							app.logger.error('Failed to load bookmark ' + bookmark_id + ' for ' + session['username'] + ': ', 'function and/or path was not set')
+							continue
+		
 						try:
-							bookmark = g.redis.hgetall(user_bookmark_key + bookmark_id)
-						except Exception as ex:
-							app.logger.error('Failed to load bookmark ' + bookmark_id + ' for ' + session['username'] + ': ' + str(ex))
+							bookmark['url'] = url_for(bookmark['function'],path=bookmark['path'])
+						except werkzeug.routing.BuildError as ex:
+							app.logger.error('Failed to load bookmark ' + bookmark_name + ' for ' + session['username'] + ': Invalid bookmark function: ', str(ex))
 							continue
 
-						if 'version' not in bookmark:
-							## Version 1 bookmark - we link directly from here
-							if 'function' not in bookmark or 'path' not in bookmark:
-								app.logger.error('Failed to load bookmark ' + bookmark_id + ' for ' + session['username'] + ': ', 'function and/or path was not set')
-								continue
-		
-							try:
-								bookmark['url'] = url_for(bookmark['function'],path=bookmark['path'])
-							except werkzeug.routing.BuildError as ex:
-								app.logger.error('Failed to load bookmark ' + bookmark_name + ' for ' + session['username'] + ': Invalid bookmark function: ', str(ex))
-								continue
+						## Version 1 bookmarks stored the name of the bookmark as the ID :(
+						bookmark['name'] = bookmark_id
 
-							## Version 1 bookmarks stored the name of the bookmark as the ID :(
-							bookmark['name'] = bookmark_id
+					else:
+						if bookmark['version'] == '2':
+							## Version 2 bookmark - use a resolver / redirector function
+							if 'name' not in bookmark:
+								app.logger.error('Failed to load bookmark ' + bookmark_id + ' for ' + session['username'] + ': No name set')
+								continue
 
+							bookmark['url'] = url_for('bookmark',bookmark_id=bookmark_id)
 						else:
-							if bookmark['version'] == '2':
-								## Version 2 bookmark - use a resolver / redirector function
-								if 'name' not in bookmark:
-									app.logger.error('Failed to load bookmark ' + bookmark_id + ' for ' + session['username'] + ': No name set')
-									continue
-
-								bookmark['url'] = url_for('bookmark',bookmark_id=bookmark_id)
-							else:
-								app.logger.error('Failed to load bookmark ' + bookmark_id + ' for ' + session['username'] + ': Invalid value for version field')
-								continue
+							app.logger.error('Failed to load bookmark ' + bookmark_id + ' for ' + session['username'] + ': Invalid value for version field')
+							continue
 
-						bookmark['id'] = bookmark_id
-						bookmarks.append(bookmark)
+					bookmark['id'] = bookmark_id
+					bookmarks.append(bookmark)
 
-				else:
-					app.logger.error('Failed to load bookmarks','Invalid redis data type when loading bookmarks set for ' + session['username'])
-			
+			else:
+				app.logger.error('Failed to load bookmarks','Invalid redis data type when loading bookmarks set for ' + session['username'])
+		
 	return bookmarks
 
 ################################################################################
 
 def get_layout():
-	if 'redis' in g:
+	if bargate.lib.redisconn.available() and 'redis' in g:
 		try:
 			layout = g.redis.get('user:' + session['username'] + ':layout')
 			if layout == 'grid':
@@ -129,7 +129,7 @@ def get_layout():
 ################################################################################
 
 def get_theme():
-	if 'redis' in g:
+	if bargate.lib.redisconn.available() and 'redis' in g:
 		try:
 			theme = g.redis.get('user:' + session['username'] + ':theme')
 			if theme != None:
@@ -144,7 +144,7 @@ def get_theme():
 ################################################################################
 
 def get_navbar():
-	if 'redis' in g:
+	if bargate.lib.redisconn.available() and 'redis' in g:
 		try:
 			navbar = g.redis.get('user:' + session['username'] + ':navbar_alt')
 			if navbar != None:
@@ -165,7 +165,7 @@ def get_show_hidden_files():
 		if not hidden_files == None:
 			return hidden_files
 		else:
-			if app.config['REDIS_ENABLED']:
+			if bargate.lib.redisconn.available():
 				try:
 					hidden_files = g.redis.get('user:' + session['username'] + ':hidden_files')
 
@@ -184,7 +184,7 @@ def get_show_hidden_files():
 
 def get_overwrite_on_upload():
 	if 'username' in session:
-		if app.config['REDIS_ENABLED']:
+		if bargate.lib.redisconn.available():
 			try:
 				overwrite_on_upload = g.redis.get('user:' + session['username'] + ':upload_overwrite')
 
@@ -207,7 +207,7 @@ def get_on_file_click():
 		if not on_file_click == None:
 			return on_file_click
 		else:
-			if app.config['REDIS_ENABLED']:
+			if bargate.lib.redisconn.available():
 				try:
 					on_file_click = g.redis.get('user:' + session['username'] + ':on_file_click')
 
@@ -227,7 +227,7 @@ def get_on_file_click():
 ################################################################################
 
 def get_online_users(minutes=15):
-	if app.config['REDIS_ENABLED']:
+	if bargate.lib.redisconn.available():
 		if minutes > 86400:
 		    minutes = 86400
 		current = int(time.time()) // 60
@@ -0,0 +1,221 @@
+#!/usr/bin/python
+#
+# This file is part of Bargate.
+#
+# Bargate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bargate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bargate.  If not, see <http://www.gnu.org/licenses/>.
+
+## zipstream.py
+# Writes ZIP archives as a stream of blocks, so that an archive can be sent to
+# the client while it is being created. Python's zipfile module needs to seek
+# back to update each local file header, which we can't do to an HTTP response,
+# so each entry's CRC and sizes are instead sent in a data descriptor after
+# its data (general purpose flag bit 3). Entries and archives larger than 2GB
+# use the ZIP64 extensions.
+
+import struct
+import time
+import zlib
+
+## Entries (and offsets) at least this large use ZIP64. This is lower than the
+## 4GB limit of the ZIP format so that deflated data larger than its source
+## can't overflow.
+ZIP64_LIMIT = (1 << 31) - 1
+
+ZIP_STORED   = 0
+ZIP_DEFLATED = 8
+
+## General purpose flags: sizes in a data descriptor, and UTF-8 file names
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8            = 0x800
+
+## MS-DOS directory attribute
+DOS_ATTR_DIRECTORY = 0x10
+
+################################################################################
+
+def dos_datetime(mtime):
+	"""Converts a UNIX timestamp to the (time, date) pair used in ZIP headers"""
+
+	t = time.localtime(mtime)
+
+	## The DOS date format starts in 1980
+	if t.tm_year < 1980:
+		return (0, (1 << 5) | 1)
+
+	dostime = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+	dosdate = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+	return (dostime, dosdate)
+
+################################################################################
+
+class ZipEntry(object):
+	"""The details of an entry already written, needed for the central directory"""
+
+	def __init__(self,name,method,flags,dostime,dosdate,offset,external_attr):
+		self.name          = name
+		self.method        = method
+		self.flags         = flags
+		self.dostime       = dostime
+		self.dosdate       = dosdate
+		self.offset        = offset
+		self.external_attr = external_attr
+		self.crc           = 0
+		self.compressed    = 0
+		self.uncompressed  = 0
+		self.zip64         = False
+
+################################################################################
+
+class ZipStream(object):
+	"""Creates a ZIP archive as a sequence of str blocks. Call add_dir() and
+	add_file() for each entry and then finish(); each returns a generator of
+	the blocks to send. Only the central directory entries are kept in memory,
+	file data is compressed and sent as it is read.
+	"""
+
+	def __init__(self,compress_level=6):
+		self.compress_level = compress_level
+		self.offset         = 0
+		self.entries        = []
+
+	def _emit(self,data):
+		self.offset = self.offset + len(data)
+		return data
+
+	def _local_header(self,entry):
+		if entry.zip64:
+			## The real sizes follow in the data descriptor
+			extra   = struct.pack('<HHQQ',0x0001,16,0,0)
+			size    = 0xFFFFFFFF
+			version = 45
+		else:
+			extra   = ''
+			size    = 0
+			version = 20
+
+		return struct.pack('<IHHHHHIIIHH',0x04034b50,version,entry.flags,entry.method,
+			entry.dostime,entry.dosdate,0,size,size,len(entry.name),len(extra)) + entry.name + extra
+
+	def add_dir(self,name,mtime):
+		"""Adds an (empty) directory entry called name (a unicode object)"""
+
+		name = name.encode('utf-8')
+		if not name.endswith('/'):
+			name = name + '/'
+
+		(dostime, dosdate) = dos_datetime(mtime)
+		entry = ZipEntry(name,ZIP_STORED,FLAG_UTF8,dostime,dosdate,self.offset,DOS_ATTR_DIRECTORY)
+		self.entries.append(entry)
+
+		yield self._emit(self._local_header(entry))
+
+	def add_file(self,name,mtime,size,blocks,compress=True):
+		"""Adds a file called name (a unicode object) of approximately size bytes
+		whose data is produced by the iterable 'blocks'. If compress is False
+		the data is stored rather than deflated (e.g. it is already compressed
+		media)."""
+
+		name = name.encode('utf-8')
+
+		if compress:
+			method = ZIP_DEFLATED
+		else:
+			method = ZIP_STORED
+
+		(dostime, dosdate) = dos_datetime(mtime)
+		entry       = ZipEntry(name,method,FLAG_DATA_DESCRIPTOR | FLAG_UTF8,dostime,dosdate,self.offset,0)
+		entry.zip64 = size is None or size >= ZIP64_LIMIT
+		self.entries.append(entry)
+
+		yield self._emit(self._local_header(entry))
+
+		crc = 0
+		if compress:
+			compressor = zlib.compressobj(self.compress_level,zlib.DEFLATED,-15)
+
+		for block in blocks:
+			crc = zlib.crc32(block,crc)
+			entry.uncompressed = entry.uncompressed + len(block)
+
+			if compress:
+				block = compressor.compress(block)
+				if not block:
+					continue
+
+			entry.compressed = entry.compressed + len(block)
+			yield self._emit(block)
+
+		if compress:
+			block = compressor.flush()
+			entry.compressed = entry.compressed + len(block)
+			yield self._emit(block)
+
+		entry.crc = crc & 0xFFFFFFFF
+
+		if entry.zip64:
+			yield self._emit(struct.pack('<IIQQ',0x08074b50,entry.crc,entry.compressed,entry.uncompressed))
+		else:
+			yield self._emit(struct.pack('<IIII',0x08074b50,entry.crc,entry.compressed,entry.uncompressed))
+
+	def finish(self):
+		"""Writes the central directory, which ends the archive"""
+
+		cd_offset = self.offset
+
+		for entry in self.entries:
+			extra        = []
+			compressed   = entry.compressed
+			uncompressed = entry.uncompressed
+			offset       = entry.offset
+
+			## ZIP64 values go in the extra field in this order
+			if uncompressed >= ZIP64_LIMIT:
+				extra.append(uncompressed)
+				uncompressed = 0xFFFFFFFF
+			if compressed >= ZIP64_LIMIT:
+				extra.append(compressed)
+				compressed = 0xFFFFFFFF
+			if offset >= ZIP64_LIMIT:
+				extra.append(offset)
+				offset = 0xFFFFFFFF
+
+			if len(extra) > 0 or entry.zip64:
+				version = 45
+			else:
+				version = 20
+
+			if len(extra) > 0:
+				extra = struct.pack('<HH',0x0001,8 * len(extra)) + struct.pack('<' + 'Q' * len(extra),*extra)
+			else:
+				extra = ''
+
+			yield self._emit(struct.pack('<IHHHHHHIIIHHHHHII',0x02014b50,version,version,entry.flags,
+				entry.method,entry.dostime,entry.dosdate,entry.crc,compressed,uncompressed,
+				len(entry.name),len(extra),0,0,0,entry.external_attr,offset) + entry.name + extra)
+
+		cd_size  = self.offset - cd_offset
+		count    = len(self.entries)
+
+		if count >= 0xFFFF or cd_size >= ZIP64_LIMIT or cd_offset >= ZIP64_LIMIT:
+			zip64_eocd_offset = self.offset
+
+			## ZIP64 end of central directory record, and its locator
+			yield self._emit(struct.pack('<IQHHIIQQQQ',0x06064b50,44,45,45,0,0,count,count,cd_size,cd_offset))
+			yield self._emit(struct.pack('<IIQI',0x07064b50,0,zip64_eocd_offset,1))
+
+			count     = min(count,0xFFFF)
+			cd_size   = min(cd_size,0xFFFFFFFF)
+			cd_offset = 0xFFFFFFFF
+
+		yield self._emit(struct.pack('<IHHHHIIH',0x06054b50,0,0,count,count,cd_size,cd_offset,0))
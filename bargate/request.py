@@ -21,10 +21,14 @@
 # functions in here register per-request functionality
 # with decorators
 
-from flask import Flask, request, session, g, abort, render_template, url_for
+from flask import Flask, request, session, g, abort, render_template, url_for, flash
 from bargate import app
 import bargate.lib.userdata
 import bargate.lib.errors
+import bargate.lib.smb
+import bargate.lib.index
+import bargate.lib.redisconn
+import bargate.lib.copyjob
 import redis
 import time
 
@@ -32,9 +36,10 @@ import time
 
 @app.before_request
 def before_request():
-	"""This function is run before the request is handled by Flask. It connects 
-	connects to REDIS, logs the user access time and asks IE users using version
-	10 or lower to upgrade their web browser.
+	"""This function is run before the request is handled by Flask. It sets up
+	the REDIS client, logs the user access time, tells the user about any of
+	their background copies which failed and asks IE users using version 10 or
+	lower to upgrade their web browser.
 	"""
 
 	# Check bargate started correctly
@@ -45,18 +50,40 @@ def before_request():
 	if (request.user_agent.browser == "msie" and int(round(float(request.user_agent.version))) <= 10):
 		return render_template('foad.html')
 
-	## Connect to redis
+	## Use the worker's shared redis client. Nothing is sent to redis here:
+	## if it is down the circuit breaker notices and Bargate carries on
+	## without it (see bargate.lib.redisconn)
 	if app.config['REDIS_ENABLED']:
+		g.redis = bargate.lib.redisconn.client
+
+	## Start crawling the shares for the filename index
+	if app.config['INDEX_ENABLED']:
+		bargate.lib.index.crawler.start()
+
+	## Log user last access time, unless redis is down
+	if 'username' in session and bargate.lib.redisconn.available():
 		try:
-			g.redis = redis.StrictRedis(host=app.config['REDIS_HOST'], port=app.config['REDIS_PORT'], db=0)
-			g.redis.get('foo')
-		except Exception as ex:
-			return bargate.lib.errors.fatalerr(message='Bargate could not connect to the REDIS server',debug=str(ex))
-			
-	## Log user last access time
+			bargate.lib.userdata.save('last',str(time.time()))
+			bargate.lib.userdata.record_user_activity(session['username'])
+		except redis.RedisError as ex:
+			app.logger.warning("Could not record user activity: " + str(ex))
+
+	## Tell the user about copies which failed after we stopped waiting
 	if 'username' in session:
-		bargate.lib.userdata.save('last',str(time.time()))
-		bargate.lib.userdata.record_user_activity(session['username'])
+		for message in bargate.lib.copyjob.failures(session['username']):
+			flash(message,'alert-danger')
+
+################################################################################
+
+@app.teardown_request
+def teardown_request(exception):
+	"""This function is run at the end of every request. It returns any SMB
+	connections used during the request to the connection pool. If the request
+	failed with an exception the connections are closed instead as they may
+	be left in an unknown state.
+	"""
+
+	bargate.lib.smb.release_contexts(discard=exception is not None)
 
 ################################################################################
 
@@ -8,7 +8,7 @@ $(document).ready(function($)
 	$('[rel="tooltip"]').on('mouseup', function () {$(this).tooltip('hide');});
 
 	/* allow clickable opens without an <a> */
-	$(".entry-open").click(function()
+	$(document).on('click', '.entry-open', function()
 	{
 		window.document.location = $(this).closest('.entry-click').data('url');
 	});
@@ -1,3 +1,85 @@
+/* called by browse.js when further pages of entries are loaded */
+function browseInsertEntries($dirs, $files)
+{
+	$('#dirs').isotope('insert', $dirs);
+	$('#files').isotope('insert', $files);
+	gridLoadPreviews();
+}
+
+/* image previews are fetched a batch at a time rather than one request each */
+var gridPreviewBatch = 30;
+var gridPreviewLoading = false;
+
+/* use larger previews on high-DPI screens */
+var gridPreviewSize = (window.devicePixelRatio > 1.5) ? 'medium' : 'small';
+
+function gridShowPreview($panel, url)
+{
+	$panel.css('background-image', "url('" + url + "')");
+}
+
+function gridLoadPreviews()
+{
+	if (gridPreviewLoading)
+	{
+		return;
+	}
+
+	var $panels = $('#files .panel-img[data-preview]').not('.preview-requested').slice(0, gridPreviewBatch);
+	if ($panels.length == 0)
+	{
+		return;
+	}
+
+	$panels.addClass('preview-requested');
+	gridPreviewLoading = true;
+
+	var names = $panels.map(function() { return $(this).attr('data-preview-name'); }).get();
+
+	$.ajax({
+		url: $('#files').data('previews'),
+		data: {name: names, size: gridPreviewSize},
+		traditional: true,
+		dataType: 'json'
+	})
+	.done(function(data)
+	{
+		$panels.each(function()
+		{
+			var $panel = $(this);
+			var name = $panel.attr('data-preview-name');
+
+			if (data.previews && data.previews.hasOwnProperty(name))
+			{
+				gridShowPreview($panel, data.previews[name]);
+			}
+			else
+			{
+				/* fall back to fetching this preview by itself */
+				gridShowPreview($panel, $panel.data('preview') + '?size=' + gridPreviewSize);
+			}
+		});
+	})
+	.fail(function()
+	{
+		$panels.each(function()
+		{
+			gridShowPreview($(this), $(this).data('preview') + '?size=' + gridPreviewSize);
+		});
+	})
+	.always(function()
+	{
+		gridPreviewLoading = false;
+		gridLoadPreviews();
+	});
+}
+
+function browseClearEntries()
+{
+	$('#dirs').isotope('remove', $('#dirs').children()).isotope('layout');
+	$('#files').isotope('remove', $('#files').children()).isotope('layout');
+}
+
 $(document).ready(function()
 {
 	var $container = $('#files').isotope(
@@ -24,24 +106,28 @@ $(document).ready(function()
 	/* sort entries in a directory */
 	$('.dir-sortby-name').on( 'click', function()
 	{
+		if (browseHasMore()) browseReload('name', 'asc');
 		$container.isotope({ sortBy: 'name' });
 		$('.sortby-check').addClass('invisible');
 		$('.dir-sortby-name span').removeClass('invisible');
 	});
 	$('.dir-sortby-mtime').on( 'click', function()
 	{
+		if (browseHasMore()) browseReload('mtime', 'desc');
 		$container.isotope({ sortBy: 'mtime' });
 		$('.sortby-check').addClass('invisible');
 		$('.dir-sortby-mtime span').removeClass('invisible');
 	});
 	$('.dir-sortby-type').on( 'click', function()
 	{
+		if (browseHasMore()) browseReload('type', 'asc');
 		$container.isotope({ sortBy: 'type' });
 		$('.sortby-check').addClass('invisible');
 		$('.dir-sortby-type span').removeClass('invisible');
 	});
 	$('.dir-sortby-size').on( 'click', function()
 	{
+		if (browseHasMore()) browseReload('size', 'desc');
 		$container.isotope({ sortBy: 'size' });
 		$('.sortby-check').addClass('invisible');
 		$('.dir-sortby-size span').removeClass('invisible');
@@ -53,4 +139,6 @@ $(document).ready(function()
 		sortBy: 'name',
 	});
 
+	gridLoadPreviews();
+
 });
@@ -1,27 +1,42 @@
+/* called by browse.js when further pages of entries are loaded */
+function browseInsertEntries($dirs, $files)
+{
+	$('#dir').DataTable().rows.add($dirs.add($files)).draw();
+}
+
+function browseClearEntries()
+{
+	$('#dir').DataTable().clear().draw();
+}
+
 $(document).ready(function()
 {
 	/* sort entries in a directory */
 	$('.dir-sortby-name').on( 'click', function()
 	{
+		if (browseHasMore()) browseReload('name', 'asc');
 		$('#dir').DataTable().order([3,'asc']).draw();
 		$('.sortby-check').addClass('invisible');
 		$('.dir-sortby-name span').removeClass('invisible');
 	});
 	$('.dir-sortby-mtime').on( 'click', function()
 	{
-		$('#dir').DataTable().order([4,'asc']).draw();
+		if (browseHasMore()) browseReload('mtime', 'desc');
+		$('#dir').DataTable().order([4,'desc']).draw();
 		$('.sortby-check').addClass('invisible');
 		$('.dir-sortby-mtime span').removeClass('invisible');
 	});
 	$('.dir-sortby-type').on( 'click', function()
 	{
+		if (browseHasMore()) browseReload('type', 'asc');
 		$('#dir').DataTable().order([5,'asc']).draw();
 		$('.sortby-check').addClass('invisible');
 		$('.dir-sortby-type span').removeClass('invisible');
 	});
 	$('.dir-sortby-size').on( 'click', function()
 	{
-		$('#dir').DataTable().order([6,'asc']).draw();
+		if (browseHasMore()) browseReload('size', 'desc');
+		$('#dir').DataTable().order([6,'desc']).draw();
 		$('.sortby-check').addClass('invisible');
 		$('.dir-sortby-size span').removeClass('invisible');
 	});
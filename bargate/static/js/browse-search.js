@@ -1,13 +1,130 @@
-$(document).ready(function()
+/* Streamed searches. Results are sent by the 'searchstream' action as
+	server-sent events as soon as they are found, along with how many folders
+	have been searched so far. Closing the event source (the 'stop' button,
+	or leaving the page) stops the search on the server. If the search runs
+	out of time the 'done' event has the URL to carry it on from, which sends
+	the results found so far again followed by any new ones. */
+var searchSource = null;
+var searchFound = 0;
+
+function searchStatus(data)
+{
+	var text = 'Searched ' + data.dirs + ' folder' + (data.dirs == 1 ? '' : 's') + ', found ' + data.results + ' result' + (data.results == 1 ? '' : 's');
+	$('#search-status').text(text);
+}
+
+function searchFinished(stopped)
 {
-	$('#dir').DataTable( {
-		"paging": false,
-		"searching": false,
-		"info": false,
-		"columns": [
-			{ "orderable": false },
-			{ "orderable": false },
-		],
-		"dom": 'lrtip'
+	if (searchSource)
+	{
+		searchSource.close();
+		searchSource = null;
+	}
+
+	$('#search-spinner').addClass('hidden');
+	$('#search-cancel').addClass('hidden');
+
+	if (stopped)
+	{
+		$('#search-status').append(' (stopped)');
+	}
+
+	if (searchFound == 0)
+	{
+		$('#dir tbody').append('<tr><td colspan="2"><em>No results found</em></td></tr>');
+	}
+}
+
+function searchStream(url)
+{
+	searchFound = 0;
+	$('#dir tbody').empty();
+	$('#search-timeout').addClass('hidden');
+	$('#search-more').addClass('hidden');
+	$('#search-truncated').addClass('hidden');
+	$('#search-spinner').removeClass('hidden');
+	$('#search-cancel').removeClass('hidden');
+	$('#search-status').text('Searching...');
+
+	searchSource = new EventSource(url);
+
+	searchSource.addEventListener('result', function(e)
+	{
+		var data = JSON.parse(e.data);
+		searchFound++;
+		$('#dir tbody').append($($.parseHTML($.trim(data.html))));
+	});
+
+	searchSource.addEventListener('progress', function(e)
+	{
+		searchStatus(JSON.parse(e.data));
 	});
+
+	searchSource.addEventListener('done', function(e)
+	{
+		var data = JSON.parse(e.data);
+		searchStatus(data);
+
+		if (data.timeout_reached)
+		{
+			$('#search-timeout').removeClass('hidden');
+
+			if (data.more)
+			{
+				$('#search-more').attr('data-url', data.more).removeClass('hidden');
+			}
+		}
+
+		if (data.truncated)
+		{
+			$('#search-truncated-count').text(searchFound);
+			$('#search-truncated').removeClass('hidden');
+		}
+
+		searchFinished(false);
+	});
+
+	/* The server closes the connection after 'done', so an error before then
+		means the search failed */
+	searchSource.onerror = function(e)
+	{
+		if (searchSource)
+		{
+			$('#search-status').text('The search failed');
+			searchFinished(false);
+		}
+	};
+}
+
+$(document).ready(function()
+{
+	var url = $('#dir').attr('data-stream');
+
+	if (url)
+	{
+		$('#search-cancel').click(function()
+		{
+			searchFinished(true);
+		});
+
+		$('#search-more').click(function()
+		{
+			searchStream($(this).attr('data-url'));
+		});
+
+		searchStream(url);
+	}
+	else
+	{
+		$('#dir').DataTable( {
+			"paging": false,
+			"searching": false,
+			"info": false,
+			"columns": [
+				{ "orderable": false },
+				{ "orderable": false },
+			],
+			"dom": 'lrtip'
+		});
+	}
 });
@@ -6,6 +6,81 @@ function bytesToString(bytes,decimals)
 	return parseFloat((bytes / Math.pow(1024, i)).toFixed(1)) + ' ' + sizes[i];
 }
 
+/* Paging of large directories. Only the first page of a directory is sent
+	with the page, further pages are fetched from the 'jsonbrowse' action.
+	browseInsertEntries and browseClearEntries are provided by the layout
+	specific javascript (browse-grid.js or browse-list.js) */
+var browseLoading = false;
+var browseGeneration = 0;
+
+function browseHasMore()
+{
+	return $('#browse-more').attr('data-next') ? true : false;
+}
+
+function browseLoadPage(url)
+{
+	if (browseLoading || !url) return;
+
+	browseLoading = true;
+	$('#browse-more-button').button('loading');
+
+	var generation = browseGeneration;
+	$.getJSON(url, function(data)
+	{
+		/* ignore pages requested before the directory was reloaded */
+		if (generation != browseGeneration) return;
+
+		if (data.error == 1)
+		{
+			console.log("WARNING: could not load the next page of entries: " + data.reason);
+			return;
+		}
+
+		var $dirs = $(), $files = $();
+		$.each(data.entries, function(i, entry)
+		{
+			var $entry = $($.parseHTML($.trim(entry.html)));
+			if (entry.type == 'file')
+			{
+				$files = $files.add($entry);
+			}
+			else
+			{
+				$dirs = $dirs.add($entry);
+			}
+		});
+
+		browseInsertEntries($dirs, $files);
+		$dirs.add($files).find('[rel="tooltip"]').tooltip({"delay": { "show": 600, "hide": 100 }, "placement": "bottom", "trigger": "hover"});
+
+		if (data.next)
+		{
+			$('#browse-more').attr('data-next', data.next).removeClass('hidden');
+		}
+		else
+		{
+			$('#browse-more').attr('data-next', '').addClass('hidden');
+		}
+	}).always(function()
+	{
+		if (generation != browseGeneration) return;
+		browseLoading = false;
+		$('#browse-more-button').button('reset');
+	});
+}
+
+/* Reloads the directory from the first page using a server side sort. This is
+	used when not all the entries have been loaded so sorting in the browser
+	would only sort the entries loaded so far. */
+function browseReload(sort, order)
+{
+	browseClearEntries();
+	browseGeneration++;
+	browseLoading = false;
+	browseLoadPage($('#browse-more').attr('data-first') + '?sort=' + sort + '&order=' + order);
+}
+
 /* browse mode (directory listings) javascript */
 $(document).ready(function()
 {
@@ -16,7 +91,7 @@ $(document).ready(function()
 		{
 			return this.each(function ()
 			{
-				$(this).on("contextmenu", function (e)
+				$(this).on("contextmenu", settings.selector, function (e)
 				{
 					if (e.ctrlKey) return;
 
@@ -71,7 +146,7 @@ $(document).ready(function()
 
 	/**************************************************************************/
 	
-	$(".entry-preview").click(function()
+	$(document).on('click', '.entry-preview', function()
 	{
 		var parent = $(this).closest('.entry-click');
 		
@@ -85,7 +160,7 @@ $(document).ready(function()
 		
 		if (parent.attr('data-imgpreview'))
 		{
-			$('#file-click-preview').attr('src',parent.data('imgpreview'));
+			$('#file-click-preview').attr('src',parent.data('imgpreview') + '?size=medium');
 			$('#file-click-preview').removeClass('hidden');
 			$('#file-click-icon').addClass('hidden');
 		}
@@ -152,8 +227,9 @@ $(document).ready(function()
 	});
 
 	/* right click menu for files */
-	$(".entry-file").contextMenu(
+	$('body').contextMenu(
 	{
+		selector: ".entry-file",
 		menuSelector: "#fileContextMenu",
 		menuSelected: function (invokedOn, selectedMenu)
 		{
@@ -222,8 +298,9 @@ $(document).ready(function()
 	});
 
 	/* right click menu for directories */
-	$(".entry-dir").contextMenu(
+	$('body').contextMenu(
 	{
+		selector: ".entry-dir",
 		menuSelector: "#dirContextMenu",
 		menuSelected: function (invokedOn, selectedMenu)
 		{
@@ -234,6 +311,10 @@ $(document).ready(function()
 			{
 				window.document.location = parentRow.data('url');
 			}
+			else if ($action == 'download_zip')
+			{
+				window.document.location = parentRow.data('download-zip');
+			}
 			else if ($action == 'rename')
 			{
 				$('#rename_path').val(parentRow.data('path'));
@@ -290,6 +371,21 @@ $(document).ready(function()
 		}
 	});
 
+	/* Large directories - load further pages when the user scrolls to the
+		bottom of the page or clicks the 'load more' button */
+	$('#browse-more-button').click(function()
+	{
+		browseLoadPage($('#browse-more').attr('data-next'));
+	});
+
+	$(window).scroll(function()
+	{
+		if ($(window).scrollTop() + $(window).height() > $(document).height() - 400)
+		{
+			browseLoadPage($('#browse-more').attr('data-next'));
+		}
+	});
+
 	/* Searching - mark as 'searching' for long page loads */
 	$("#search-form" ).submit(function( event )
 	{
@@ -149,6 +149,22 @@ def csrfp_error(error):
 	
 	return render_template('error.html',title="Security Error",message="Your browser failed to present a valid security token (CSRF protection token).",debug=debug), 400
 
+@app.errorhandler(redis.ConnectionError)
+@app.errorhandler(redis.TimeoutError)
+def redis_error(error):
+	"""Handles REDIS going away during a request. The circuit breaker (see
+	bargate.lib.redisconn) stops later requests from waiting for it, and
+	most of Bargate carries on without it."""
+
+	if app.debug:
+		debug = traceback.format_exc()
+	else:
+		debug = None
+
+	app.logger.warning('Could not talk to redis: ' + str(error))
+
+	return render_template('error.html',title="Temporarily unavailable",message="Bargate could not reach its database, please try again in a few minutes.",debug=debug), 503
+
 ################################################################################
 
 @app.errorhandler(Exception)
@@ -17,7 +17,8 @@
 
 import bargate
 from bargate import app
-from flask import Flask, request, session, redirect, url_for, render_template
+from flask import Flask, request, session, redirect, url_for, render_template, abort, flash, get_template_attribute
+from flask import Response, stream_with_context
 
 ################################################################################
 #### SHARE HANDLER
@@ -26,18 +27,8 @@ from flask import Flask, request, session, redirect, url_for, render_template
 @app.allow_disable
 def share_handler(path, action="browse"):
 
-	## Get the path variable
-	svrpath = app.sharesConfig.get(request.endpoint,'path')
-
-	## Variable substition for username
-	svrpath = svrpath.replace("%USERNAME%",session['username'])
-	svrpath = svrpath.replace("%USER%",session['username'])
-
-	## LDAP home dir substitution support
-	if app.config['LDAP_HOMEDIR']:
-		if 'ldap_homedir' in session:
-			if not session['ldap_homedir'] == None:
-				svrpath = svrpath.replace("%LDAP_HOMEDIR%",session['ldap_homedir'])
+	## Get the path, with the user's details filled in
+	svrpath = bargate.lib.smb.get_share_path(request.endpoint)
 
 	## Get the display name
 	display = app.sharesConfig.get(request.endpoint,'display')
@@ -48,6 +39,81 @@ def share_handler(path, action="browse"):
 	## Run the page!
 	return bargate.lib.smb.connection(svrpath,request.endpoint,menu,display,action,path)
 
+################################################################################
+#### SEARCH ALL SHARES
+
+@app.route('/search')
+@app.login_required
+@app.allow_disable
+def search_all():
+	if not app.config['SEARCH_ENABLED'] or not app.config['SEARCH_ALL_SHARES']:
+		abort(404)
+
+	if 'q' not in request.args:
+		return redirect(url_for(app.config['SHARES_DEFAULT']))
+
+	query = request.args.get('q')
+
+	try:
+		bargate.lib.query.parse(query)
+	except ValueError as ex:
+		return bargate.lib.errors.invalid_search(unicode(ex),redirect(url_for(app.config['SHARES_DEFAULT'])))
+
+	## Streamed searches start once the page has loaded, see search_all_stream
+	if app.config['SEARCH_STREAM']:
+		results    = []
+		url_stream = url_for('search_all_stream',q=query)
+	else:
+		url_stream = None
+		searchEngine = bargate.lib.search.FederatedSearch(bargate.lib.search.search_shares(),query)
+		results, timeout_reached = searchEngine.search()
+
+		if timeout_reached:
+			flash("Some search results have been omitted because the search took too long to perform.","alert-warning")
+
+		if searchEngine.truncated:
+			flash("Only the first " + str(app.config['INDEX_SEARCH_MAX_RESULTS']) + " results from some shares are shown, please narrow down your search.","alert-warning")
+
+	return render_template('search.html',
+		results=results,
+		url_stream=url_stream,
+		query=query,
+		path='',
+		root_display_name='All shares',
+		search_mode=True,
+		search_all=True,
+		url_home=url_for(app.config['SHARES_DEFAULT']),
+		url_search=url_for('search_all'),
+		crumbs=[],
+		on_file_click=bargate.lib.userdata.get_on_file_click())
+
+@app.route('/search/stream')
+@app.login_required
+@app.allow_disable
+def search_all_stream():
+	if not app.config['SEARCH_ENABLED'] or not app.config['SEARCH_ALL_SHARES'] or not app.config['SEARCH_STREAM']:
+		abort(404)
+
+	if 'q' not in request.args:
+		abort(400)
+
+	try:
+		searchEngine = bargate.lib.search.FederatedSearch(bargate.lib.search.search_shares(),request.args.get('q'),app.config['SEARCH_STREAM_TIMEOUT'])
+	except ValueError as ex:
+		abort(400)
+
+	on_file_click = bargate.lib.userdata.get_on_file_click()
+	render_result = get_template_attribute('search-entries.html','result_entry')
+
+	## Each result says which share it was found on
+	events = bargate.lib.search.stream(searchEngine,lambda entry: render_result(entry,on_file_click,entry['share']))
+
+	response = Response(stream_with_context(events),mimetype='text/event-stream')
+	response.headers['Cache-Control'] = 'no-cache'
+	## Stop nginx buffering the events
+	response.headers['X-Accel-Buffering'] = 'no'
+	return response
+
 ################################################################################
 
 @app.route('/other')
@@ -68,12 +134,14 @@ def custom_server():
 
 @app.route('/c', methods=['GET','POST'], defaults={'path': '', 'action': 'browse'})
 @app.route('/c/browse/<path:path>/', methods=['GET','POST'], defaults={'action': 'browse'})
+@app.route('/c/<action>/', methods=['GET','POST'], defaults={'path': ''})
 @app.route('/c/<action>/<path:path>/', methods=['GET','POST'])
 @app.login_required
 @app.allow_disable
 def custom(path,action="browse"):
 
-	if request.method == 'POST':
+	## Uploads are streamed to the file server, so don't parse the form here
+	if request.method == 'POST' and action != 'jsonupload':
 		try:
 			server_uri = request.form['open_server_uri']
 			## validate the path...somehow?
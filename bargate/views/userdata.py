@@ -19,6 +19,7 @@ import bargate
 import bargate.lib.userdata
 import bargate.lib.errors
 import bargate.lib.smb
+import bargate.lib.redisconn
 from bargate import app
 from flask import Flask, request, session, redirect, url_for, flash, g, abort, render_template
 import mimetypes
@@ -40,6 +41,9 @@ def settings():
 	if not app.config['REDIS_ENABLED']:
 		abort(404)
 
+	if not bargate.lib.redisconn.available():
+		return bargate.lib.errors.redis_unavailable()
+
 	themes = []
 	themes.append({'name':'Lumen','value':'lumen'})
 	themes.append({'name':'Cerulean','value':'cerulean'})
@@ -163,6 +167,9 @@ def bookmarks():
 	if not app.config['REDIS_ENABLED']:
 		abort(404)
 
+	if not bargate.lib.redisconn.available():
+		return bargate.lib.errors.redis_unavailable()
+
 	user_bookmarks_key   = 'user:' + session['username'] + ':bookmarks'
 	user_bookmark_prefix = 'user:' + session['username'] + ':bookmark:'
 
@@ -271,6 +278,9 @@ def bookmark(bookmark_id):
 	if not app.config['REDIS_ENABLED']:
 		abort(404)
 
+	if not bargate.lib.redisconn.available():
+		return bargate.lib.errors.redis_unavailable()
+
 	## Prepare the redis key name
 	redis_key = 'user:' + session['username'] + ':bookmark:' + bookmark_id
 
@@ -40,6 +40,6 @@ setup(
 		'pysmbc>=1.0.15.5',
 		'pycrypto>=2.6.1',
 		'Pillow>=3.0',
-		'redis>=2.4',
+		'redis>=2.10',
 	]
 )
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+#
+# This file is part of Bargate.
+#
+# Bargate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bargate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bargate.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from bargate import app
+import bargate.lib.copyjob
+import bargate.lib.pool
+import threading
+import unittest
+
+################################################################################
+
+class FakeFile(object):
+	"""A file whose first read returns 10 bytes and whose second read fails,
+	once 'ready' is set"""
+
+	def __init__(self):
+		self.reads   = 0
+		self.written = []
+		self.closed  = False
+		self.ready   = threading.Event()
+		self.ready.set()
+
+	def seek(self,offset):
+		pass
+
+	def read(self,size):
+		self.reads = self.reads + 1
+		if self.reads > 1:
+			self.ready.wait(5)
+			raise IOError(5,'Input/output error')
+		return 'x' * size
+
+	def write(self,data):
+		self.written.append(data)
+
+	def close(self):
+		self.closed = True
+
+class FakeContext(object):
+	def __init__(self):
+		self.files    = {}
+		self.unlinked = []
+
+	def open(self,uri,flags=0):
+		self.files[uri] = FakeFile()
+		return self.files[uri]
+
+	def unlink(self,uri):
+		self.unlinked.append(uri)
+
+class FakePooledContext(object):
+	def __init__(self,context):
+		self.context = context
+
+class FakePool(object):
+	def __init__(self):
+		self.context = FakeContext()
+
+	def acquire(self,key,workgroup,username,password):
+		return FakePooledContext(self.context)
+
+	def release(self,pctx):
+		pass
+
+################################################################################
+
+class CopyJobTestCase(unittest.TestCase):
+	def setUp(self):
+		self.contexts = bargate.lib.pool.contexts
+		self.config   = dict(app.config)
+
+		bargate.lib.pool.contexts = FakePool()
+		app.config['COPY_BLOCK_SIZE'] = 10
+		app.config['REDIS_ENABLED']   = False
+
+	def tearDown(self):
+		bargate.lib.pool.contexts = self.contexts
+		app.config.clear()
+		app.config.update(self.config)
+
+	def job(self):
+		return bargate.lib.copyjob.CopyJob('key','WORKGROUP','user','password','smb://server/share/a.txt','smb://server/share/b.txt',30)
+
+	def test_failure_removes_destination(self):
+		job = self.job()
+		job.start()
+
+		self.assertTrue(job.wait(5))
+		self.assertTrue(job.error is not None)
+		self.assertEqual(job.copied,10)
+
+		context = bargate.lib.pool.contexts.context
+		self.assertTrue(context.files['smb://server/share/b.txt'].closed)
+		self.assertEqual(context.unlinked,['smb://server/share/b.txt'])
+
+		## The request saw the failure, so there is nothing to tell the user later
+		self.assertEqual(bargate.lib.copyjob.failures('user'),[])
+
+	def test_background_failure_is_reported(self):
+		job    = self.job()
+		source = bargate.lib.pool.contexts.context.files['smb://server/share/a.txt']
+		source.ready.clear()
+		job.start()
+
+		self.assertFalse(job.wait(0))
+		source.ready.set()
+		job.complete.wait(5)
+
+		self.assertEqual(bargate.lib.pool.contexts.context.unlinked,['smb://server/share/b.txt'])
+
+		messages = bargate.lib.copyjob.failures('user')
+		self.assertEqual(len(messages),1)
+		self.assertTrue('b.txt' in messages[0])
+		self.assertEqual(bargate.lib.copyjob.failures('user'),[])
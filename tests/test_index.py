@@ -0,0 +1,83 @@
+#!/usr/bin/python
+#
+# This file is part of Bargate.
+#
+# Bargate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bargate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bargate.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from bargate import app
+import bargate.lib.index
+import smbc
+import stat
+import shutil
+import tempfile
+import unittest
+
+################################################################################
+
+class FakeDentry(object):
+	def __init__(self,name,smbc_type):
+		self.name      = name
+		self.smbc_type = smbc_type
+
+class FakeDir(object):
+	def __init__(self,dentries):
+		self.dentries = dentries
+
+	def getdents(self):
+		return self.dentries
+
+class FakeContext(object):
+	"""A libsmbclient context for a share with one file, report.txt, and
+	one empty directory, Old"""
+
+	def __init__(self,auth_fn=None):
+		self.stats = {
+			'smb://server/share':            (stat.S_IFDIR | 0755, 0, 0, 1, 0, 0, 0, 0, 1500000000, 0),
+			'smb://server/share/report.txt': (stat.S_IFREG | 0644, 0, 0, 1, 0, 0, 1234, 0, 1500000100, 0),
+			'smb://server/share/Old':        (stat.S_IFDIR | 0755, 0, 0, 1, 0, 0, 0, 0, 1500000200, 0),
+		}
+
+	def stat(self,uri):
+		return self.stats[uri]
+
+	def opendir(self,uri):
+		if uri == 'smb://server/share/':
+			return FakeDir([FakeDentry('.',bargate.lib.smb.SMB_DIR),FakeDentry('report.txt',bargate.lib.smb.SMB_FILE),FakeDentry('Old',bargate.lib.smb.SMB_DIR)])
+		return FakeDir([])
+
+################################################################################
+
+class CrawlerTestCase(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.context   = smbc.Context
+		self.index     = bargate.lib.index.FilenameIndex(self.directory)
+
+		smbc.Context = FakeContext
+
+	def tearDown(self):
+		smbc.Context = self.context
+		shutil.rmtree(self.directory)
+
+	def test_crawl_stores_size_and_mtime(self):
+		crawler = bargate.lib.index.Crawler(self.index,3600)
+		crawler.crawl_share('share','smb://server/share/')
+
+		rows = self.index.connect().execute("SELECT name, type, size, mtime FROM entries WHERE share = 'share' AND parent = '' ORDER BY name").fetchall()
+		self.assertEqual(rows,[(u'Old',u'dir',None,1500000200),(u'report.txt',u'file',1234,1500000100)])
+
+		self.assertEqual(self.index.search('share',u'',u'report',10,min_size=1000,after=1500000000),[(u'',u'report.txt',u'file')])
+		self.assertEqual(self.index.search('share',u'',u'report',10,min_size=2000),[])
+		self.assertEqual(self.index.search('share',u'',u'report',10,before=1500000100),[])
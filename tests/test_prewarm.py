@@ -0,0 +1,56 @@
+#!/usr/bin/python
+#
+# This file is part of Bargate.
+#
+# Bargate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bargate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bargate.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from bargate import app
+import bargate.lib.prewarm
+import unittest
+
+################################################################################
+
+class PrewarmerTestCase(unittest.TestCase):
+	def setUp(self):
+		self.prewarmer = bargate.lib.prewarm.Prewarmer(1,10)
+
+		## Don't start the worker threads, the tests take the tasks themselves
+		self.prewarmer.started = True
+		self.prewarmer.add('smb://server/share/','WORKGROUP','user','secret',[('smb://server/share/a.jpg','a.jpg'),('smb://server/share/b.jpg','b.jpg')])
+
+	def tasks(self):
+		tasks = []
+		while not self.prewarmer.queue.empty():
+			tasks.append(self.prewarmer.queue.get_nowait()[2])
+		return tasks
+
+	def test_tasks_have_no_password(self):
+		for task in self.tasks():
+			self.assertFalse(hasattr(task,'password'))
+
+	def test_cancel_forgets_password(self):
+		self.prewarmer.cancel('user')
+		self.assertEqual(self.prewarmer.credentials,{})
+
+		for task in self.tasks():
+			self.assertEqual(self.prewarmer._password(task),None)
+
+	def test_password_forgotten_after_last_task(self):
+		tasks = self.tasks()
+
+		self.assertEqual(self.prewarmer._password(tasks[0]),'secret')
+		self.assertTrue('user' in self.prewarmer.credentials)
+		self.assertEqual(self.prewarmer._password(tasks[1]),'secret')
+		self.assertEqual(self.prewarmer.credentials,{})
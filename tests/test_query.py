@@ -0,0 +1,63 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Bargate.
+#
+# Bargate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bargate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bargate.  If not, see <http://www.gnu.org/licenses/>.
+
+import bargate.lib.query
+import unittest
+
+################################################################################
+
+class ParseTestCase(unittest.TestCase):
+	def test_words(self):
+		query = bargate.lib.query.parse(u'Annual Report')
+		self.assertEqual(query.text,u'annual report')
+		self.assertTrue(query.match_name(u'The annual report.docx','file'))
+
+	def test_apostrophe(self):
+		query = bargate.lib.query.parse(u"John's report")
+		self.assertEqual(query.text,u"john's report")
+		self.assertTrue(query.match_name(u"John's report 2016.docx",'file'))
+
+		query = bargate.lib.query.parse(u"it's Bob's")
+		self.assertEqual(query.text,u"it's bob's")
+
+	def test_inch_mark(self):
+		query = bargate.lib.query.parse(u'5" drive')
+		self.assertEqual(query.text,u'5" drive')
+
+	def test_unclosed_quote(self):
+		query = bargate.lib.query.parse(u'"budget 2016')
+		self.assertEqual(query.text,u'"budget 2016')
+
+	def test_quoted_terms(self):
+		query = bargate.lib.query.parse(u'"annual  report" exclude:"Old Files" ext:pdf')
+		self.assertEqual(query.text,u'annual  report')
+		self.assertTrue(query.match_name(u'Annual  Report.pdf','file'))
+		self.assertFalse(query.descend(u'old files',1))
+		self.assertTrue(query.descend(u'New Files',1))
+
+	def test_quoted_regex(self):
+		query = bargate.lib.query.parse(u"re:'IMG \\d+\\.jpg'")
+		self.assertTrue(query.match_name(u'IMG 0042.jpg','file'))
+		self.assertFalse(query.match_name(u'IMG_0042.jpg','file'))
+
+	def test_utf8(self):
+		query = bargate.lib.query.parse(u'café'.encode('utf-8'))
+		self.assertEqual(query.text,u'café')
+
+	def test_empty(self):
+		self.assertRaises(ValueError,bargate.lib.query.parse,u'   ')
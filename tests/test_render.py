@@ -0,0 +1,111 @@
+#!/usr/bin/python
+#
+# This file is part of Bargate.
+#
+# Bargate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bargate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bargate.  If not, see <http://www.gnu.org/licenses/>.
+
+from bargate import app
+import bargate.lib.smb
+import bargate.lib.thumbnail
+import smbc
+import stat
+import shutil
+import tempfile
+import unittest
+
+################################################################################
+
+class FakeFile(object):
+	def __init__(self):
+		self.closed = False
+
+	def close(self):
+		self.closed = True
+
+class FakeContext(object):
+	"""A libsmbclient context for a user who can list the directory the image
+	is in, and who can read the image only if 'readable' is True"""
+
+	def __init__(self,readable):
+		self.readable = readable
+		self.files    = []
+
+	def stat(self,uri):
+		return (stat.S_IFREG | 0644, 0, 0, 1, 0, 0, 1234, 0, 1500000000, 0)
+
+	def open(self,uri,flags=0):
+		if not self.readable:
+			raise smbc.PermissionError(13,'Permission denied')
+
+		fh = FakeFile()
+		self.files.append(fh)
+		return fh
+
+################################################################################
+
+class RenderEntryTestCase(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.cache     = bargate.lib.thumbnail.cache
+		self.create    = bargate.lib.thumbnail.create
+		self.created   = []
+
+		bargate.lib.thumbnail.cache  = bargate.lib.thumbnail.ThumbnailCache(self.directory,1024 * 1024)
+		bargate.lib.thumbnail.create = self.fake_create
+
+	def tearDown(self):
+		bargate.lib.thumbnail.cache  = self.cache
+		bargate.lib.thumbnail.create = self.create
+		shutil.rmtree(self.directory)
+
+	def fake_create(self,file_object,mtype,size,fmt):
+		self.created.append(file_object)
+		return 'thumbnail'
+
+	def render(self,context):
+		return bargate.lib.smb.renderEntry(context,'smb://server/share/photo.jpg','photo.jpg',(200,200),'jpeg',10 * 1024 * 1024)
+
+	def test_render_creates_and_caches(self):
+		context = FakeContext(True)
+
+		(key, data) = self.render(context)
+		self.assertEqual(data,'thumbnail')
+		self.assertTrue(bargate.lib.thumbnail.cache.has(key))
+
+		## The second time comes from the cache, but the file is still opened
+		self.assertEqual(self.render(context)[1],'thumbnail')
+		self.assertEqual(len(self.created),1)
+		self.assertEqual(len(context.files),2)
+		self.assertTrue(all([fh.closed for fh in context.files]))
+
+	def test_cached_variant_needs_read_access(self):
+		## A user who can read the file puts it in the cache...
+		(key, data) = self.render(FakeContext(True))
+		self.assertTrue(bargate.lib.thumbnail.cache.has(key))
+
+		## ...but a user who can only list the directory doesn't get it
+		self.assertRaises(smbc.PermissionError,self.render,FakeContext(False))
+		self.assertEqual(len(self.created),1)
+
+	def test_too_large(self):
+		self.assertRaises(bargate.lib.smb.TooLargeError,bargate.lib.smb.renderEntry,FakeContext(True),'smb://server/share/photo.jpg','photo.jpg',(200,200),'jpeg',100)
+
+	def test_cached_preview_needs_read_access(self):
+		## The same goes for the previews sent by the preview and previews
+		## actions, and made by the prewarmer
+		(key, data) = bargate.lib.smb.previewEntry(FakeContext(True),'smb://server/share/photo.jpg','photo.jpg','small','jpeg')
+		self.assertTrue(bargate.lib.thumbnail.cache.has(key))
+
+		self.assertRaises(smbc.PermissionError,bargate.lib.smb.previewEntry,FakeContext(False),'smb://server/share/photo.jpg','photo.jpg','small','jpeg')
+		self.assertEqual(len(self.created),1)